@@ -1,7 +1,68 @@
-from django.contrib import admin
+import uuid
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
 from django.contrib.auth.admin import UserAdmin
+from django.db.models import DecimalField, ExpressionWrapper, F, Min
 
 from .models import *
+from .pagination import EstimatedCountPaginator
+from .recompute import deferred_recompute
+
+
+class GasPurchaseActionForm(ActionForm):
+    vehicle = forms.ModelChoiceField(
+        queryset=Car.objects.all(), required=False, label="Car",
+    )
+    odometer_offset = forms.IntegerField(required=False, label="Miles")
+
+
+def _vehicle_ids(queryset):
+    return queryset.order_by().values_list('vehicle', flat=True).distinct()
+
+
+class HistoryAdmin(admin.ModelAdmin):
+    """
+    Admin for a table of every car's history, which may hold millions of
+    rows: searches are exact matches on indexed columns, counts of the whole
+    table are estimated, and every column is loaded with the rows.
+    """
+    list_display_links = (
+        'uuid',
+    )
+    list_filter = (
+        'vehicle',
+    )
+    list_select_related = (
+        'vehicle',
+    )
+    search_fields = (
+        'uuid', 'odometer_reading'
+    )
+    date_hierarchy = 'datetime'
+    ordering = (
+        '-datetime',
+    )
+
+    list_per_page = 25
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        # Substring matches on these columns can only be answered by reading
+        # every row, so only whole values are looked up (with the primary
+        # key and the odometer index).
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        try:
+            return queryset.filter(uuid=uuid.UUID(search_term)), False
+        except ValueError:
+            pass
+        if search_term.isdigit():
+            return queryset.filter(odometer_reading=int(search_term)), False
+        return queryset.none(), False
 
 
 @admin.register(Car)
@@ -12,6 +73,9 @@ class CarAdmin(admin.ModelAdmin):
     list_display_links = (
         'uuid', 'vin'
     )
+    list_select_related = (
+        'owner',
+    )
     search_fields = (
         'uuid', 'vin'
     )
@@ -20,31 +84,94 @@ class CarAdmin(admin.ModelAdmin):
 
 
 @admin.register(GasPurchase)
-class GasPurchaseAdmin(admin.ModelAdmin):
+class GasPurchaseAdmin(HistoryAdmin):
     list_display = (
         'uuid', 'datetime', 'gallons', 'cost_per_gallon', 'odometer_reading',
-        'total_cost', 'vehicle'
+        'total_cost', 'tank_mpg', 'vehicle'
     )
-    list_display_links = (
-        'uuid',
-    )
-    search_fields = (
-        'uuid', 'odometer_reading'
+    list_select_related = (
+        'vehicle', 'tank_segment'
     )
 
-    list_per_page = 25
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            total_cost_value=ExpressionWrapper(
+                F('gallons') * F('cost_per_gallon'),
+                output_field=DecimalField(),
+            ),
+        )
+
+    def total_cost(self, obj):
+        return obj.total_cost_value
+    total_cost.admin_order_field = 'total_cost_value'
+
+    action_form = GasPurchaseActionForm
+    actions = ['move_to_vehicle', 'shift_odometer']
+
+    def delete_queryset(self, request, queryset):
+        with deferred_recompute():
+            super().delete_queryset(request, queryset)
+
+    def action_value(self, request, name):
+        form = self.action_form(request.POST)
+        form.fields['action'].choices = self.get_action_choices(request)
+        form.is_valid()
+        return form.cleaned_data.get(name)
+
+    def move_to_vehicle(self, request, queryset):
+        vehicle = self.action_value(request, 'vehicle')
+        if vehicle is None:
+            self.message_user(request, "Choose a car.", messages.ERROR)
+            return
+        with deferred_recompute() as cars:
+            cars.update(_vehicle_ids(queryset))
+            cars.add(vehicle.pk)
+            count = queryset.update(vehicle=vehicle)
+        self.message_user(request, f"Moved {count} purchases to {vehicle}.")
+    move_to_vehicle.short_description = "Move selected purchases to car"
+
+    def shift_odometer(self, request, queryset):
+        offset = self.action_value(request, 'odometer_offset')
+        if not offset:
+            self.message_user(
+                request, "Enter the miles to shift by.", messages.ERROR,
+            )
+            return
+        lowest = queryset.aggregate(
+            lowest=Min('odometer_reading'),
+        )['lowest']
+        if lowest is not None and lowest + offset < 0:
+            self.message_user(
+                request,
+                "Odometer readings cannot become negative.",
+                messages.ERROR,
+            )
+            return
+        with deferred_recompute() as cars:
+            cars.update(_vehicle_ids(queryset))
+            count = queryset.update(
+                odometer_reading=F('odometer_reading') + offset,
+            )
+        self.message_user(
+            request, f"Shifted {count} purchases by {offset} miles.",
+        )
+    shift_odometer.short_description = "Shift odometer of selected purchases"
 
 
 @admin.register(Maintenance)
-class MaintenanceAdmin(admin.ModelAdmin):
+class MaintenanceAdmin(HistoryAdmin):
     list_display = (
         'uuid', 'datetime', 'vehicle', 'odometer_reading', 'cost'
     )
-    list_display_links = (
-        'uuid',
+
+
+@admin.register(RecomputeJob)
+class RecomputeJobAdmin(admin.ModelAdmin):
+    list_display = (
+        'car', 'requested_at', 'claimed_at'
     )
-    search_fields = (
-        'uuid', 'odometer_reading'
+    list_select_related = (
+        'car',
     )
 
     list_per_page = 25
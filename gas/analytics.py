@@ -0,0 +1,316 @@
+"""
+Monthly and weekly rollups of gas purchases, rolling statistics over a
+car's tank MPG series, and an owner's fleet summary.
+
+Rollups are grouped in the database with a single GROUP BY over the
+purchases and their tank segments. Rolling statistics use NumPy when it is
+installed, with a pure Python fallback that gives the same results.
+"""
+import datetime
+import heapq
+import math
+
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import (
+    SEGMENT_PRECISION,
+    ArchivedGasPurchase,
+    Car,
+    GasPurchase,
+    Maintenance,
+    TankSegment,
+)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+PERIODS = {
+    'month': TruncMonth,
+    'week': TruncWeek,
+}
+
+PERCENTILES = (10, 50, 90)
+
+
+def _ratio(numerator, denominator):
+    if numerator is None or not denominator:
+        return None
+    return (Decimal(numerator) / denominator).quantize(SEGMENT_PRECISION)
+
+
+def _period_totals(purchases, period, limit, segment):
+    # The tank columns are those of each purchase's tank segment, or for
+    # archived purchases, the copies stored with them.
+    rows = purchases.annotate(
+        period=PERIODS[period]('datetime'),
+    ).order_by().values('period').annotate(
+        fill_count=Count('pk'),
+        spend=Sum(
+            F('gallons') * F('cost_per_gallon'),
+            output_field=DecimalField(),
+        ),
+        gallons_total=Sum('gallons'),
+        miles=Sum(f'{segment}miles'),
+        tank_gallons=Sum(f'{segment}gallons'),
+        tank_cost=Sum(
+            F(f'{segment}miles') * F(f'{segment}cost_per_mile'),
+            output_field=DecimalField(),
+        ),
+    ).order_by('-period')
+    if limit is not None:
+        rows = rows[:limit]
+    return rows
+
+
+def _add(a, b):
+    # Sums over no values are None.
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a + b
+
+
+def rollups(purchases, period='month', limit=None, archived=None):
+    """
+    Returns the spend, gallons, average price per gallon, MPG and cost per
+    mile of the given purchases for each period, oldest first. With a limit,
+    only that many of the most recent periods are returned.
+
+    MPG and cost per mile are those of the tanks bought in the period, so a
+    period's most recent fill up does not count towards them until the next
+    one is recorded.
+
+    The archived purchases given (see gas.archive) are rolled up with the
+    rest, in a second query.
+    """
+    totals = {}
+    sources = [(purchases, 'tank_segment__')]
+    if archived is not None:
+        sources.append((archived, 'tank_'))
+    for queryset, segment in sources:
+        for row in _period_totals(queryset, period, limit, segment):
+            start = row.pop('period')
+            if start in totals:
+                # A week can span the start of the archived years.
+                row = {
+                    key: _add(totals[start][key], value)
+                    for key, value in row.items()
+                }
+            totals[start] = row
+    rows = sorted(totals.items(), reverse=True)[:limit]
+
+    return [
+        {
+            'period': period_start.date(),
+            'fill_count': row['fill_count'],
+            'spend': row['spend'],
+            'gallons': row['gallons_total'],
+            'price_per_gallon': _ratio(row['spend'], row['gallons_total']),
+            'miles': row['miles'] or 0,
+            'mpg': _ratio(row['miles'], row['tank_gallons']),
+            'cost_per_mile': _ratio(row['tank_cost'], row['miles']),
+        }
+        for period_start, row in reversed(rows)
+    ]
+
+
+def _percentile(ordered, q):
+    # Linear interpolation between the closest ranks, which is also what
+    # numpy.percentile() does by default.
+    position = (len(ordered) - 1) * q / 100
+    low, high = math.floor(position), math.ceil(position)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def _rolling_python(values, window):
+    means, bands = [], {q: [] for q in PERCENTILES}
+    for end in range(window, len(values) + 1):
+        current = values[end - window:end]
+        means.append(sum(current) / window)
+        ordered = sorted(current)
+        for q in PERCENTILES:
+            bands[q].append(_percentile(ordered, q))
+    return means, bands
+
+
+def _rolling_numpy(values, window):
+    windows = np.lib.stride_tricks.sliding_window_view(
+        np.array(values, dtype=float), window,
+    )
+    percentiles = np.percentile(windows, PERCENTILES, axis=1)
+    return (
+        windows.mean(axis=1).tolist(),
+        {q: band.tolist() for q, band in zip(PERCENTILES, percentiles)},
+    )
+
+
+def rolling_stats(values, window):
+    """
+    Returns the mean and the PERCENTILES of each trailing window of values,
+    as lists aligned with values (starting with None until the first window
+    is full).
+    """
+    values = [float(value) for value in values]
+    if len(values) < window:
+        means, bands = [], {q: [] for q in PERCENTILES}
+    elif np is not None:
+        means, bands = _rolling_numpy(values, window)
+    else:
+        means, bands = _rolling_python(values, window)
+
+    padding = [None] * (len(values) - len(means))
+    stats = {'mean': padding + means}
+    for q in PERCENTILES:
+        stats[f'p{q}'] = padding + bands[q]
+    return stats
+
+
+def mpg_series(car, window=5, archived=True):
+    """
+    Returns the tank MPG of each of a car's fill ups in odometer order, along
+    with the rolling mean and percentile bands over the last window tanks.
+    Its archived fill ups are included unless archived is False.
+    """
+    rows = TankSegment.objects.filter(
+        vehicle=car, mpg__isnull=False,
+    ).order_by('start_odometer').values_list('start_odometer', 'mpg')
+    if archived:
+        rows = heapq.merge(ArchivedGasPurchase.objects.filter(
+            vehicle=car, tank_mpg__isnull=False,
+        ).order_by('odometer_reading').values_list(
+            'odometer_reading', 'tank_mpg',
+        ), rows)
+    rows = list(rows)
+    odometer_readings, mpgs = zip(*rows) if rows else ((), ())
+    return {
+        'odometer_reading': list(odometer_readings),
+        'mpg': [float(mpg) for mpg in mpgs],
+        'window': window,
+        **rolling_stats(mpgs, window),
+    }
+
+
+TRAILING_PERIOD = datetime.timedelta(days=365)
+
+
+def fleet_cars(owner):
+    """
+    Returns an owner's cars with their statistics and last fill up.
+    """
+    last_fill_up = GasPurchase.objects.filter(
+        vehicle=OuterRef('pk'),
+    ).order_by('-datetime')
+    cars = Car.objects.filter(owner=owner).select_related('stats').annotate(
+        last_fill_up=Subquery(last_fill_up.values('datetime')[:1]),
+        last_odometer_reading=Subquery(
+            last_fill_up.values('odometer_reading')[:1],
+        ),
+    ).order_by('-year', 'make', 'model')
+    return list(cars)
+
+
+def trailing_purchases(owner, since):
+    """
+    Returns the spend, miles and gallons of an owner's tanks bought since the
+    given time, by car.
+    """
+    rows = GasPurchase.objects.filter(
+        vehicle__owner=owner, datetime__gte=since,
+    ).order_by().values('vehicle').annotate(
+        spend=Sum(
+            F('gallons') * F('cost_per_gallon'),
+            output_field=DecimalField(),
+        ),
+        miles=Sum('tank_segment__miles'),
+        tank_gallons=Sum('tank_segment__gallons'),
+    )
+    return {row['vehicle']: row for row in rows}
+
+
+def trailing_maintenance(owner, since):
+    """
+    Returns the cost of an owner's maintenances since the given time, by car.
+    """
+    return dict(Maintenance.objects.filter(
+        vehicle__owner=owner, datetime__gte=since,
+    ).order_by().values('vehicle').annotate(
+        cost_total=Sum('cost'),
+    ).values_list('vehicle', 'cost_total'))
+
+
+def fleet_summary(owner, now=None):
+    """
+    Returns lifetime and trailing twelve month costs, MPG and cost per mile
+    for each of an owner's cars, along with the totals for the whole fleet.
+
+    This takes three queries however many cars and purchases there are: the
+    cars with their statistics and last fill up, and the trailing purchases
+    and maintenances grouped by car. They do not depend on each other, so
+    they can also be run separately and passed to summarize_fleet().
+    """
+    since = (now or timezone.now()) - TRAILING_PERIOD
+    return summarize_fleet(
+        fleet_cars(owner),
+        trailing_purchases(owner, since),
+        trailing_maintenance(owner, since),
+    )
+
+
+def summarize_fleet(cars, purchases, maintenance):
+    """
+    Returns the rows and totals of fleet_summary() from the results of
+    fleet_cars(), trailing_purchases() and trailing_maintenance().
+    """
+    rows = []
+    totals = dict.fromkeys([
+        'cost', 'miles', 'gallons',
+        'trailing_cost', 'trailing_miles', 'trailing_gallons',
+    ], 0)
+    for car in cars:
+        stats = car.summary
+        miles = (stats.last_odometer or 0) - (stats.first_odometer or 0)
+        trailing = purchases.get(car.pk, {})
+        trailing_cost = (
+            (trailing.get('spend') or 0) + maintenance.get(car.pk, 0)
+        )
+        trailing_miles = trailing.get('miles') or 0
+        trailing_gallons = trailing.get('tank_gallons') or 0
+        rows.append({
+            'car': car,
+            'last_fill_up': car.last_fill_up,
+            'last_odometer_reading': car.last_odometer_reading,
+            'cost': stats.operating_cost,
+            'mpg': stats.average_mpg,
+            'cost_per_mile': _ratio(stats.operating_cost, miles),
+            'trailing_cost': trailing_cost,
+            'trailing_mpg': _ratio(trailing_miles, trailing_gallons),
+            'trailing_cost_per_mile': _ratio(trailing_cost, trailing_miles),
+        })
+
+        totals['cost'] += stats.operating_cost
+        totals['miles'] += miles
+        # The first fill up only tops off the tank.
+        totals['gallons'] += stats.gallons - (stats.first_gallons or 0)
+        totals['trailing_cost'] += trailing_cost
+        totals['trailing_miles'] += trailing_miles
+        totals['trailing_gallons'] += trailing_gallons
+
+    totals.update({
+        'mpg': _ratio(totals['miles'], totals['gallons']),
+        'cost_per_mile': _ratio(totals['cost'], totals['miles']),
+        'trailing_mpg': _ratio(
+            totals['trailing_miles'], totals['trailing_gallons'],
+        ),
+        'trailing_cost_per_mile': _ratio(
+            totals['trailing_cost'], totals['trailing_miles'],
+        ),
+    })
+    return rows, totals
@@ -0,0 +1,380 @@
+"""
+A read-only JSON API over the requesting user's cars and their histories.
+
+Responses are serialized from values() querysets, selecting only the
+columns behind the fields a client asks for with ?fields=, and lists are
+cursor paginated like the HTML pages. Derived values (tank MPG, average MPG
+and operating cost) come from the precomputed tank segments and car
+statistics, so they cost no more than a join.
+"""
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Value
+from django.http import Http404, JsonResponse
+from django.views import View
+
+from .analytics import PERIODS, mpg_series, rollups
+from .mixins import OwnedCarMixin
+from .models import (
+    ArchivedGasPurchase,
+    ArchivedMaintenance,
+    Car,
+    CarStats,
+    GasPurchase,
+    Maintenance,
+    _average_mpg,
+)
+from .pagination import (
+    MergedCursorPaginator,
+    decode_cursor,
+    ordering_fields,
+)
+
+
+class Field:
+    """
+    A field of an API resource, computed from one or more columns of the
+    resource's values() queryset. Fields without a compute function are the
+    value of their only column, and computed fields are None when any of
+    their columns is, unless compute_nulls is set.
+    """
+
+    def __init__(self, *columns, compute=None, compute_nulls=False):
+        self.columns = columns
+        self.compute = compute
+        self.compute_nulls = compute_nulls
+
+    def value(self, row):
+        values = [row[column] for column in self.columns]
+        if self.compute is None:
+            return values[0]
+        if None in values and not self.compute_nulls:
+            return None
+        return self.compute(*values)
+
+
+def _operating_cost(fuel_cost, maintenance_cost):
+    return fuel_cost + maintenance_cost
+
+
+def _total_cost(gallons, cost_per_gallon):
+    return gallons * cost_per_gallon
+
+
+CAR_FIELDS = {
+    'uuid': Field('uuid'),
+    'make': Field('make'),
+    'model': Field('model'),
+    'year': Field('year'),
+    'purchase_date': Field('purchase_date'),
+    'vin': Field('vin'),
+    'operating_cost': Field(
+        'stats__fuel_cost',
+        'stats__maintenance_cost',
+        compute=_operating_cost,
+    ),
+    'average_mpg': Field(
+        'stats__gallons',
+        'stats__first_gallons',
+        'stats__first_odometer',
+        'stats__last_odometer',
+        # Cars without any fill ups have an average of 0, as on the pages.
+        compute=_average_mpg,
+        compute_nulls=True,
+    ),
+    'fill_count': Field('stats__fill_count'),
+}
+
+GAS_PURCHASE_FIELDS = {
+    'uuid': Field('uuid'),
+    'datetime': Field('datetime'),
+    'odometer_reading': Field('odometer_reading'),
+    'gallons': Field('gallons'),
+    'cost_per_gallon': Field('cost_per_gallon'),
+    'total_cost': Field('gallons', 'cost_per_gallon', compute=_total_cost),
+    'tank_mpg': Field('tank_segment__mpg'),
+}
+
+# Archived purchases have their tank MPG stored with them.
+ARCHIVED_GAS_PURCHASE_FIELDS = {
+    **GAS_PURCHASE_FIELDS,
+    'tank_mpg': Field('tank_mpg'),
+}
+
+MAINTENANCE_FIELDS = {
+    'uuid': Field('uuid'),
+    'datetime': Field('datetime'),
+    'odometer_reading': Field('odometer_reading'),
+    'cost': Field('cost'),
+    'description': Field('description'),
+}
+
+
+def select_fields(requested, fields):
+    """
+    Returns the fields named in a comma separated ?fields= value, or every
+    field when none were requested, raising ValueError for unknown names.
+    """
+    if not requested:
+        return dict(fields)
+
+    names = [name.strip() for name in requested.split(',') if name.strip()]
+    unknown = [name for name in names if name not in fields]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return {name: fields[name] for name in names}
+
+
+class ApiView(LoginRequiredMixin, View):
+    """
+    Base for API views, which answer with the serialized rows of
+    get_queryset() restricted to the fields the client selected.
+    """
+    # Anonymous clients get a 403 rather than a redirect to the login page.
+    raise_exception = True
+    model = None
+    queryset = None
+    fields = None
+
+    def get_queryset(self):
+        if self.queryset is not None:
+            return self.queryset.all()
+        if self.model is not None:
+            return self.model._default_manager.all()
+        raise ImproperlyConfigured(
+            f"{self.__class__.__name__} is missing a queryset. Define "
+            f"{self.__class__.__name__}.model, "
+            f"{self.__class__.__name__}.queryset, or override "
+            f"{self.__class__.__name__}.get_queryset()."
+        )
+
+    def serialize(self, row, fields):
+        return {name: field.value(row) for name, field in fields.items()}
+
+    def columns(self, fields, *extra):
+        columns = dict.fromkeys(extra)
+        for field in fields.values():
+            columns.update(dict.fromkeys(field.columns))
+        return list(columns)
+
+    def parse(self, request):
+        """
+        Reads the options of the request from its query string, raising
+        ValueError with a message for the client when they are invalid.
+        """
+        self.selected_fields = select_fields(
+            request.GET.get('fields'), self.fields,
+        )
+
+    def get(self, request, *args, **kwargs):
+        try:
+            self.parse(request)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        return JsonResponse(self.get_data())
+
+    def get_data(self):
+        fields = self.selected_fields
+        row = self.get_queryset().values(*self.columns(fields)).first()
+        if row is None:
+            raise Http404("No such object.")
+        return self.serialize(row, fields)
+
+
+class ApiListView(ApiView):
+    """
+    ApiView for lists, which are cursor paginated over cursor_ordering.
+    The rows of get_archived_queryset(), if any, are listed along with the
+    rest, serialized with archived_fields (by default, the same fields).
+    """
+    cursor_ordering = None
+    cursor_kwarg = 'cursor'
+    paginate_by = 100
+    archived_fields = None
+
+    def get_archived_queryset(self):
+        return None
+
+    def parse(self, request):
+        super().parse(request)
+        cursor = request.GET.get(self.cursor_kwarg)
+        if cursor:
+            decode_cursor(
+                cursor, ordering_fields(self.model, self.cursor_ordering),
+            )
+
+    def page_url(self, cursor):
+        if cursor is None:
+            return None
+        params = self.request.GET.copy()
+        params[self.cursor_kwarg] = cursor
+        return f'{self.request.path}?{params.urlencode()}'
+
+    def get_data(self):
+        fields = archived_fields = self.selected_fields
+        ordering = [field.lstrip('-') for field in self.cursor_ordering]
+        querysets = [
+            self.get_queryset().values(*self.columns(fields, *ordering)),
+        ]
+        archived = self.get_archived_queryset()
+        if archived is not None:
+            archived_fields = {
+                name: (self.archived_fields or self.fields)[name]
+                for name in fields
+            }
+            querysets.append(archived.values(
+                *self.columns(archived_fields, *ordering),
+                archived=Value(True),
+            ))
+        paginator = MergedCursorPaginator(
+            querysets, self.paginate_by, self.cursor_ordering,
+        )
+        page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        return {
+            'results': [
+                self.serialize(
+                    row, archived_fields if row.get('archived') else fields,
+                )
+                for row in page
+            ],
+            'next': self.page_url(page.next_cursor),
+            'previous': self.page_url(page.previous_cursor),
+        }
+
+
+class CarStatsApiMixin:
+    """
+    Rebuilds the statistics of cars that have none (such as cars created
+    before CarStats existed) as their rows are serialized, as Car.summary
+    does for the pages.
+    """
+    model = Car
+    fields = CAR_FIELDS
+
+    def columns(self, fields, *extra):
+        columns = super().columns(fields, *extra)
+        stats = [column for column in columns if column.startswith('stats__')]
+        if stats:
+            # Only ever NULL for cars without statistics.
+            columns += ['uuid', 'stats__car']
+        return list(dict.fromkeys(columns))
+
+    def serialize(self, row, fields):
+        if 'stats__car' in row and row['stats__car'] is None:
+            stats, = CarStats.objects.rebuild(
+                Car.objects.filter(pk=row['uuid']),
+            )
+            for column in list(row):
+                if column.startswith('stats__') and column != 'stats__car':
+                    row[column] = getattr(stats, column[len('stats__'):])
+        return super().serialize(row, fields)
+
+
+class CarListApiView(CarStatsApiMixin, ApiListView):
+    cursor_ordering = ['-year', 'uuid']
+
+    def get_queryset(self):
+        return super().get_queryset().filter(owner=self.request.user)
+
+
+class CarApiView(CarStatsApiMixin, ApiView):
+    def get_queryset(self):
+        return super().get_queryset().filter(
+            owner=self.request.user, uuid=self.kwargs['uuid'],
+        )
+
+
+class GasPurchaseListApiView(OwnedCarMixin, ApiListView):
+    model = GasPurchase
+    fields = GAS_PURCHASE_FIELDS
+    archived_fields = ARCHIVED_GAS_PURCHASE_FIELDS
+    cursor_ordering = ['-odometer_reading', '-uuid']
+
+    def get_queryset(self):
+        return super().get_queryset().filter(vehicle=self.car)
+
+    def get_archived_queryset(self):
+        if not self.car_has_archive():
+            return None
+        return ArchivedGasPurchase.objects.filter(vehicle=self.car)
+
+
+class MaintenanceListApiView(OwnedCarMixin, ApiListView):
+    model = Maintenance
+    fields = MAINTENANCE_FIELDS
+    cursor_ordering = ['odometer_reading', 'uuid']
+
+    def get_queryset(self):
+        return super().get_queryset().filter(vehicle=self.car)
+
+    def get_archived_queryset(self):
+        if not self.car_has_archive():
+            return None
+        return ArchivedMaintenance.objects.filter(vehicle=self.car)
+
+
+class RollupApiView(ApiView):
+    """
+    Spend, gallons, price per gallon, MPG and cost per mile of the requesting
+    user's gas purchases by ?period= (month or week).
+    """
+
+    def get_purchases(self):
+        return GasPurchase.objects.filter(vehicle__owner=self.request.user)
+
+    def get_archived_purchases(self):
+        return ArchivedGasPurchase.objects.filter(
+            vehicle__owner=self.request.user,
+        )
+
+    def parse(self, request):
+        self.period = request.GET.get('period', 'month')
+        if self.period not in PERIODS:
+            raise ValueError(f"Unknown period: {self.period}")
+
+    def get_data(self):
+        return {
+            'period': self.period,
+            'rollups': rollups(
+                self.get_purchases(),
+                self.period,
+                archived=self.get_archived_purchases(),
+            ),
+        }
+
+
+class CarRollupApiView(OwnedCarMixin, RollupApiView):
+    """
+    RollupApiView for a single car, which also includes its tank MPG series
+    with rolling statistics over the last ?window= tanks.
+    """
+    max_window = 100
+
+    def parse(self, request):
+        try:
+            self.window = int(request.GET.get('window', 5))
+        except ValueError:
+            self.window = 0
+        if not 1 <= self.window <= self.max_window:
+            raise ValueError(
+                f"window must be between 1 and {self.max_window}",
+            )
+        super().parse(request)
+
+    def get_purchases(self):
+        return GasPurchase.objects.filter(vehicle=self.car)
+
+    def get_archived_purchases(self):
+        if not self.car_has_archive():
+            return None
+        return ArchivedGasPurchase.objects.filter(vehicle=self.car)
+
+    def get_mpg_series(self):
+        return mpg_series(
+            self.car, self.window, archived=self.car_has_archive(),
+        )
+
+    def get_data(self):
+        data = super().get_data()
+        data['mpg_series'] = self.get_mpg_series()
+        return data
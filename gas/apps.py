@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class GasConfig(AppConfig):
     name = 'gas'
+    default_auto_field = 'django.db.models.AutoField'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
@@ -0,0 +1,139 @@
+"""
+Moving old history out of the GasPurchase and Maintenance tables, for the
+archive_history command, so that the queries over a car's history made by
+every page no longer pay for all of it.
+
+Whole calendar years are archived at once into ArchivedGasPurchase and
+ArchivedMaintenance, and their totals are rolled into the car's
+ArchivedTotals, which its CarStats are rebuilt from along with the rest of
+its history. Archived gas purchases keep the columns of their tank segment.
+
+Rows left without a car by on_delete=SET_NULL, which no page shows, are
+archived as well, whatever their date.
+"""
+import datetime
+
+from django.utils import timezone
+
+from .models import (
+    ArchivedGasPurchase,
+    ArchivedMaintenance,
+    ArchivedTotals,
+    GasPurchase,
+    Maintenance,
+)
+from .recompute import deferred_recompute
+
+
+# The fields of each archived row, by the column of the live row they are
+# copied from.
+PURCHASE_COLUMNS = {
+    'uuid': 'uuid',
+    'datetime': 'datetime',
+    'gallons': 'gallons',
+    'cost_per_gallon': 'cost_per_gallon',
+    'odometer_reading': 'odometer_reading',
+    'vehicle_id': 'vehicle_id',
+    'tank_miles': 'tank_segment__miles',
+    'tank_gallons': 'tank_segment__gallons',
+    'tank_mpg': 'tank_segment__mpg',
+    'tank_cost_per_mile': 'tank_segment__cost_per_mile',
+}
+
+MAINTENANCE_COLUMNS = {
+    'uuid': 'uuid',
+    'datetime': 'datetime',
+    'cost': 'cost',
+    'odometer_reading': 'odometer_reading',
+    'description': 'description',
+    'vehicle_id': 'vehicle_id',
+}
+
+
+def archive_cutoff(years, now=None):
+    """
+    Returns the start of the calendar year after the last one that ended at
+    least the given number of years ago, in the current time zone, which is
+    what everything archived is dated before.
+
+    Years that ended less than a year ago are never archived, so the
+    trailing twelve months shown on the fleet dashboard and car pages are
+    always in the live tables.
+    """
+    if years < 1:
+        raise ValueError(
+            "Only years that ended at least a year ago can be archived.",
+        )
+    year = timezone.localdate(now).year - years
+    return timezone.make_aware(datetime.datetime(year, 1, 1))
+
+
+def _move(queryset, archive_model, columns, batch_size):
+    """
+    Moves the rows of queryset into archive_model, batch_size at a time,
+    returning how many were moved.
+    """
+    count = 0
+    while True:
+        rows = list(
+            queryset.order_by('pk').values(*columns.values())[:batch_size],
+        )
+        if not rows:
+            return count
+        archive_model.objects.bulk_create([
+            archive_model(**{
+                field: row[column] for field, column in columns.items()
+            })
+            for row in rows
+        ])
+        queryset.filter(pk__in=[row['uuid'] for row in rows]).delete()
+        count += len(rows)
+
+
+def archive_car(car_id, before, batch_size=500):
+    """
+    Archives a car's history dated before the given time in one transaction,
+    returning the numbers of gas purchases and maintenances archived.
+    """
+    # The deletes are recomputed (or queued) once, for the car's statistics
+    # to take in its new archived totals.
+    with deferred_recompute():
+        purchases = _move(
+            GasPurchase.objects.filter(vehicle_id=car_id, datetime__lt=before),
+            ArchivedGasPurchase,
+            PURCHASE_COLUMNS,
+            batch_size,
+        )
+        maintenances = _move(
+            Maintenance.objects.filter(
+                vehicle_id=car_id, datetime__lt=timezone.localdate(before),
+            ),
+            ArchivedMaintenance,
+            MAINTENANCE_COLUMNS,
+            batch_size,
+        )
+        if purchases or maintenances:
+            ArchivedTotals.objects.rebuild(car_id, before)
+    return purchases, maintenances
+
+
+def archive_orphans(batch_size=500):
+    """
+    Archives every gas purchase and maintenance without a car, returning how
+    many there were.
+    """
+    with deferred_recompute():
+        return sum([
+            _move(
+                GasPurchase.objects.filter(vehicle__isnull=True),
+                ArchivedGasPurchase,
+                PURCHASE_COLUMNS,
+                batch_size,
+            ),
+            _move(
+                Maintenance.objects.filter(vehicle__isnull=True),
+                ArchivedMaintenance,
+                MAINTENANCE_COLUMNS,
+                batch_size,
+            ),
+        ])
@@ -0,0 +1,39 @@
+"""
+The app's URLs (see gas.urls) with the read-heavy views replaced by their
+async versions from gas.async_views. Used instead of gas.urls when
+GAS_ASYNC_VIEWS is set.
+"""
+from django.urls import path
+
+from . import async_views
+from .urls import urlpatterns as sync_urlpatterns
+
+ASYNC_VIEWS = {
+    'cars': async_views.CarListView,
+    'fleet': async_views.FleetDashboardView,
+    'car-detail': async_views.CarDetailView,
+    'car-export-csv': async_views.CarHistoryExportView,
+    'car-export-jsonl': async_views.CarHistoryExportView,
+    'car-gas-purchases': async_views.GasPurchaseListView,
+    'car-maintenances': async_views.MaintenanceListView,
+    'api-cars': async_views.CarListApiView,
+    'api-car': async_views.CarApiView,
+    'api-car-gas-purchases': async_views.GasPurchaseListApiView,
+    'api-car-maintenances': async_views.MaintenanceListApiView,
+    'api-car-rollups': async_views.CarRollupApiView,
+    'api-rollups': async_views.RollupApiView,
+}
+
+
+def _async(pattern):
+    view = ASYNC_VIEWS.get(pattern.name)
+    if view is None:
+        return pattern
+    return path(
+        str(pattern.pattern),
+        view.as_view(**pattern.callback.view_initkwargs),
+        name=pattern.name,
+    )
+
+
+urlpatterns = [_async(pattern) for pattern in sync_urlpatterns]
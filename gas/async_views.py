@@ -0,0 +1,372 @@
+"""
+Async versions of the read-heavy views in gas.views and gas.api, served in
+their place by gas.async_urls when GAS_ASYNC_VIEWS is set and the site is
+run with gastracker/asgi.py.
+
+Django's ORM is synchronous, so every query still runs in a thread, but
+queries that do not depend on each other's results are started together
+with concurrently(), each in a worker thread (and on a database connection)
+of its own. A page then takes about as long as its slowest query rather
+than all of them added up, and the event loop is free to serve other
+requests while it waits.
+
+Each view is a subclass of the sync view it replaces: only how the data is
+loaded differs, and anything left over (such as rendering, which may still
+load lazily what a cached fragment turned out to need) runs in a thread.
+"""
+import asyncio
+import calendar
+import functools
+import itertools
+
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.core.exceptions import PermissionDenied
+from django.db import close_old_connections, connections
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+)
+from django.utils.http import http_date, quote_etag
+from django.views import View
+
+from . import api, views
+from .analytics import (
+    TRAILING_PERIOD,
+    fleet_cars,
+    mpg_series,
+    summarize_fleet,
+    trailing_maintenance,
+    trailing_purchases,
+)
+from .exporters import export_lines, export_response
+from .middleware import record_thread_queries
+from .models import (
+    ArchivedGasPurchase,
+    ArchivedMaintenance,
+    GasPurchase,
+    Maintenance,
+)
+
+
+def in_thread(func):
+    """
+    Returns an async version of func that runs it in a worker thread outside
+    the request's own thread.
+    """
+    def run(*args, **kwargs):
+        record_thread_queries()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            # Worker threads are not part of the request cycle that closes
+            # connections that are done with (see CONN_MAX_AGE).
+            close_old_connections()
+
+    return sync_to_async(run, thread_sensitive=False)
+
+
+async def concurrently(*funcs):
+    """
+    Calls each of funcs in a worker thread of its own, all at once, returning
+    their results in order. The first exception raised is raised again once
+    all of them have finished.
+    """
+    results = await asyncio.gather(
+        *(in_thread(func)() for func in funcs), return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+class AsyncLoginRequiredMixin:
+    """
+    LoginRequiredMixin for async views, which looks the user up in a thread.
+    """
+    raise_exception = False
+
+    async def dispatch(self, request, *args, **kwargs):
+        if not await in_thread(lambda: request.user.is_authenticated)():
+            if self.raise_exception:
+                raise PermissionDenied
+            return redirect_to_login(request.get_full_path())
+        return await self.handle(request, *args, **kwargs)
+
+    async def handle(self, request, *args, **kwargs):
+        return await View.dispatch(self, request, *args, **kwargs)
+
+
+class AsyncCarConditionMixin(AsyncLoginRequiredMixin):
+    """
+    CarConditionMixin for async views. The car's last change is looked up in
+    a thread before anything else, and repeat requests are answered from it
+    just as the sync views' condition() decorator would.
+    """
+
+    async def handle(self, request, *args, **kwargs):
+        modified = await in_thread(self.car_modified)(request)
+        etag = self.car_etag(request)
+        etag = quote_etag(etag) if etag else None
+        last_modified = (
+            calendar.timegm(modified.utctimetuple()) if modified else None
+        )
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified,
+        )
+        if response is None:
+            response = await super().handle(request, *args, **kwargs)
+        if request.method in ('GET', 'HEAD'):
+            if last_modified and not response.has_header('Last-Modified'):
+                response['Last-Modified'] = http_date(last_modified)
+            if etag:
+                response.headers.setdefault('ETag', etag)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+def _fragment_cache():
+    # The same cache as the {% cache %} tag uses.
+    try:
+        return caches['template_fragments']
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+## CAR ##
+
+
+class CarListView(AsyncLoginRequiredMixin, views.CarListView):
+    async def get(self, request, *args, **kwargs):
+        return await sync_to_async(super().get)(request, *args, **kwargs)
+
+
+class FleetDashboardView(AsyncLoginRequiredMixin, views.FleetDashboardView):
+    async def get(self, request, *args, **kwargs):
+        since = timezone.now() - TRAILING_PERIOD
+        self.summary = summarize_fleet(*await concurrently(
+            functools.partial(fleet_cars, request.user),
+            functools.partial(trailing_purchases, request.user, since),
+            functools.partial(trailing_maintenance, request.user, since),
+        ))
+        return await sync_to_async(super().get)(request, *args, **kwargs)
+
+    def get_summary(self):
+        return self.summary
+
+
+class CarDetailView(AsyncCarConditionMixin, views.CarDetailView):
+    """
+    The car and the recent history of each fragment that is not already
+    cached are loaded together. A fragment that expires before the page is
+    rendered still loads its history then.
+    """
+
+    def uncached_fragments(self, request):
+        modified = self.car_modified(request)
+        if modified is None:
+            return list(self.fragments)
+        # The same keys as the {% cache %} tags in gas/car-detail.html.
+        vary_on = [
+            self.kwargs[self.pk_url_kwarg],
+            modified.isoformat(),
+            timezone.get_current_timezone_name(),
+        ]
+        keys = {
+            make_template_fragment_key(fragment, vary_on): name
+            for name, fragment in self.fragments.items()
+        }
+        cached = _fragment_cache().get_many(keys)
+        return [name for key, name in keys.items() if key not in cached]
+
+    async def get(self, request, *args, **kwargs):
+        car_id = self.kwargs[self.pk_url_kwarg]
+        missing = await in_thread(self.uncached_fragments)(request)
+        self.object, *loaded = await concurrently(
+            self.get_object,
+            *(functools.partial(getattr(self, name), car_id)
+              for name in missing),
+        )
+        self.loaded = dict(zip(missing, loaded))
+        context = await sync_to_async(self.get_context_data)(
+            object=self.object,
+        )
+        return self.render_to_response(context)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(self.loaded)
+        return context
+
+
+class CarHistoryExportView(AsyncLoginRequiredMixin,
+                           views.CarHistoryExportView):
+    # Rows per trip to the thread reading the history.
+    batch_size = 500
+
+    async def get(self, request, *args, **kwargs):
+        car = await in_thread(lambda: self.car)()
+        lines = _stream(export_lines(car, self.format), self.batch_size)
+        return export_response(car, self.format, lines=lines)
+
+
+async def _stream(chunks, batch_size):
+    """
+    Iterates the chunks of a sync streaming response in batches, always in
+    the same thread: the history is read with a server-side cursor, which
+    belongs to that thread's database connection.
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    take = sync_to_async(
+        lambda: list(itertools.islice(chunks, batch_size)),
+        thread_sensitive=False,
+        executor=executor,
+    )
+
+    def finish():
+        chunks.close()
+        # The thread (and its connection) is not used again.
+        connections.close_all()
+
+    try:
+        while True:
+            batch = await take()
+            if not batch:
+                break
+            for chunk in batch:
+                yield chunk
+    finally:
+        await sync_to_async(
+            finish, thread_sensitive=False, executor=executor,
+        )()
+        executor.shutdown(wait=False)
+
+
+## HISTORY ##
+
+
+class AsyncHistoryListMixin(AsyncCarConditionMixin):
+    """
+    For the cursor paginated history lists: the page is loaded alongside the
+    car. Its queries filter on the car's key from the URL rather than on
+    self.car, and are only used once the car is found to be the user's.
+    Not knowing whether the car has an archive yet, they always include the
+    archived rows.
+    """
+
+    def get_queryset(self):
+        return self.filter_queryset(self.model.objects.filter(
+            vehicle=self.kwargs[self.car_url_kwarg],
+        ))
+
+    def get_archived_queryset(self):
+        return self.archived_model.objects.filter(
+            vehicle=self.kwargs[self.car_url_kwarg],
+        )
+
+    def load_page(self):
+        return super().paginate_queryset(
+            self.get_queryset(), self.get_paginate_by(None),
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        return self.page
+
+    async def get(self, request, *args, **kwargs):
+        _, self.page = await concurrently(lambda: self.car, self.load_page)
+        return await sync_to_async(super().get)(request, *args, **kwargs)
+
+
+class GasPurchaseListView(AsyncHistoryListMixin, views.GasPurchaseListView):
+    pass
+
+
+class MaintenanceListView(AsyncHistoryListMixin, views.MaintenanceListView):
+    pass
+
+
+## API ##
+
+
+class AsyncApiMixin(AsyncLoginRequiredMixin):
+    raise_exception = True
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            self.parse(request)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        return JsonResponse(await self.load_data())
+
+    async def load_data(self):
+        return await in_thread(self.get_data)()
+
+
+class AsyncOwnedCarApiMixin(AsyncApiMixin):
+    """
+    Loads the data alongside the car, from querysets filtered on the car's
+    key from the URL, which are only used once the car is found to be the
+    user's.
+    """
+
+    def car_id(self):
+        return self.kwargs[self.car_url_kwarg]
+
+    async def load_data(self):
+        _, data = await concurrently(lambda: self.car, self.get_data)
+        return data
+
+
+class CarListApiView(AsyncApiMixin, api.CarListApiView):
+    pass
+
+
+class CarApiView(AsyncApiMixin, api.CarApiView):
+    pass
+
+
+class GasPurchaseListApiView(AsyncOwnedCarApiMixin,
+                             api.GasPurchaseListApiView):
+    def get_queryset(self):
+        return GasPurchase.objects.filter(vehicle=self.car_id())
+
+    def get_archived_queryset(self):
+        return ArchivedGasPurchase.objects.filter(vehicle=self.car_id())
+
+
+class MaintenanceListApiView(AsyncOwnedCarApiMixin,
+                             api.MaintenanceListApiView):
+    def get_queryset(self):
+        return Maintenance.objects.filter(vehicle=self.car_id())
+
+    def get_archived_queryset(self):
+        return ArchivedMaintenance.objects.filter(vehicle=self.car_id())
+
+
+class RollupApiView(AsyncApiMixin, api.RollupApiView):
+    pass
+
+
+class CarRollupApiView(AsyncOwnedCarApiMixin, api.CarRollupApiView):
+    def get_purchases(self):
+        return GasPurchase.objects.filter(vehicle=self.car_id())
+
+    def get_archived_purchases(self):
+        return ArchivedGasPurchase.objects.filter(vehicle=self.car_id())
+
+    async def load_data(self):
+        _, data, series = await concurrently(
+            lambda: self.car,
+            functools.partial(api.RollupApiView.get_data, self),
+            functools.partial(mpg_series, self.car_id(), self.window),
+        )
+        data['mpg_series'] = series
+        return data
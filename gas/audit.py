@@ -0,0 +1,59 @@
+"""
+Finding gas purchases whose odometer readings do not add up, for the
+audit_odometers command.
+
+Each car's purchases are read once, in date order, with server-side
+iteration over the (vehicle, datetime) index, and every fill up is compared
+with the one before it. Archived history is not audited.
+"""
+from collections import namedtuple
+
+from .models import GasPurchase
+
+
+Anomaly = namedtuple(
+    'Anomaly', ['car_id', 'purchase_id', 'datetime', 'kind', 'message'],
+)
+
+REGRESSION = 'regression'
+DUPLICATE = 'duplicate'
+MPG_SPIKE = 'mpg'
+
+
+def audit_car(car_id, min_mpg=5, max_mpg=100, chunk_size=2000):
+    """
+    Yields an Anomaly for every fill up of a car whose odometer reading is
+    lower than (a regression) or the same as (a duplicate) that of the fill
+    up before it, or that gives an MPG outside min_mpg to max_mpg.
+    """
+    rows = GasPurchase.objects.filter(vehicle_id=car_id).order_by(
+        'datetime', 'uuid',
+    ).values_list(
+        'uuid', 'datetime', 'odometer_reading', 'gallons',
+    ).iterator(chunk_size=chunk_size)
+
+    previous = None
+    for uuid, datetime, odometer_reading, gallons in rows:
+        if previous is not None:
+            miles = odometer_reading - previous
+            if miles < 0:
+                yield Anomaly(
+                    car_id, uuid, datetime, REGRESSION,
+                    f"odometer went back from {previous} to "
+                    f"{odometer_reading}",
+                )
+            elif miles == 0:
+                yield Anomaly(
+                    car_id, uuid, datetime, DUPLICATE,
+                    f"same odometer reading ({odometer_reading}) as the "
+                    f"previous fill up",
+                )
+            elif gallons:
+                mpg = miles / gallons
+                if not min_mpg <= mpg <= max_mpg:
+                    yield Anomaly(
+                        car_id, uuid, datetime, MPG_SPIKE,
+                        f"{mpg:.1f} MPG over {miles} miles since the "
+                        f"previous fill up",
+                    )
+        previous = odometer_reading
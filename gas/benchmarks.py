@@ -0,0 +1,289 @@
+"""
+A benchmark harness that requests every route in gas/urls.py through the
+Django test client and reports latency percentiles and queries per request
+for growing amounts of history.
+
+compare_servers() instead measures the throughput of the read-heavy routes
+under concurrent clients, served through the WSGI application (with the sync
+views) and the ASGI application (with the async views of gas.async_views).
+"""
+import asyncio
+import io
+import statistics
+import threading
+import time
+
+from urllib.parse import urlsplit
+
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import urls
+from .seeding import seed_fleet
+
+
+def route_urls(car):
+    """
+    Yields the name and a URL of every route in gas/urls.py, filled in with
+    car and the first of its gas purchases and maintenances.
+    """
+    values = {
+        'uuid': car.uuid,
+        'car_id': car.uuid,
+        'gas_id': car.gaspurchase_set.first().uuid,
+        'maint_id': car.maintenance_set.first().uuid,
+    }
+    for pattern in urls.urlpatterns:
+        kwargs = {name: values[name] for name in pattern.pattern.converters}
+        url = reverse(pattern.name, kwargs=kwargs)
+        # Forms for adding to a car are prefilled with the car given here.
+        yield pattern.name, f'{url}?uuid={car.uuid}'
+
+
+def fetch(client, url):
+    response = client.get(url)
+    # Streaming responses only query the database as they are consumed.
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(client, url, requests):
+    timings = []
+    for _ in range(requests):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = fetch(client, url)
+            timings.append(time.perf_counter() - start)
+    return {
+        'status': response.status_code,
+        'queries': len(queries.captured_queries),
+        'p50_ms': round(percentile(timings, 0.5) * 1000, 3),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+        'mean_ms': round(statistics.mean(timings) * 1000, 3),
+    }
+
+
+def run(sizes, cars_per_user=3, requests=20, seed=0):
+    """
+    Yields a result for every route at every size, where a size is the
+    years of history given to each of a fresh user's cars.
+    """
+    for years in sizes:
+        car, *_ = seed_fleet(cars_per_user=cars_per_user, years=years, seed=seed)
+        client = Client()
+        client.force_login(car.owner)
+        purchases = car.gaspurchase_set.count()
+        for name, url in route_urls(car):
+            fetch(client, url)  # Warm up any caches.
+            yield {
+                'years': years,
+                'cars': cars_per_user,
+                'purchases_per_car': purchases,
+                'route': name,
+                **measure(client, url, requests),
+            }
+
+
+## WSGI AND ASGI ##
+
+
+# The routes served by async views under ASGI (see gas.async_urls).
+READ_ROUTES = (
+    'cars',
+    'fleet',
+    'car-detail',
+    'car-export-csv',
+    'car-gas-purchases',
+    'car-maintenances',
+    'api-cars',
+    'api-car-gas-purchases',
+    'api-car-rollups',
+    'api-rollups',
+)
+
+
+def wsgi_get(application, url, cookie):
+    """
+    Requests url from a WSGI application, returning the response status.
+    """
+    parts = urlsplit(url)
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': parts.path,
+        'QUERY_STRING': parts.query,
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'testserver',
+        'HTTP_COOKIE': cookie,
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': io.StringIO(),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    status = []
+
+    def start_response(value, headers, exc_info=None):
+        status.append(int(value.split()[0]))
+
+    body = application(environ, start_response)
+    try:
+        for _ in body:
+            pass
+    finally:
+        body.close()
+    return status[0]
+
+
+async def asgi_get(application, url, cookie):
+    """
+    Requests url from an ASGI application, returning the response status.
+    """
+    parts = urlsplit(url)
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': parts.path,
+        'raw_path': parts.path.encode(),
+        'query_string': parts.query.encode(),
+        'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 0),
+        'server': ('testserver', 80),
+    }
+    requested = False
+    status = []
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # The client never disconnects early.
+        await asyncio.Future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+def _summary(timings, statuses, elapsed):
+    return {
+        'errors': sum(1 for status in statuses if status != 200),
+        'throughput_rps': round(len(timings) / elapsed, 1),
+        'p50_ms': round(percentile(timings, 0.5) * 1000, 3),
+        'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+    }
+
+
+def measure_wsgi(url, cookie, clients, requests, workers):
+    """
+    Has clients threads each request url requests times in a row from the
+    WSGI application, which (like a threaded WSGI server) serves at most
+    workers requests at once.
+    """
+    application = get_wsgi_application()
+    slots = threading.Semaphore(workers)
+    timings, statuses = [], []
+
+    def client():
+        try:
+            for _ in range(requests):
+                start = time.perf_counter()
+                with slots:
+                    statuses.append(wsgi_get(application, url, cookie))
+                timings.append(time.perf_counter() - start)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return _summary(timings, statuses, time.perf_counter() - start)
+
+
+def measure_asgi(url, cookie, clients, requests):
+    """
+    Has clients tasks each request url requests times in a row from the
+    ASGI application, all served by one event loop.
+    """
+    application = get_asgi_application()
+    timings, statuses = [], []
+
+    async def client():
+        for _ in range(requests):
+            start = time.perf_counter()
+            statuses.append(await asgi_get(application, url, cookie))
+            timings.append(time.perf_counter() - start)
+
+    async def run():
+        await asyncio.gather(*(client() for _ in range(clients)))
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    return _summary(timings, statuses, time.perf_counter() - start)
+
+
+def compare_servers(sizes, clients=16, requests=10, workers=4,
+                    cars_per_user=3, routes=READ_ROUTES, seed=0):
+    """
+    Yields the throughput and latency of every route in routes at every
+    size, first through WSGI and then through ASGI.
+    """
+    for years in sizes:
+        car, *_ = seed_fleet(
+            cars_per_user=cars_per_user, years=years, seed=seed,
+        )
+        client = Client()
+        client.force_login(car.owner)
+        cookie = f"sessionid={client.cookies['sessionid'].value}"
+        purchases = car.gaspurchase_set.count()
+        for name, url in route_urls(car):
+            if name not in routes:
+                continue
+            result = {
+                'years': years,
+                'cars': cars_per_user,
+                'purchases_per_car': purchases,
+                'route': name,
+                'clients': clients,
+                'requests': clients * requests,
+            }
+            with override_settings(ROOT_URLCONF='gastracker.urls'):
+                wsgi_get(get_wsgi_application(), url, cookie)  # Warm up.
+                yield {
+                    **result,
+                    'server': 'wsgi',
+                    'workers': workers,
+                    **measure_wsgi(url, cookie, clients, requests, workers),
+                }
+            with override_settings(ROOT_URLCONF='gastracker.async_urls'):
+                yield {
+                    **result,
+                    'server': 'asgi',
+                    **measure_asgi(url, cookie, clients, requests),
+                }
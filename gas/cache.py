@@ -0,0 +1,169 @@
+"""
+Caching of per-car derived values on top of the Django cache framework.
+
+Every entry is keyed by a per-car version number, which is bumped whenever
+one of the car's gas purchases or maintenances is written. Entries are
+never invalidated individually: bumping the version makes every old entry
+for that car unreachable, and the cache evicts them in its own time.
+
+Misses are always read from the default database, never the read replica:
+the version is bumped as soon as a car is written, and a replica that is
+behind would otherwise fill the new version with what it was before.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+
+def _cache():
+    return caches[getattr(settings, 'GAS_CACHE_ALIAS', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'GAS_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+class CacheCounters:
+    """
+    Thread-safe, per-process counts of cache hits and misses.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def record(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def snapshot(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+counters = CacheCounters()
+
+
+def _version_key(car_id):
+    return f'gas:car:{car_id}:version'
+
+
+def car_versions(car_ids):
+    """
+    Returns the current version of each car, starting a version for cars
+    the cache does not know about.
+    """
+    cache = _cache()
+    keys = {_version_key(car_id): car_id for car_id in car_ids}
+    found = cache.get_many(keys)
+    versions = {keys[key]: version for key, version in found.items()}
+    for key, car_id in keys.items():
+        if key not in found:
+            # A version that was evicted must not restart at a number that
+            # old entries were stored under, so new versions start from the
+            # clock.
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[car_id] = cache.get(key)
+    return versions
+
+
+def bump_car_versions(car_ids):
+    """
+    Invalidates everything cached for the given cars, both straight away and
+    once the current transaction commits, so that no request can cache
+    pre-commit data under the new version.
+    """
+    car_ids = {car_id for car_id in car_ids if car_id is not None}
+
+    def bump():
+        cache = _cache()
+        for car_id in car_ids:
+            try:
+                cache.incr(_version_key(car_id))
+            except ValueError:
+                cache.add(_version_key(car_id), time.time_ns(), timeout=None)
+
+    if car_ids:
+        bump()
+        transaction.on_commit(bump)
+
+
+def _cached(keys, compute):
+    """
+    Returns the values for keys (a mapping of cache key to item) from the
+    cache, calling compute with the items that missed to fill in the rest.
+    """
+    cache = _cache()
+    found = cache.get_many(keys)
+    missing = [item for key, item in keys.items() if key not in found]
+    counters.record(hits=len(found), misses=len(missing))
+
+    values = {keys[key]: value for key, value in found.items()}
+    if missing:
+        computed = compute(missing)
+        values.update(computed)
+        cache.set_many(
+            {key: computed[item] for key, item in keys.items()
+             if item in computed},
+            timeout=_timeout(),
+        )
+    return values
+
+
+def attach_car_stats(cars):
+    """
+    Loads the CarStats of each car from the cache (or the database on a
+    miss), so that operating_cost and average_mpg need no further queries.
+    """
+    from .models import Car, CarStats
+
+    cars = list(cars)
+    versions = car_versions([car.pk for car in cars])
+    keys = {f'gas:car:{car.pk}:v{versions[car.pk]}:stats': car for car in cars}
+
+    def compute(missing):
+        stats = CarStats.objects.using(DEFAULT_DB_ALIAS).in_bulk(
+            [car.pk for car in missing],
+        )
+        return {car: stats[car.pk] for car in missing if car.pk in stats}
+
+    for car, stats in _cached(keys, compute).items():
+        Car.stats.related.set_cached_value(car, stats)
+    return cars
+
+
+def attach_tank_mpgs(purchases):
+    """
+    Loads the tank MPG of each of the given purchases from the cache (or
+    their tank segments on a miss).
+    """
+    from .models import TankSegment
+
+    purchases = list(purchases)
+    versions = car_versions({purchase.vehicle_id for purchase in purchases})
+    keys = {
+        f'gas:car:{purchase.vehicle_id}:v{versions[purchase.vehicle_id]}'
+        f':tank:{purchase.pk}': purchase
+        for purchase in purchases
+    }
+
+    def compute(missing):
+        segments = TankSegment.objects.using(DEFAULT_DB_ALIAS).order_by()
+        mpgs = dict(segments.filter(
+            start__in=[purchase.pk for purchase in missing],
+        ).values_list('start', 'mpg'))
+        # Wrapped so that purchases without a segment are cached as well.
+        return {purchase: (mpgs.get(purchase.pk),) for purchase in missing}
+
+    for purchase, (mpg,) in _cached(keys, compute).items():
+        purchase.cached_tank_mpg = mpg
+    return purchases
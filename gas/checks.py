@@ -0,0 +1,164 @@
+"""
+A database check that runs EXPLAIN on the querysets behind the app's hot
+pages and reports any that fall back to scanning or sorting a whole table,
+so that missing or unusable indexes are noticed before they are deployed.
+
+Run it with ``manage.py check --database default``.
+"""
+import re
+import uuid
+
+from django.core.checks import Tags, Warning, register
+from django.db import DatabaseError, connections, transaction
+from django.utils import timezone
+
+from .models import (
+    ArchivedGasPurchase,
+    ArchivedMaintenance,
+    Car,
+    CarStats,
+    GasPurchase,
+    Maintenance,
+    TankSegment,
+)
+from .pagination import CursorPaginator
+
+
+def canonical_querysets():
+    """
+    Returns the hot query shapes of the app by name. The values used in the
+    filters do not need to exist; only the plans are inspected.
+    """
+    car = uuid.UUID(int=0)
+    now = timezone.now()
+    purchases = GasPurchase.objects.filter(vehicle_id=car)
+    maintenances = Maintenance.objects.filter(vehicle_id=car)
+    purchase_pages = CursorPaginator(
+        purchases, 20, ['-odometer_reading', '-uuid'],
+    )
+    maintenance_pages = CursorPaginator(
+        maintenances, 20, ['odometer_reading', 'uuid'],
+    )
+
+    return {
+        'cars by owner': Car.objects.filter(owner_id=0),
+        'car stats': CarStats.objects.filter(car_id=car),
+        'gas purchase page': purchases.select_related(
+            'tank_segment',
+        ).order_by('-odometer_reading', '-uuid')[:21],
+        'gas purchase next page': purchases.filter(
+            purchase_pages.keyset_filter([0, car]),
+        ).order_by('-odometer_reading', '-uuid')[:21],
+        'next fill up': purchases.filter(
+            odometer_reading__gt=0,
+        ).order_by('odometer_reading', 'uuid')[:1],
+        'first fill up': purchases.order_by('odometer_reading')[:1],
+        'previous fill up by date': purchases.filter(
+            datetime__lt=now,
+        ).order_by('-datetime')[:1],
+        'next fill up by date': purchases.filter(
+            datetime__gt=now,
+        ).order_by('datetime')[:1],
+        'gas purchases by date': purchases.filter(
+            datetime__gte=now, datetime__lt=now,
+        ).order_by('datetime'),
+        'maintenance page': maintenances.order_by(
+            'odometer_reading', 'uuid',
+        )[:21],
+        'maintenance next page': maintenances.filter(
+            maintenance_pages.keyset_filter([0, car]),
+        ).order_by('odometer_reading', 'uuid')[:21],
+        'archived gas purchase page': ArchivedGasPurchase.objects.filter(
+            vehicle_id=car,
+        ).order_by('-odometer_reading', '-uuid')[:21],
+        'archived maintenance page': ArchivedMaintenance.objects.filter(
+            vehicle_id=car,
+        ).order_by('odometer_reading', 'uuid')[:21],
+        'maintenances by date': maintenances.filter(
+            datetime__gte=now.date(), datetime__lt=now.date(),
+        ).order_by('datetime'),
+        'tank segments': TankSegment.objects.filter(
+            vehicle_id=car,
+        ).order_by('-start_odometer')[:21],
+        'admin gas purchases': GasPurchase.objects.order_by(
+            '-datetime', '-uuid',
+        )[:25],
+        'admin gas purchase search': GasPurchase.objects.filter(
+            odometer_reading=0,
+        ),
+        'admin maintenances': Maintenance.objects.order_by(
+            '-datetime', '-uuid',
+        )[:25],
+        'admin maintenance search': Maintenance.objects.filter(
+            odometer_reading=0,
+        ),
+    }
+
+
+def _postgresql_problems(plan):
+    scans = re.findall(r'Seq Scan on (\w+)', plan)
+    sorts = re.findall(r'^\s*(?:->\s*)?((?:Incremental )?Sort)\b', plan, re.M)
+    return scans, sorts
+
+
+def _sqlite_problems(plan):
+    scans, sorts = [], []
+    for line in plan.splitlines():
+        scan = re.search(r'\bSCAN (?:TABLE )?(\w+)', line)
+        if scan and 'USING' not in line:
+            scans.append(scan.group(1))
+        if 'USE TEMP B-TREE' in line:
+            sorts.append(line.strip())
+    return scans, sorts
+
+
+def explain(queryset, using='default'):
+    """
+    Returns the plan for a queryset along with the tables it scans
+    sequentially and the sorts it performs without an index.
+    """
+    connection = connections[using]
+    queryset = queryset.using(using)
+    if connection.vendor == 'postgresql':
+        # Make the planner use any index that applies, since tiny test
+        # tables would otherwise be scanned whether or not one exists.
+        with transaction.atomic(using=using):
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('SET LOCAL enable_sort = off')
+            plan = queryset.explain()
+        return (plan, *_postgresql_problems(plan))
+    if connection.vendor == 'sqlite':
+        plan = queryset.explain()
+        return (plan, *_sqlite_problems(plan))
+    return None, [], []
+
+
+@register(Tags.database)
+def check_query_plans(app_configs=None, databases=None, **kwargs):
+    errors = []
+    for alias in databases or []:
+        for name, queryset in canonical_querysets().items():
+            try:
+                plan, scans, sorts = explain(queryset, using=alias)
+            except DatabaseError:
+                # The tables do not exist yet, such as when this runs before
+                # the first migrate.
+                continue
+            for table in scans:
+                errors.append(Warning(
+                    f"The {name} query scans every row of {table} on "
+                    f"the '{alias}' database.",
+                    hint=plan,
+                    obj=queryset.model,
+                    id='gas.W001',
+                ))
+            for sort in sorts:
+                errors.append(Warning(
+                    f"The {name} query sorts without an index on the "
+                    f"'{alias}' database ({sort}).",
+                    hint=plan,
+                    obj=queryset.model,
+                    id='gas.W002',
+                ))
+    return errors
@@ -0,0 +1,178 @@
+"""
+Streaming export of a car's gas purchase and maintenance history.
+
+Both histories, and their archived parts, are read with server-side
+iteration over value tuples and merged in odometer order, so memory use does
+not depend on how long the history is. Tank MPG is worked out in the same
+pass by holding back each fill up until the next one has been read (archived
+fill ups have theirs stored with them).
+"""
+import csv
+import heapq
+import json
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import (
+    ArchivedGasPurchase,
+    ArchivedMaintenance,
+    GasPurchase,
+    Maintenance,
+)
+
+
+COLUMNS = [
+    'type',
+    'datetime',
+    'odometer_reading',
+    'gallons',
+    'cost_per_gallon',
+    'total_cost',
+    'tank_mpg',
+    'cost',
+    'description',
+]
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def _purchases(car, chunk_size):
+    rows = GasPurchase.objects.filter(vehicle=car).order_by(
+        'odometer_reading', 'uuid',
+    ).values_list(
+        'datetime', 'odometer_reading', 'gallons', 'cost_per_gallon',
+    ).iterator(chunk_size=chunk_size)
+
+    # Fill ups at the highest odometer reading read so far, whose tank MPG
+    # depends on the next (higher) reading.
+    pending = []
+    for row in rows:
+        odometer_reading, gallons = row[1], row[2]
+        if pending and pending[0]['odometer_reading'] < odometer_reading:
+            for record in pending:
+                miles = odometer_reading - record['odometer_reading']
+                record['tank_mpg'] = miles / gallons if gallons else None
+                yield record
+            pending = []
+
+        datetime, _, _, cost_per_gallon = row
+        pending.append({
+            'type': 'gas',
+            'datetime': timezone.localtime(datetime).isoformat(),
+            'odometer_reading': odometer_reading,
+            'gallons': gallons,
+            'cost_per_gallon': cost_per_gallon,
+            'total_cost': gallons * cost_per_gallon,
+            'tank_mpg': None,
+        })
+
+    yield from pending
+
+
+def _archived_purchases(car, chunk_size):
+    rows = ArchivedGasPurchase.objects.filter(vehicle=car).order_by(
+        'odometer_reading', 'uuid',
+    ).values_list(
+        'datetime', 'odometer_reading', 'gallons', 'cost_per_gallon',
+        'tank_mpg',
+    ).iterator(chunk_size=chunk_size)
+
+    for datetime, odometer_reading, gallons, cost_per_gallon, mpg in rows:
+        yield {
+            'type': 'gas',
+            'datetime': timezone.localtime(datetime).isoformat(),
+            'odometer_reading': odometer_reading,
+            'gallons': gallons,
+            'cost_per_gallon': cost_per_gallon,
+            'total_cost': gallons * cost_per_gallon,
+            'tank_mpg': mpg,
+        }
+
+
+def _maintenances(car, chunk_size, model=Maintenance):
+    rows = model.objects.filter(vehicle=car).order_by(
+        'odometer_reading', 'uuid',
+    ).values_list(
+        'datetime', 'odometer_reading', 'cost', 'description',
+    ).iterator(chunk_size=chunk_size)
+
+    for datetime, odometer_reading, cost, description in rows:
+        yield {
+            'type': 'maintenance',
+            'datetime': datetime.isoformat(),
+            'odometer_reading': odometer_reading,
+            'total_cost': cost,
+            'cost': cost,
+            'description': description,
+        }
+
+
+def history_records(car, chunk_size=2000):
+    """
+    Yields a dictionary for every gas purchase and maintenance of a car,
+    archived ones included, in odometer order.
+    """
+    histories = [_purchases(car, chunk_size), _maintenances(car, chunk_size)]
+    if car.has_archive:
+        histories += [
+            _archived_purchases(car, chunk_size),
+            _maintenances(car, chunk_size, model=ArchivedMaintenance),
+        ]
+    return heapq.merge(
+        *histories, key=lambda record: record['odometer_reading'],
+    )
+
+
+class _Echo:
+    """
+    A file-like object whose write() hands back what it was given, letting
+    csv.writer produce lines for a streaming response.
+    """
+
+    def write(self, value):
+        return value
+
+
+def _csv_lines(records):
+    writer = csv.DictWriter(_Echo(), fieldnames=COLUMNS)
+    yield writer.writeheader()
+    for record in records:
+        yield writer.writerow(record)
+
+
+def _jsonl_lines(records):
+    for record in records:
+        yield json.dumps(record, default=str) + '\n'
+
+
+def export_lines(car, format, chunk_size=2000):
+    """
+    Returns an iterator over the lines of the car's history as CSV or JSON
+    Lines.
+    """
+    records = history_records(car, chunk_size=chunk_size)
+    if format == 'csv':
+        return _csv_lines(records)
+    elif format == 'jsonl':
+        return _jsonl_lines(records)
+    raise ValueError(f"Unknown export format: {format}")
+
+
+def export_response(car, format, lines=None):
+    """
+    Returns a streaming response with the car's history as CSV or JSON Lines,
+    made of the given lines (which may be an async iterator) or, by default,
+    those of export_lines().
+    """
+    if lines is None:
+        lines = export_lines(car, format)
+
+    response = StreamingHttpResponse(lines, content_type=CONTENT_TYPES[format])
+    filename = f"{slugify(f'{car.year} {car.make} {car.model}')}.{format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
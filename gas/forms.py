@@ -1,7 +1,14 @@
+import codecs
+import datetime
+
 from django import forms
+from django.db.models import F, Min
 from django.forms import ModelForm
+from django.utils import timezone
 
+from .importers import guess_format
 from .models import *
+from .recompute import deferred_recompute
 
 
 class GasPurchaseForm(ModelForm):
@@ -14,3 +21,227 @@ class GasPurchaseForm(ModelForm):
             'cost_per_gallon',
             'gallons',
         ]
+
+
+class ImportHistoryForm(forms.Form):
+    vehicle = forms.ModelChoiceField(queryset=Car.objects.none())
+    kind = forms.ChoiceField(
+        label="Contents",
+        choices=[
+            ('gas', "Gas purchases"),
+            ('maintenance', "Maintenances"),
+        ],
+    )
+    file = forms.FileField(
+        help_text="A CSV or JSON Lines (.jsonl) file with one row per entry.",
+    )
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['vehicle'].queryset = Car.objects.filter(owner=user)
+
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        if guess_format(upload.name) is None:
+            raise forms.ValidationError(
+                "Only .csv and .jsonl files can be imported."
+            )
+
+        # Checked before anything is imported, as the import commits as it
+        # goes.
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        try:
+            for chunk in upload.chunks():
+                decoder.decode(chunk)
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            raise forms.ValidationError("The file is not UTF-8 text.")
+        upload.seek(0)
+        return upload
+
+
+class HistoryFilterForm(forms.Form):
+    """
+    Query string filters for a car's history. Date and odometer ranges are
+    range predicates on the (vehicle, datetime) and (vehicle,
+    odometer_reading) indexes, and the remaining filters only ever apply to
+    the one car's rows those indexes select.
+    """
+    start_date = forms.DateField(required=False, label="From")
+    end_date = forms.DateField(required=False, label="To")
+    min_odometer = forms.IntegerField(
+        required=False, min_value=0, label="Odometer from",
+    )
+    max_odometer = forms.IntegerField(
+        required=False, min_value=0, label="Odometer to",
+    )
+
+    ranges = [
+        ('start_date', 'end_date'),
+        ('min_odometer', 'max_odometer'),
+    ]
+
+    def clean(self):
+        cleaned_data = super().clean()
+        for low, high in self.ranges:
+            low_value = cleaned_data.get(low)
+            high_value = cleaned_data.get(high)
+            if (low_value is not None and high_value is not None
+                    and low_value > high_value):
+                raise forms.ValidationError(
+                    f"{self.fields[low].label} must not be after "
+                    f"{self.fields[high].label.lower()}."
+                )
+        return cleaned_data
+
+    def date_filters(self, start, end):
+        filters = {}
+        if start is not None:
+            filters['datetime__gte'] = start
+        if end is not None:
+            filters['datetime__lte'] = end
+        return filters
+
+    def get_filters(self):
+        data = self.cleaned_data
+        filters = self.date_filters(data['start_date'], data['end_date'])
+        if data['min_odometer'] is not None:
+            filters['odometer_reading__gte'] = data['min_odometer']
+        if data['max_odometer'] is not None:
+            filters['odometer_reading__lte'] = data['max_odometer']
+        return filters
+
+    def filter(self, queryset):
+        return queryset.filter(**self.get_filters())
+
+
+class GasPurchaseFilterForm(HistoryFilterForm):
+    min_price = forms.DecimalField(
+        required=False, min_value=0, decimal_places=3, label="Cost/gallon from",
+    )
+    max_price = forms.DecimalField(
+        required=False, min_value=0, decimal_places=3, label="Cost/gallon to",
+    )
+
+    ranges = HistoryFilterForm.ranges + [('min_price', 'max_price')]
+
+    def date_filters(self, start, end):
+        # Comparing the stored datetimes with the bounds of the local days,
+        # rather than with their dates, keeps the predicate on the index.
+        def midnight(date):
+            return timezone.make_aware(
+                datetime.datetime.combine(date, datetime.time.min),
+            )
+
+        filters = {}
+        if start is not None:
+            filters['datetime__gte'] = midnight(start)
+        if end is not None:
+            filters['datetime__lt'] = midnight(end + datetime.timedelta(days=1))
+        return filters
+
+    def get_filters(self):
+        filters = super().get_filters()
+        data = self.cleaned_data
+        if data['min_price'] is not None:
+            filters['cost_per_gallon__gte'] = data['min_price']
+        if data['max_price'] is not None:
+            filters['cost_per_gallon__lte'] = data['max_price']
+        return filters
+
+
+class MaintenanceFilterForm(HistoryFilterForm):
+    description = forms.CharField(required=False, max_length=100)
+
+    def get_filters(self):
+        filters = super().get_filters()
+        if self.cleaned_data['description']:
+            filters['description__icontains'] = self.cleaned_data['description']
+        return filters
+
+
+class GasPurchaseBulkForm(forms.Form):
+    """
+    Moves, shifts the odometer readings of, or deletes a selection of one
+    car's gas purchases at once.
+    """
+    purchases = forms.ModelMultipleChoiceField(
+        queryset=GasPurchase.objects.none(),
+        widget=forms.MultipleHiddenInput,
+        error_messages={'required': "Select at least one purchase."},
+    )
+    action = forms.ChoiceField(choices=[
+        ('move', "Move to another car"),
+        ('shift', "Shift odometer readings"),
+        ('delete', "Delete"),
+    ])
+    vehicle = forms.ModelChoiceField(
+        queryset=Car.objects.none(),
+        required=False,
+        label="Move to",
+        empty_label="Car to move to",
+    )
+    odometer_offset = forms.IntegerField(
+        required=False,
+        label="Shift odometer readings by",
+        widget=forms.NumberInput(attrs={'placeholder': "Miles to shift by"}),
+    )
+
+    def __init__(self, *args, car=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.car = car
+        # Validating the selection against the car's purchases is the one
+        # ownership check needed for all of them.
+        self.fields['purchases'].queryset = GasPurchase.objects.filter(
+            vehicle=car,
+        )
+        self.fields['vehicle'].queryset = Car.objects.filter(
+            owner_id=car.owner_id,
+        ).exclude(pk=car.pk)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        action = cleaned_data.get('action')
+        if action == 'move' and not cleaned_data.get('vehicle'):
+            self.add_error('vehicle', "Choose the car to move them to.")
+        if action == 'shift':
+            offset = cleaned_data.get('odometer_offset')
+            purchases = cleaned_data.get('purchases')
+            if not offset:
+                self.add_error(
+                    'odometer_offset', "Enter a number of miles to shift by.",
+                )
+            elif purchases is not None:
+                lowest = purchases.aggregate(
+                    lowest=Min('odometer_reading'),
+                )['lowest']
+                if lowest + offset < 0:
+                    self.add_error(
+                        'odometer_offset',
+                        "Odometer readings cannot become negative.",
+                    )
+        return cleaned_data
+
+    def save(self):
+        """
+        Applies the action with a single query in one transaction, then
+        recomputes the cars involved once. Returns the number of purchases
+        changed.
+        """
+        purchases = self.cleaned_data['purchases']
+        action = self.cleaned_data['action']
+        with deferred_recompute() as cars:
+            cars.add(self.car.pk)
+            if action == 'move':
+                vehicle = self.cleaned_data['vehicle']
+                cars.add(vehicle.pk)
+                return purchases.update(vehicle=vehicle)
+            if action == 'shift':
+                return purchases.update(
+                    odometer_reading=(
+                        F('odometer_reading')
+                        + self.cleaned_data['odometer_offset']
+                    ),
+                )
+            _, deleted = purchases.delete()
+            return deleted.get(GasPurchase._meta.label, 0)
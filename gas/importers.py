@@ -0,0 +1,188 @@
+"""
+Bulk importing of gas purchase and maintenance histories from CSV or JSON
+Lines files.
+
+Rows are read lazily, validated with the same field validators the models
+use and written with bulk_create in fixed size batches, so files of any
+length can be imported without holding them in memory.
+"""
+import csv
+import datetime
+import json
+
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from .models import (
+    GasPurchase,
+    Maintenance,
+)
+from .recompute import schedule
+
+
+KINDS = {
+    'gas': (
+        GasPurchase,
+        ['datetime', 'odometer_reading', 'gallons', 'cost_per_gallon'],
+    ),
+    'maintenance': (
+        Maintenance,
+        ['datetime', 'odometer_reading', 'cost', 'description'],
+    ),
+}
+
+FORMATS = ['csv', 'jsonl']
+
+
+def guess_format(filename):
+    """
+    Returns the import format implied by a file name's extension, if any.
+    """
+    extension = filename.rsplit('.', 1)[-1].lower()
+    if extension in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    if extension == 'csv':
+        return 'csv'
+    return None
+
+
+class MalformedRow:
+    """
+    Stands in for a record that could not be parsed at all, so that it is
+    reported like any other invalid row.
+    """
+
+    def __init__(self, message):
+        self.message = message
+
+
+def read_rows(lines, format):
+    """
+    Yields a dictionary for every record in an iterable of text lines.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown import format: {format}")
+    try:
+        if format == 'csv':
+            yield from csv.DictReader(lines)
+        else:
+            for line in lines:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield MalformedRow(f"Invalid JSON: {e}")
+    except UnicodeDecodeError as e:
+        # Nothing after this point can be read.
+        yield MalformedRow(f"Not UTF-8 text: {e.reason}")
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        # (row number, message) pairs, where row 1 is the first record.
+        self.errors = []
+
+    @property
+    def failed(self):
+        return len(self.errors)
+
+
+class HistoryImporter:
+    """
+    Imports rows of a single kind ('gas' or 'maintenance') into a vehicle.
+    """
+
+    def __init__(self, vehicle, kind, batch_size=1000):
+        self.vehicle = vehicle
+        self.model, self.field_names = KINDS[kind]
+        self.fields = [
+            self.model._meta.get_field(name) for name in self.field_names
+        ]
+        self.batch_size = batch_size
+
+    def clean_row(self, row):
+        """
+        Builds an unsaved instance from a row, raising ValidationError with
+        every problem found in it.
+        """
+        instance = self.model(vehicle=self.vehicle)
+        errors = {}
+        for field in self.fields:
+            value = row.get(field.name)
+            if isinstance(value, str):
+                value = value.strip()
+            try:
+                value = field.clean(value, instance)
+            except ValidationError as e:
+                errors[field.name] = e.messages
+                continue
+
+            if (isinstance(value, datetime.datetime)
+                    and timezone.is_naive(value)):
+                value = timezone.make_aware(value)
+            setattr(instance, field.attname, value)
+
+        if errors:
+            raise ValidationError(errors)
+        return instance
+
+    def run(self, rows):
+        """
+        Imports every row, skipping (and reporting) the ones that are not
+        valid rather than aborting the import.
+        """
+        result = ImportResult()
+        rows = enumerate(rows, start=1)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            self._import_batch(batch, result)
+
+        schedule([self.vehicle.pk])
+        return result
+
+    def _import_batch(self, batch, result):
+        instances = []
+        for number, row in batch:
+            if isinstance(row, MalformedRow):
+                result.errors.append((number, row.message))
+                continue
+            try:
+                instances.append((number, self.clean_row(row)))
+            except ValidationError as e:
+                result.errors.append((number, self._describe(e)))
+            except (AttributeError, TypeError):
+                result.errors.append((number, "Row is not a record."))
+
+        try:
+            with transaction.atomic():
+                self.model.objects.bulk_create(
+                    [instance for number, instance in instances],
+                )
+        except DatabaseError:
+            # Saved one at a time instead, to find the rows at fault.
+            for number, instance in instances:
+                try:
+                    with transaction.atomic():
+                        self.model.objects.bulk_create([instance])
+                except DatabaseError as e:
+                    result.errors.append(
+                        (number, f"Could not be saved: {e}"),
+                    )
+                else:
+                    result.created += 1
+        else:
+            result.created += len(instances)
+
+    @staticmethod
+    def _describe(error):
+        return '; '.join(
+            f"{field}: {' '.join(messages)}"
+            for field, messages in error.message_dict.items()
+        )
@@ -0,0 +1,111 @@
+"""
+The worker side of the recompute queue (see gas.recompute), run by the
+run_gas_worker command.
+
+Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED in a short
+transaction of their own, so any number of worker threads and processes
+can share the queue without handing out the same job twice. The job's car
+is locked along with it, so two workers can not claim jobs for the same car
+at once, and a car is only ever recomputed by one worker at a time.
+"""
+import datetime
+import logging
+
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import RecomputeJob
+from .recompute import recompute_cars
+
+
+logger = logging.getLogger(__name__)
+
+# Claimed jobs that have not finished after this long are assumed to belong
+# to a worker that died, and are handed out again.
+STALE_AFTER = datetime.timedelta(minutes=10)
+
+
+def claim(now=None):
+    """
+    Claims the oldest job for a car that no other worker is recomputing,
+    returning None when there are none.
+    """
+    now = now or timezone.now()
+    stale = now - STALE_AFTER
+    running = RecomputeJob.objects.filter(
+        car=OuterRef('car'), claimed_at__gt=stale,
+    ).exclude(pk=OuterRef('pk'))
+
+    with transaction.atomic():
+        # Other workers' claims of jobs for the same car are not seen until
+        # they commit, but the lock on the car is.
+        job = RecomputeJob.objects.select_related('car').select_for_update(
+            skip_locked=True, of=('self', 'car'),
+        ).filter(
+            Q(claimed_at__isnull=True) | Q(claimed_at__lte=stale),
+        ).annotate(
+            running=Exists(running),
+        ).filter(running=False).order_by('requested_at').first()
+        if job is not None:
+            job.claimed_at = now
+            job.save(update_fields=['claimed_at'])
+    return job
+
+
+def run_job(job):
+    """
+    Recomputes the job's car and removes the job. Failed jobs are left
+    claimed, to be retried once they are stale.
+    """
+    try:
+        recompute_cars([job.car_id])
+    except Exception:
+        logger.exception("Recomputing car %s failed", job.car_id)
+        return False
+    job.delete()
+    return True
+
+
+def run_pending():
+    """
+    Runs queued jobs in this thread until none are left, returning how many
+    were run. This is what tests and run_gas_worker --once use.
+    """
+    count = 0
+    while True:
+        job = claim()
+        if job is None:
+            return count
+        run_job(job)
+        count += 1
+
+
+def work(stop, poll_interval=1.0, once=False):
+    """
+    Runs jobs until the stop event is set (or, with once, until there are no
+    more), waiting poll_interval seconds whenever the queue is empty. Returns
+    the number of jobs run.
+    """
+    count = 0
+    try:
+        while not stop.is_set():
+            try:
+                job = claim()
+            except DatabaseError:
+                # Such as lock timeouts, which are worth waiting out rather
+                # than taking the worker thread down.
+                logger.exception("Claiming a recompute job failed")
+                stop.wait(poll_interval)
+                continue
+            if job is None:
+                if once:
+                    break
+                stop.wait(poll_interval)
+                continue
+            run_job(job)
+            count += 1
+    finally:
+        # Every worker thread has a connection of its own.
+        connection.close()
+    return count
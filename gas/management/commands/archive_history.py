@@ -0,0 +1,61 @@
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gas.archive import archive_car, archive_cutoff, archive_orphans
+from gas.models import Car
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves the gas purchases and maintenances of years that are over into "
+        "the archive, along with any that no longer belong to a car."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'cars',
+            nargs='*',
+            type=uuid.UUID,
+            metavar='uuid',
+            help="Only archive the history of these cars.",
+        )
+        parser.add_argument(
+            '--older-than',
+            type=int,
+            default=2,
+            metavar='YEARS',
+            help=(
+                "Archive the calendar years that ended at least this many "
+                "years ago."
+            ),
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help="Number of rows to move at once.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            before = archive_cutoff(options['older_than'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        cars = Car.objects.order_by('pk')
+        if options['cars']:
+            cars = cars.filter(uuid__in=options['cars'])
+
+        purchases = maintenances = 0
+        for car_id in list(cars.values_list('pk', flat=True)):
+            archived = archive_car(car_id, before, options['batch_size'])
+            purchases += archived[0]
+            maintenances += archived[1]
+        orphans = archive_orphans(options['batch_size'])
+
+        self.stdout.write(
+            f"Archived {purchases} gas purchase(s) and {maintenances} "
+            f"maintenance(s) dated before {before.date()}, and {orphans} "
+            f"without a car."
+        )
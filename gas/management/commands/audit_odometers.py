@@ -0,0 +1,65 @@
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from gas.audit import audit_car
+from gas.models import Car
+
+
+class Command(BaseCommand):
+    help = (
+        "Reports gas purchases whose odometer readings go backwards, repeat "
+        "the previous reading or give an implausible MPG."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'cars',
+            nargs='*',
+            type=uuid.UUID,
+            metavar='uuid',
+            help="Only audit the history of these cars.",
+        )
+        parser.add_argument(
+            '--min-mpg',
+            type=float,
+            default=5,
+            help="Report tanks with a lower MPG than this.",
+        )
+        parser.add_argument(
+            '--max-mpg',
+            type=float,
+            default=100,
+            help="Report tanks with a higher MPG than this.",
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help="Number of gas purchases to read at once.",
+        )
+
+    def handle(self, *args, **options):
+        cars = Car.objects.order_by('pk')
+        if options['cars']:
+            cars = cars.filter(uuid__in=options['cars'])
+
+        count = audited = 0
+        for car_id in list(cars.values_list('pk', flat=True)):
+            anomalies = audit_car(
+                car_id,
+                min_mpg=options['min_mpg'],
+                max_mpg=options['max_mpg'],
+                chunk_size=options['chunk_size'],
+            )
+            for anomaly in anomalies:
+                self.stdout.write(
+                    f"{anomaly.car_id} {anomaly.datetime.isoformat()} "
+                    f"{anomaly.purchase_id} {anomaly.kind}: "
+                    f"{anomaly.message}"
+                )
+                count += 1
+            audited += 1
+        self.stdout.write(
+            f"Found {count} anomaly(ies) in {audited} car(s)."
+        )
@@ -0,0 +1,73 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.test.runner import DiscoverRunner
+from django.test.utils import (
+    setup_test_environment,
+    teardown_test_environment,
+)
+
+from gas import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the throughput of the read-heavy views under concurrent "
+        "clients when served through WSGI (sync views) and ASGI (async "
+        "views), against a throwaway test database. Prints one JSON object "
+        "per route, server and data size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--years',
+            default='1,4',
+            help="Comma separated years of history per car to benchmark with.",
+        )
+        parser.add_argument('--cars-per-user', type=int, default=3)
+        parser.add_argument(
+            '--clients',
+            type=int,
+            default=16,
+            help="Clients making requests at the same time.",
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=10,
+            help="Requests made in a row by every client, to every route.",
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help="Requests the WSGI server handles at once (its threads).",
+        )
+        parser.add_argument(
+            '--routes',
+            default=','.join(benchmarks.READ_ROUTES),
+            help="Comma separated names of the routes to benchmark.",
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        sizes = [float(years) for years in options['years'].split(',')]
+
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        databases = runner.setup_databases()
+        try:
+            results = benchmarks.compare_servers(
+                sizes,
+                clients=options['clients'],
+                requests=options['requests'],
+                workers=options['workers'],
+                cars_per_user=options['cars_per_user'],
+                routes=options['routes'].split(','),
+                seed=options['seed'],
+            )
+            for result in results:
+                self.stdout.write(json.dumps(result))
+        finally:
+            runner.teardown_databases(databases)
+            teardown_test_environment()
@@ -0,0 +1,51 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.test.runner import DiscoverRunner
+from django.test.utils import (
+    setup_test_environment,
+    teardown_test_environment,
+)
+
+from gas import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks every view against a throwaway test database, printing "
+        "one JSON object per view and data size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--years',
+            default='1,4,16',
+            help="Comma separated years of history per car to benchmark with.",
+        )
+        parser.add_argument('--cars-per-user', type=int, default=3)
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=20,
+            help="Requests made to every view at every size.",
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        sizes = [float(years) for years in options['years'].split(',')]
+
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        databases = runner.setup_databases()
+        try:
+            results = benchmarks.run(
+                sizes,
+                cars_per_user=options['cars_per_user'],
+                requests=options['requests'],
+                seed=options['seed'],
+            )
+            for result in results:
+                self.stdout.write(json.dumps(result))
+        finally:
+            runner.teardown_databases(databases)
+            teardown_test_environment()
@@ -0,0 +1,71 @@
+import sys
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gas.importers import (
+    FORMATS,
+    KINDS,
+    HistoryImporter,
+    guess_format,
+    read_rows,
+)
+from gas.models import Car
+
+
+class Command(BaseCommand):
+    help = "Imports gas purchases or maintenances for a car from a file."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'car', type=uuid.UUID, metavar='uuid', help="Car to import into.",
+        )
+        parser.add_argument(
+            'path',
+            help="CSV or JSON Lines file to import, or - for standard input.",
+        )
+        parser.add_argument(
+            '--kind',
+            choices=sorted(KINDS),
+            default='gas',
+            help="Whether the file holds gas purchases or maintenances.",
+        )
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            help="File format, guessed from the file extension by default.",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Number of rows to insert per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            car = Car.objects.get(uuid=options['car'])
+        except Car.DoesNotExist:
+            raise CommandError(f"No car with UUID {options['car']}")
+
+        path = options['path']
+        format = options['format'] or guess_format(path)
+        if format is None:
+            raise CommandError("Unable to guess the file format; use --format.")
+
+        importer = HistoryImporter(
+            car,
+            options['kind'],
+            batch_size=options['batch_size'],
+        )
+        if path == '-':
+            result = importer.run(read_rows(sys.stdin, format))
+        else:
+            with open(path, newline='', encoding='utf-8') as f:
+                result = importer.run(read_rows(f, format))
+
+        for number, message in result.errors:
+            self.stderr.write(f"Row {number}: {message}")
+        self.stdout.write(
+            f"Imported {result.created} row(s), skipped {result.failed}."
+        )
@@ -0,0 +1,32 @@
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from gas.models import Car, CarStats
+
+
+class Command(BaseCommand):
+    help = "Recomputes the running statistics of cars from their histories."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'cars',
+            nargs='*',
+            type=uuid.UUID,
+            metavar='uuid',
+            help="Only rebuild the statistics of these cars.",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help="Number of statistics rows to insert per query.",
+        )
+
+    def handle(self, *args, **options):
+        cars = Car.objects.all()
+        if options['cars']:
+            cars = cars.filter(uuid__in=options['cars'])
+
+        stats = CarStats.objects.rebuild(cars, batch_size=options['batch_size'])
+        self.stdout.write(f"Rebuilt statistics for {len(stats)} car(s).")
@@ -0,0 +1,35 @@
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from gas.models import Car, TankSegment
+
+
+class Command(BaseCommand):
+    help = "Recomputes the tank segments of cars from their gas purchases."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'cars',
+            nargs='*',
+            type=uuid.UUID,
+            metavar='uuid',
+            help="Only rebuild the tank segments of these cars.",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help="Number of gas purchases to read and segments to insert at once.",
+        )
+
+    def handle(self, *args, **options):
+        cars = Car.objects.all()
+        if options['cars']:
+            cars = cars.filter(uuid__in=options['cars'])
+
+        segments = TankSegment.objects.rebuild(
+            cars,
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(f"Rebuilt {len(segments)} tank segment(s).")
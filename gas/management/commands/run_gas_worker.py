@@ -0,0 +1,49 @@
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from gas.jobs import work
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the recomputes of cars' derived data queued when "
+        "GAS_RECOMPUTE_MODE is 'queue'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=4,
+            help="Number of jobs to run at once.",
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help="Seconds to wait before checking an empty queue again.",
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help="Exit once the queue is empty instead of waiting for jobs.",
+        )
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            futures = [
+                pool.submit(
+                    work, stop, options['poll_interval'], options['once'],
+                )
+                for _ in range(options['threads'])
+            ]
+            try:
+                count = sum(future.result() for future in futures)
+            except KeyboardInterrupt:
+                stop.set()
+                count = sum(future.result() for future in futures)
+        self.stdout.write(f"Ran {count} recompute job(s).")
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from gas.seeding import seed_fleet
+
+
+class Command(BaseCommand):
+    help = "Generates users with cars and years of fill up history."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1)
+        parser.add_argument('--cars-per-user', type=int, default=2)
+        parser.add_argument(
+            '--years',
+            type=float,
+            default=3,
+            help="Years of history to generate for every car.",
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            help="Random seed, for generating the same fleet again.",
+        )
+
+    def handle(self, *args, **options):
+        cars = seed_fleet(
+            users=options['users'],
+            cars_per_user=options['cars_per_user'],
+            years=options['years'],
+            seed=options['seed'],
+        )
+        self.stdout.write(f"Created {len(cars)} car(s).")
@@ -1,15 +1,238 @@
-import pytz
+import logging
+import threading
+import time
 
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
 from django.utils import timezone
 
+from . import routers, timezones
+
+logger = logging.getLogger('gas.metrics')
+
+
 class TimezoneMiddleware:
+    """
+    Activates the time zone named by the request's timezone cookie, and
+    updates the cookie on responses to requests that changed it (see
+    gas.timezones).
+    """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
-    def __call__(self, request):
-        tzname = request.session.get('django_timezone')
+    def activate(self, request):
+        tzname = timezones.read_cookie(request)
         if tzname:
-            timezone.activate(pytz.timezone(tzname))
+            timezone.activate(timezones.get_timezone(tzname))
         else:
             timezone.deactivate()
-        return self.get_response(request)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.activate(request)
+        return timezones.update_cookie(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        self.activate(request)
+        response = await self.get_response(request)
+        return timezones.update_cookie(request, response)
+
+
+class ReplicaMiddleware:
+    """
+    Sends the reads of safe (GET, HEAD and OPTIONS) requests to the read
+    replica (see gas.routers). Clients that made any other request in the
+    last GAS_DB_REPLICA_STICKINESS seconds, as noted in a cookie, read from
+    the default database instead, so that they see their own writes.
+
+    Enabled when the GAS_DB_REPLICA setting names a replica. Queries made
+    while a streaming response is being sent happen after the response
+    leaves the middleware, and go to the default database.
+    """
+    sync_capable = True
+    async_capable = True
+    cookie_name = 'gas_primary'
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        if not routers.replica():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def reads_from_replica(self, request):
+        return (
+            request.method in self.safe_methods
+            and self.cookie_name not in request.COOKIES
+        )
+
+    def stick(self, request, response):
+        if request.method not in self.safe_methods:
+            response.set_cookie(
+                self.cookie_name,
+                '1',
+                max_age=settings.GAS_DB_REPLICA_STICKINESS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.reads_from_replica(request):
+            return self.stick(request, self.get_response(request))
+        with routers.replica_reads():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not self.reads_from_replica(request):
+            return self.stick(request, await self.get_response(request))
+        with routers.replica_reads():
+            return await self.get_response(request)
+
+
+class QueryMetrics:
+    """
+    A database execute wrapper that counts queries and the time spent in
+    them, from any number of threads at once.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self.duration += duration
+                self.count += 1
+
+
+# The metrics of the request being handled. Context variables are carried
+# into the threads that sync_to_async() runs code in, so the queries made by
+# the worker threads of the async views count towards their request.
+_current_metrics = ContextVar('gas_query_metrics', default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def _install(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def record_thread_queries():
+    """
+    Counts the queries made on the connections this thread already has
+    towards the current request's metrics, for threads (such as those kept
+    by sync_to_async()) whose connections may have connected before the
+    metrics were enabled. New connections are counted as they connect.
+    """
+    if getattr(settings, 'GAS_QUERY_METRICS', False):
+        for connection in connections.all(initialized_only=True):
+            _install(connection)
+
+
+class QueryMetricsMiddleware:
+    """
+    Records the number of queries, the time spent in SQL and the time spent
+    rendering templates for each request. The figures are logged against the
+    URL name and returned in X-Query-Count, X-Query-Time and X-Render-Time
+    response headers (times in milliseconds).
+
+    Queries are counted on every connection, in whichever thread makes them,
+    by an execute wrapper that is installed on each connection as it
+    connects.
+
+    Enabled by the GAS_QUERY_METRICS setting. Queries made while a streaming
+    response is being sent happen after the response leaves the middleware
+    and are not counted.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'GAS_QUERY_METRICS', False):
+            raise MiddlewareNotUsed
+        connection_created.connect(_install, dispatch_uid='gas_query_metrics')
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def start(self, request):
+        record_thread_queries()
+        request._render_time = 0.0
+        return QueryMetrics(), time.perf_counter()
+
+    def finish(self, request, response, metrics, start):
+        total = time.perf_counter() - start
+
+        response['X-Query-Count'] = str(metrics.count)
+        response['X-Query-Time'] = f"{metrics.duration * 1000:.2f}"
+        response['X-Render-Time'] = f"{request._render_time * 1000:.2f}"
+
+        match = request.resolver_match
+        logger.info(
+            "%s queries=%d sql_ms=%.2f render_ms=%.2f total_ms=%.2f",
+            match.view_name if match else request.path,
+            metrics.count,
+            metrics.duration * 1000,
+            request._render_time * 1000,
+            total * 1000,
+        )
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics, start = self.start(request)
+        token = _current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+        return self.finish(request, response, metrics, start)
+
+    async def __acall__(self, request):
+        metrics, start = self.start(request)
+        token = _current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+        return self.finish(request, response, metrics, start)
+
+    def process_template_response(self, request, response):
+        # Template responses are rendered right after the template response
+        # middleware has run, so the render time is measured from here until
+        # the post-render callbacks are called.
+        start = time.perf_counter()
+
+        def finished(response):
+            request._render_time += time.perf_counter() - start
+
+        response.add_post_render_callback(finished)
+        return response
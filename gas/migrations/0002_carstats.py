@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gas', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CarStats',
+            fields=[
+                ('car', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='gas.car')),
+                ('fuel_cost', models.DecimalField(decimal_places=6, default=0, max_digits=16)),
+                ('maintenance_cost', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('gallons', models.DecimalField(decimal_places=3, default=0, max_digits=12)),
+                ('first_odometer', models.IntegerField(null=True)),
+                ('first_gallons', models.DecimalField(decimal_places=3, max_digits=6, null=True)),
+                ('last_odometer', models.IntegerField(null=True)),
+                ('fill_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'car stats',
+            },
+        ),
+    ]
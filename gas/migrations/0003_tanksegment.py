@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gas', '0002_carstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TankSegment',
+            fields=[
+                ('start', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='tank_segment', serialize=False, to='gas.gaspurchase')),
+                ('start_odometer', models.IntegerField()),
+                ('miles', models.IntegerField()),
+                ('gallons', models.DecimalField(decimal_places=3, max_digits=6)),
+                ('mpg', models.DecimalField(decimal_places=6, max_digits=12, null=True)),
+                ('cost_per_mile', models.DecimalField(decimal_places=6, max_digits=12, null=True)),
+                ('end', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='gas.gaspurchase')),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tank_segments', to='gas.car')),
+            ],
+            options={
+                'ordering': ['-start_odometer'],
+                'indexes': [models.Index(fields=['vehicle', 'start_odometer'], name='gas_tankseg_vehicle_302202_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gas', '0003_tanksegment'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='gaspurchase',
+            index=models.Index(fields=['vehicle', 'odometer_reading', 'uuid'], name='gaspurchase_vehicle_odo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gaspurchase',
+            index=models.Index(fields=['vehicle', 'datetime'], name='gaspurchase_vehicle_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='maintenance',
+            index=models.Index(fields=['vehicle', 'odometer_reading', 'uuid'], name='maintenance_vehicle_odo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='maintenance',
+            index=models.Index(fields=['vehicle', 'datetime'], name='maintenance_vehicle_date_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gas', '0006_recomputejob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='gaspurchase',
+            index=models.Index(fields=['datetime', 'uuid'], name='gaspurchase_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gaspurchase',
+            index=models.Index(fields=['odometer_reading'], name='gaspurchase_odo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='maintenance',
+            index=models.Index(fields=['datetime', 'uuid'], name='maintenance_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='maintenance',
+            index=models.Index(fields=['odometer_reading'], name='maintenance_odo_idx'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gas', '0008_user_timezone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTotals',
+            fields=[
+                ('car', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archived_totals', serialize=False, to='gas.car')),
+                ('archived_before', models.DateTimeField()),
+                ('fuel_cost', models.DecimalField(decimal_places=6, default=0, max_digits=16)),
+                ('maintenance_cost', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('gallons', models.DecimalField(decimal_places=3, default=0, max_digits=12)),
+                ('first_odometer', models.IntegerField(null=True)),
+                ('first_gallons', models.DecimalField(decimal_places=3, max_digits=6, null=True)),
+                ('last_odometer', models.IntegerField(null=True)),
+                ('fill_count', models.PositiveIntegerField(default=0)),
+                ('maintenance_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'archived totals',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedGasPurchase',
+            fields=[
+                ('uuid', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('datetime', models.DateTimeField()),
+                ('gallons', models.DecimalField(decimal_places=3, max_digits=6)),
+                ('cost_per_gallon', models.DecimalField(decimal_places=3, max_digits=6)),
+                ('odometer_reading', models.IntegerField()),
+                ('tank_miles', models.IntegerField(null=True)),
+                ('tank_gallons', models.DecimalField(decimal_places=3, max_digits=6, null=True)),
+                ('tank_mpg', models.DecimalField(decimal_places=6, max_digits=12, null=True)),
+                ('tank_cost_per_mile', models.DecimalField(decimal_places=6, max_digits=12, null=True)),
+                ('vehicle', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='gas.car')),
+            ],
+            options={
+                'ordering': ['-odometer_reading'],
+                'indexes': [models.Index(fields=['vehicle', 'odometer_reading', 'uuid'], name='archivedgas_vehicle_odo_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedMaintenance',
+            fields=[
+                ('uuid', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('datetime', models.DateField()),
+                ('cost', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('odometer_reading', models.IntegerField()),
+                ('description', models.TextField()),
+                ('vehicle', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='gas.car')),
+            ],
+            options={
+                'ordering': ['odometer_reading'],
+                'indexes': [models.Index(fields=['vehicle', 'odometer_reading', 'uuid'], name='archivedmaint_vehicle_odo_idx')],
+            },
+        ),
+    ]
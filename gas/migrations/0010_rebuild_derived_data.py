@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def rebuild(apps, schema_editor):
+    # The rebuilds are only available on the real managers, which is safe
+    # while this is the latest migration touching their tables. Histories
+    # recorded before CarStats and TankSegment existed would otherwise show
+    # blank tank MPGs until rebuild_tank_segments is run by hand.
+    from gas.models import CarStats, TankSegment
+
+    TankSegment.objects.rebuild()
+    CarStats.objects.rebuild()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gas', '0009_history_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild, migrations.RunPython.noop),
+    ]
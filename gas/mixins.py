@@ -0,0 +1,205 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db.models import Count, Max, Q
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from .models import Car, CarStats
+from .pagination import MergedCursorPaginator
+
+
+class OwnedObjectMixin(LoginRequiredMixin):
+    """
+    Restricts a single object view to objects owned by the requesting user.
+
+    Ownership is part of the query rather than a separate check, so objects
+    owned by someone else are simply not found, and the object is only looked
+    up once per request no matter how often get_object() is called.
+    """
+    owner_field = 'owner'
+
+    def get_queryset(self):
+        return super().get_queryset().filter(
+            **{self.owner_field: self.request.user}
+        )
+
+    def get_object(self, queryset=None):
+        if queryset is not None:
+            return super().get_object(queryset)
+
+        if not hasattr(self, '_owned_object'):
+            self._owned_object = super().get_object()
+        return self._owned_object
+
+
+class OwnedVehicleObjectMixin(OwnedObjectMixin):
+    """
+    OwnedObjectMixin for gas purchases and maintenances, which are owned
+    through their vehicle.
+    """
+    owner_field = 'vehicle__owner'
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('vehicle')
+
+
+class OwnedCarMixin(LoginRequiredMixin):
+    """
+    Provides the requesting user's car named in the URL as self.car, for
+    views that show something belonging to a car rather than the car itself.
+    """
+    car_url_kwarg = 'uuid'
+
+    @cached_property
+    def car(self):
+        return get_object_or_404(
+            Car.objects.filter(
+                owner=self.request.user,
+            ).select_related('archived_totals'),
+            uuid=self.kwargs.get(self.car_url_kwarg),
+        )
+
+    def car_has_archive(self):
+        return self.car.has_archive
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['car'] = self.car
+        return context
+
+
+class CarConditionMixin:
+    """
+    Answers repeat requests for a car's pages with 304 Not Modified, until
+    something shown on them changes, before the view does any work.
+
+    The time of the car's last change is also added to the context as
+    car_modified, for keying the page's cached template fragments.
+    """
+    car_url_kwarg = 'uuid'
+    # Set for pages that also show the owner's other cars (such as the
+    # gas purchase list's "Move to" choices), which must change whenever
+    # any of them is added, changed or removed as well.
+    shows_other_cars = False
+
+    def car_modified(self, request):
+        if not hasattr(self, '_car_modified'):
+            # Ownership is part of the query, so other users' cars (and
+            # anonymous requests) have no validators at all.
+            stats = CarStats.objects.filter(car__owner=request.user.pk)
+            car = self.kwargs.get(self.car_url_kwarg)
+            self._other_cars = None
+            if self.shows_other_cars:
+                totals = stats.aggregate(
+                    car=Max('updated_at', filter=Q(car=car)),
+                    cars=Max('updated_at'),
+                    count=Count('pk'),
+                )
+                self._car_modified = totals['car']
+                self._other_cars = (totals['cars'], totals['count'])
+            else:
+                self._car_modified = stats.filter(car=car).values_list(
+                    'updated_at', flat=True,
+                ).first()
+        return self._car_modified
+
+    def car_etag(self, request, *args, **kwargs):
+        modified = self.car_modified(request)
+        if modified is None:
+            return None
+        # Dates are rendered in the user's timezone, and list pages differ
+        # by their cursor.
+        parts = [
+            modified.isoformat(),
+            request.get_full_path(),
+            timezone.get_current_timezone_name(),
+        ]
+        if self._other_cars is not None:
+            latest, count = self._other_cars
+            parts += [latest.isoformat(), str(count)]
+        return hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+    def car_last_modified(self, request, *args, **kwargs):
+        modified = self.car_modified(request)
+        if modified is not None and self._other_cars is not None:
+            return max(modified, self._other_cars[0])
+        return modified
+
+    def dispatch(self, request, *args, **kwargs):
+        view = condition(
+            etag_func=self.car_etag,
+            last_modified_func=self.car_last_modified,
+        )(super().dispatch)
+        view = cache_control(private=True, no_cache=True)(view)
+        return view(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['car_modified'] = self.car_modified(self.request)
+        context['fragment_timeout'] = settings.GAS_CACHE_TIMEOUT
+        return context
+
+
+class HistoryFilterMixin:
+    """
+    Filters a list of a car's history with filter_form_class, bound to the
+    query string, and adds the subtotals of every row matching the filters
+    (not just those on the current page) to the context as subtotals.
+
+    The car's rows in archived_model (see gas.archive), if it has any, are
+    listed, filtered and subtotalled along with the rest.
+    """
+    filter_form_class = None
+    archived_model = None
+    subtotal_fields = ('count', 'cost')
+
+    @cached_property
+    def filter_form(self):
+        return self.filter_form_class(self.request.GET or None)
+
+    def get_archived_queryset(self):
+        if not self.car_has_archive():
+            return None
+        return self.archived_model.objects.filter(vehicle=self.car)
+
+    def apply_filters(self, queryset):
+        if self.filter_form.is_bound and self.filter_form.is_valid():
+            queryset = self.filter_form.filter(queryset)
+        return queryset
+
+    def filter_queryset(self, queryset):
+        queryset = self.apply_filters(queryset)
+        archived = self.get_archived_queryset()
+        self.archived_queryset = None
+        if archived is None:
+            return queryset.with_subtotals()
+
+        # The rows of each carry the subtotals of both.
+        archived = self.apply_filters(archived)
+        self.archived_queryset = archived.with_subtotals(queryset)
+        return queryset.with_subtotals(archived)
+
+    def get_cursor_paginator(self, queryset, page_size):
+        querysets = [queryset]
+        if self.archived_queryset is not None:
+            querysets.append(self.archived_queryset)
+        return MergedCursorPaginator(
+            querysets, page_size, self.cursor_ordering,
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['filter_form'] = self.filter_form
+        # Every row carries the same subtotals, and there are none to carry
+        # them when nothing matched.
+        rows = context['object_list']
+        context['subtotals'] = {
+            field: getattr(rows[0], f'subtotal_{field}') if rows else 0
+            for field in self.subtotal_fields
+        }
+        return context
@@ -3,16 +3,88 @@ import uuid
 from decimal import Decimal
 
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models import (
+    Count,
+    DecimalField,
+    F,
+    Max,
+    Min,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.urls import reverse
 
+from .cache import bump_car_versions
+
+
 class User(AbstractUser):
     """
     Custom user class that can be modified later if needed.
     """
-    pass
+    # One of gas.timezones.TIMEZONES, or blank for the default.
+    timezone = models.CharField(max_length=63, blank=True)
+
+
+class CarQuerySet(models.QuerySet):
+    def with_stats(self):
+        """
+        Annotates each car with the aggregates needed by operating_cost and
+        average_mpg so that they can be computed without loading any gas
+        purchases or maintenances.
+        """
+        purchases = GasPurchase.objects.filter(
+            vehicle=OuterRef('pk'),
+        ).order_by().values('vehicle')
+        maintenances = Maintenance.objects.filter(
+            vehicle=OuterRef('pk'),
+        ).order_by().values('vehicle')
+
+        def aggregate(qs, expression, output_field):
+            return Subquery(
+                qs.annotate(value=expression).values('value'),
+                output_field=output_field,
+            )
+
+        money = DecimalField(max_digits=20, decimal_places=6)
+        zero = Value(Decimal(0), output_field=money)
+        return self.annotate(
+            fuel_cost_total=Coalesce(
+                aggregate(
+                    purchases,
+                    Sum(F('gallons') * F('cost_per_gallon'), output_field=money),
+                    money,
+                ),
+                zero,
+            ),
+            maintenance_cost_total=Coalesce(
+                aggregate(maintenances, Sum('cost'), money),
+                zero,
+            ),
+            gallons_total=aggregate(
+                purchases, Sum('gallons'), models.DecimalField(),
+            ),
+            odometer_min=aggregate(
+                purchases, Min('odometer_reading'), models.IntegerField(),
+            ),
+            odometer_max=aggregate(
+                purchases, Max('odometer_reading'), models.IntegerField(),
+            ),
+            fill_count=Coalesce(
+                aggregate(purchases, Count('pk'), models.IntegerField()),
+                Value(0),
+            ),
+            first_fill_gallons=Subquery(
+                purchases.order_by('odometer_reading').values('gallons')[:1],
+            ),
+        )
 
 
 class Car(models.Model):
@@ -24,6 +96,7 @@ class Car(models.Model):
     vin = models.CharField(max_length=17)
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
 
+    objects = CarQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.make} {self.model} - {self.vin}"
@@ -31,32 +104,136 @@ class Car(models.Model):
     def get_absolute_url(self):
         return reverse('car-detail', kwargs={'uuid': str(self.uuid)})
 
+    @property
+    def summary(self):
+        """
+        The car's running statistics, rebuilt on demand if they have never
+        been computed (such as for cars created before CarStats existed).
+        """
+        try:
+            return self.stats
+        except CarStats.DoesNotExist:
+            stats, = CarStats.objects.rebuild(Car.objects.filter(pk=self.pk))
+            Car.stats.related.set_cached_value(self, stats)
+            return stats
+
+    @property
+    def has_archive(self):
+        """
+        Whether any of the car's history has been archived, which needs no
+        query for cars loaded with select_related('archived_totals').
+        """
+        return hasattr(self, 'archived_totals')
+
     @property
     def operating_cost(self):
-        gas_purchases = GasPurchase.objects.filter(vehicle=self)
-        maintenances = Maintenance.objects.filter(vehicle=self)
-        gas_total = sum([purchase.total_cost for purchase in gas_purchases])
-        maint_total = sum([maint.cost for maint in maintenances])
-        return gas_total + maint_total
+        if hasattr(self, 'fuel_cost_total'):
+            return self.fuel_cost_total + self.maintenance_cost_total
+        return self.summary.operating_cost
 
     @property
     def average_mpg(self):
-        gas_purchases = self.gaspurchase_set.order_by('odometer_reading').all()
-        if gas_purchases:
-            total_gallons = sum([purchase.gallons for purchase in gas_purchases])
-            first_odom = gas_purchases[0].odometer_reading
-            first_gallons = gas_purchases[0].gallons
-            last_odom = gas_purchases.last().odometer_reading
+        if hasattr(self, 'gallons_total'):
+            return _average_mpg(
+                self.gallons_total,
+                self.first_fill_gallons,
+                self.odometer_min,
+                self.odometer_max,
+            )
+        return self.summary.average_mpg
 
-            if total_gallons - first_gallons == 0:
-                return 0
 
-            return (last_odom - first_odom) / (total_gallons - first_gallons)
+def _average_mpg(total_gallons, first_gallons, first_odom, last_odom):
+    if not total_gallons:
+        return 0
 
+    # The first fill up only tops off the tank, so the gallons put in at that
+    # point do not contribute to any of the miles driven.
+    gallons = total_gallons - first_gallons
+    if gallons == 0:
         return 0
 
+    return (last_odom - first_odom) / gallons
+
+
+class LoadedValuesMixin:
+    """
+    Remembers the field values a model instance was loaded with so that
+    signal handlers can tell what changed when it is saved again.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def remember_loaded_values(self):
+        # Fields deferred by only() or defer() are loaded with one query,
+        # rather than one each.
+        deferred = self.get_deferred_fields()
+        if deferred:
+            self.refresh_from_db(fields=deferred)
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+        }
+
+
+def _subtotal(queryset, aggregate):
+    # Grouping by vehicle turns the aggregate into a single row subquery for
+    # querysets that are limited to one car.
+    return Subquery(
+        queryset.order_by().values('vehicle').annotate(
+            subtotal=aggregate,
+        ).values('subtotal'),
+    )
+
 
-class GasPurchase(models.Model):
+def _subtotals(querysets, aggregate, output_field):
+    """
+    Adds up the subtotals of several (single car) querysets, such as a car's
+    live and archived rows, any of which may have no rows at all.
+    """
+    zero = Value(0, output_field=output_field)
+    subtotals = [
+        Coalesce(_subtotal(queryset, aggregate), zero,
+                 output_field=output_field)
+        for queryset in querysets
+    ]
+    total = subtotals[0]
+    for subtotal in subtotals[1:]:
+        total = total + subtotal
+    return total
+
+
+class GasPurchaseQuerySet(models.QuerySet):
+    def with_subtotals(self, *others):
+        """
+        Annotates every purchase with the count, gallons and cost of all the
+        purchases in this (single car) queryset. The subtotals are computed
+        by an uncorrelated subquery in the same statement, so a page of
+        purchases carries the totals of the whole filtered history.
+
+        The rows of any other querysets given (such as the car's archived
+        purchases) are included in the subtotals as well.
+        """
+        querysets = [self, *others]
+        return self.annotate(
+            subtotal_count=_subtotals(
+                querysets, Count('pk'), models.IntegerField(),
+            ),
+            subtotal_gallons=_subtotals(
+                querysets, Sum('gallons'), DecimalField(),
+            ),
+            subtotal_cost=_subtotals(querysets, Sum(
+                F('gallons') * F('cost_per_gallon'),
+                output_field=DecimalField(),
+            ), DecimalField()),
+        )
+
+
+class GasPurchase(LoadedValuesMixin, models.Model):
     uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     datetime = models.DateTimeField()
     gallons = models.DecimalField(
@@ -74,6 +251,11 @@ class GasPurchase(models.Model):
     )
     vehicle = models.ForeignKey(Car, on_delete=models.SET_NULL, null=True)
 
+    objects = GasPurchaseQuerySet.as_manager()
+
+    # See ArchivedGasPurchase.
+    archived = False
+
     def __str__(self):
         return f"{self.datetime} {self.gallons}@{self.cost_per_gallon}"
 
@@ -81,15 +263,74 @@ class GasPurchase(models.Model):
     def total_cost(self):
         return self.cost_per_gallon * self.gallons
 
+    def clean(self):
+        """
+        Checks that the odometer reading is no lower than that of the car's
+        previous fill up by date, and no higher than that of the next one.
+        """
+        super().clean()
+        if (self.vehicle_id is None or self.datetime is None
+                or self.odometer_reading is None):
+            return
+
+        previous, following = self.neighbours()
+        if previous is not None and self.odometer_reading < previous:
+            raise ValidationError({'odometer_reading': (
+                f"Must be at least {previous}, the reading at the previous "
+                f"fill up."
+            )})
+        if following is not None and self.odometer_reading > following:
+            raise ValidationError({'odometer_reading': (
+                f"Must be at most {following}, the reading at the next "
+                f"fill up."
+            )})
+
+    def neighbours(self):
+        """
+        Returns the odometer readings of the car's fill ups immediately
+        before and after this one by date (None where there is none), each
+        found with a single bounded lookup on the (vehicle, datetime) index.
+        """
+        purchases = GasPurchase.objects.filter(
+            vehicle_id=self.vehicle_id,
+        ).exclude(pk=self.pk).values_list('odometer_reading', flat=True)
+        previous = purchases.filter(
+            datetime__lt=self.datetime,
+        ).order_by('-datetime').first()
+        following = purchases.filter(
+            datetime__gt=self.datetime,
+        ).order_by('datetime').first()
+
+        if previous is None:
+            # Everything before it may have been archived.
+            previous = ArchivedTotals.objects.filter(
+                car_id=self.vehicle_id, archived_before__lte=self.datetime,
+            ).values_list('last_odometer', flat=True).first()
+        return previous, following
+
     @property
     def tank_mpg(self):
+        # Purchases passed through cache.attach_tank_mpgs() carry the value
+        # that was cached for their car's current version.
+        if hasattr(self, 'cached_tank_mpg'):
+            return self.cached_tank_mpg
+
+        # Purchases fetched with select_related('tank_segment') can use the
+        # precomputed segment, where a missing segment means there is no
+        # later fill up yet.
+        if GasPurchase.tank_segment.is_cached(self):
+            try:
+                return self.tank_segment.mpg
+            except TankSegment.DoesNotExist:
+                return None
+
         # Get all the gas purchases with an odometer reading more than the
         # reading at this purchase, allowing for finding the next reading
         # (the one that is immediately larger than the current purchase).
         qs = GasPurchase.objects.filter(
             vehicle=self.vehicle,
             odometer_reading__gt=self.odometer_reading,
-        ).order_by('odometer_reading')
+        ).order_by('odometer_reading', 'uuid')
         # An empty query set suggests that there are no larger readings (such
         # as the most recent fill up)
         if not qs:
@@ -100,9 +341,45 @@ class GasPurchase(models.Model):
 
     class Meta:
         ordering = ['-odometer_reading']
+        indexes = [
+            models.Index(
+                fields=['vehicle', 'odometer_reading', 'uuid'],
+                name='gaspurchase_vehicle_odo_idx',
+            ),
+            models.Index(
+                fields=['vehicle', 'datetime'],
+                name='gaspurchase_vehicle_date_idx',
+            ),
+            # For the admin, which lists, searches and drills down into
+            # every car's rows at once.
+            models.Index(
+                fields=['datetime', 'uuid'],
+                name='gaspurchase_date_idx',
+            ),
+            models.Index(
+                fields=['odometer_reading'],
+                name='gaspurchase_odo_idx',
+            ),
+        ]
 
 
-class Maintenance(models.Model):
+class MaintenanceQuerySet(models.QuerySet):
+    def with_subtotals(self, *others):
+        """
+        Annotates every maintenance with the count and cost of all the
+        maintenances in this (single car) queryset and any others, like
+        GasPurchaseQuerySet.with_subtotals().
+        """
+        querysets = [self, *others]
+        return self.annotate(
+            subtotal_count=_subtotals(
+                querysets, Count('pk'), models.IntegerField(),
+            ),
+            subtotal_cost=_subtotals(querysets, Sum('cost'), DecimalField()),
+        )
+
+
+class Maintenance(LoadedValuesMixin, models.Model):
     uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     datetime = models.DateField()
     cost = models.DecimalField(
@@ -116,5 +393,579 @@ class Maintenance(models.Model):
     description = models.TextField()
     vehicle = models.ForeignKey(Car, on_delete=models.SET_NULL, null=True)
 
+    objects = MaintenanceQuerySet.as_manager()
+
+    # See ArchivedMaintenance.
+    archived = False
+
     class Meta:
         ordering = ['odometer_reading']
+        indexes = [
+            models.Index(
+                fields=['vehicle', 'odometer_reading', 'uuid'],
+                name='maintenance_vehicle_odo_idx',
+            ),
+            models.Index(
+                fields=['vehicle', 'datetime'],
+                name='maintenance_vehicle_date_idx',
+            ),
+            # For the admin, which lists, searches and drills down into
+            # every car's rows at once.
+            models.Index(
+                fields=['datetime', 'uuid'],
+                name='maintenance_date_idx',
+            ),
+            models.Index(
+                fields=['odometer_reading'],
+                name='maintenance_odo_idx',
+            ),
+        ]
+
+
+class ArchivedGasPurchase(models.Model):
+    """
+    A gas purchase moved out of GasPurchase by the archive_history command,
+    along with the tank MPG it had then (its tank segment is not kept).
+    Archived purchases are read only, but are listed, exported and counted
+    in a car's statistics along with the rest of its history.
+    """
+    uuid = models.UUIDField(primary_key=True, editable=False)
+    datetime = models.DateTimeField()
+    gallons = models.DecimalField(max_digits=6, decimal_places=3)
+    cost_per_gallon = models.DecimalField(max_digits=6, decimal_places=3)
+    odometer_reading = models.IntegerField()
+    vehicle = models.ForeignKey(
+        Car,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='+',
+    )
+    # The columns of the purchase's tank segment, for MPG and rollups.
+    tank_miles = models.IntegerField(null=True)
+    tank_gallons = models.DecimalField(
+        max_digits=6,
+        decimal_places=3,
+        null=True,
+    )
+    tank_mpg = models.DecimalField(max_digits=12, decimal_places=6, null=True)
+    tank_cost_per_mile = models.DecimalField(
+        max_digits=12,
+        decimal_places=6,
+        null=True,
+    )
+
+    objects = GasPurchaseQuerySet.as_manager()
+
+    archived = True
+
+    class Meta:
+        ordering = ['-odometer_reading']
+        indexes = [
+            models.Index(
+                fields=['vehicle', 'odometer_reading', 'uuid'],
+                name='archivedgas_vehicle_odo_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.datetime} {self.gallons}@{self.cost_per_gallon}"
+
+    @property
+    def total_cost(self):
+        return self.cost_per_gallon * self.gallons
+
+
+class ArchivedMaintenance(models.Model):
+    """
+    A maintenance moved out of Maintenance by the archive_history command.
+    """
+    uuid = models.UUIDField(primary_key=True, editable=False)
+    datetime = models.DateField()
+    cost = models.DecimalField(max_digits=10, decimal_places=2)
+    odometer_reading = models.IntegerField()
+    description = models.TextField()
+    vehicle = models.ForeignKey(
+        Car,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='+',
+    )
+
+    objects = MaintenanceQuerySet.as_manager()
+
+    archived = True
+
+    class Meta:
+        ordering = ['odometer_reading']
+        indexes = [
+            models.Index(
+                fields=['vehicle', 'odometer_reading', 'uuid'],
+                name='archivedmaint_vehicle_odo_idx',
+            ),
+        ]
+
+
+class ArchivedTotalsManager(models.Manager):
+    def rebuild(self, car_id, archived_before):
+        """
+        Recomputes the totals of a car's archived history from the archive,
+        noting that everything dated before archived_before has now been
+        archived.
+        """
+        purchases = ArchivedGasPurchase.objects.filter(vehicle_id=car_id)
+        maintenances = ArchivedMaintenance.objects.filter(vehicle_id=car_id)
+        fuel = purchases.aggregate(
+            fuel_cost=Sum(
+                F('gallons') * F('cost_per_gallon'),
+                output_field=DecimalField(max_digits=20, decimal_places=6),
+            ),
+            gallons=Sum('gallons'),
+            fill_count=Count('pk'),
+            last_odometer=Max('odometer_reading'),
+        )
+        first = purchases.order_by('odometer_reading').values_list(
+            'odometer_reading', 'gallons',
+        ).first()
+        maintenance = maintenances.aggregate(
+            maintenance_cost=Sum('cost'),
+            maintenance_count=Count('pk'),
+        )
+        previous = self.filter(car_id=car_id).values_list(
+            'archived_before', flat=True,
+        ).first()
+
+        first_odometer, first_gallons = first or (None, None)
+        totals, _ = self.update_or_create(car_id=car_id, defaults={
+            'archived_before': max(filter(None, [previous, archived_before])),
+            'fuel_cost': fuel['fuel_cost'] or 0,
+            'gallons': fuel['gallons'] or 0,
+            'fill_count': fuel['fill_count'],
+            'first_odometer': first_odometer,
+            'first_gallons': first_gallons,
+            'last_odometer': fuel['last_odometer'],
+            'maintenance_cost': maintenance['maintenance_cost'] or 0,
+            'maintenance_count': maintenance['maintenance_count'],
+        })
+        return totals
+
+
+class ArchivedTotals(models.Model):
+    """
+    The totals of a car's archived history, which its CarStats are rebuilt
+    from (along with its live history) without reading the archive itself.
+    """
+    car = models.OneToOneField(
+        Car,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name='archived_totals',
+    )
+    # Everything dated before this has been archived.
+    archived_before = models.DateTimeField()
+    fuel_cost = models.DecimalField(max_digits=16, decimal_places=6, default=0)
+    maintenance_cost = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        default=0,
+    )
+    gallons = models.DecimalField(max_digits=12, decimal_places=3, default=0)
+    first_odometer = models.IntegerField(null=True)
+    first_gallons = models.DecimalField(
+        max_digits=6,
+        decimal_places=3,
+        null=True,
+    )
+    last_odometer = models.IntegerField(null=True)
+    fill_count = models.PositiveIntegerField(default=0)
+    maintenance_count = models.PositiveIntegerField(default=0)
+
+    objects = ArchivedTotalsManager()
+
+    class Meta:
+        verbose_name_plural = 'archived totals'
+
+    def __str__(self):
+        return f"Archived totals for {self.car_id}"
+
+
+class CarStatsManager(models.Manager):
+    def rebuild(self, cars=None, batch_size=500):
+        """
+        Recomputes the statistics for the given cars (or every car) from
+        their full histories, replacing whatever was stored before.
+        """
+        if cars is None:
+            cars = Car.objects.all()
+
+        # Everything is read in the transaction, and so from the default
+        # database, even during requests that read from the replica.
+        with transaction.atomic():
+            rows = cars.order_by().with_stats().values_list(
+                'pk',
+                'fuel_cost_total',
+                'maintenance_cost_total',
+                'gallons_total',
+                'odometer_min',
+                'first_fill_gallons',
+                'odometer_max',
+                'fill_count',
+            )
+            stats = [
+                CarStats(
+                    car_id=car_id,
+                    fuel_cost=fuel_cost,
+                    maintenance_cost=maintenance_cost,
+                    gallons=gallons or 0,
+                    first_odometer=first_odometer,
+                    first_gallons=first_gallons,
+                    last_odometer=last_odometer,
+                    fill_count=fill_count,
+                )
+                for (car_id, fuel_cost, maintenance_cost, gallons,
+                     first_odometer, first_gallons, last_odometer,
+                     fill_count) in rows
+            ]
+            archived = ArchivedTotals.objects.in_bulk(
+                [row.car_id for row in stats],
+            )
+            for row in stats:
+                if row.car_id in archived:
+                    row.add_archived(archived[row.car_id])
+            # Replaces the rows in place, so that requests rebuilding the
+            # same car at once (see Car.summary) both succeed.
+            self.bulk_create(
+                stats,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=['car'],
+                update_fields=[
+                    'fuel_cost',
+                    'maintenance_cost',
+                    'gallons',
+                    'first_odometer',
+                    'first_gallons',
+                    'last_odometer',
+                    'fill_count',
+                    'updated_at',
+                ],
+            )
+            bump_car_versions(row.car_id for row in stats)
+        return stats
+
+
+class CarStats(models.Model):
+    """
+    Running totals for a car's history, kept up to date as gas purchases and
+    maintenances are written so that summaries never need to scan them.
+    """
+    car = models.OneToOneField(
+        Car,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name='stats',
+    )
+    fuel_cost = models.DecimalField(max_digits=16, decimal_places=6, default=0)
+    maintenance_cost = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        default=0,
+    )
+    gallons = models.DecimalField(max_digits=12, decimal_places=3, default=0)
+    first_odometer = models.IntegerField(null=True)
+    first_gallons = models.DecimalField(
+        max_digits=6,
+        decimal_places=3,
+        null=True,
+    )
+    last_odometer = models.IntegerField(null=True)
+    fill_count = models.PositiveIntegerField(default=0)
+    # The last time anything shown on the car's pages changed, which is what
+    # their ETag and Last-Modified headers are derived from.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = CarStatsManager()
+
+    class Meta:
+        verbose_name_plural = 'car stats'
+
+    def __str__(self):
+        return f"Statistics for {self.car_id}"
+
+    @property
+    def operating_cost(self):
+        return self.fuel_cost + self.maintenance_cost
+
+    @property
+    def average_mpg(self):
+        return _average_mpg(
+            self.gallons,
+            self.first_gallons,
+            self.first_odometer,
+            self.last_odometer,
+        )
+
+    @classmethod
+    def update_for(cls, car_id, update):
+        """
+        Applies update to the locked statistics row for a car. Cars without
+        statistics have them rebuilt from scratch instead, which already
+        accounts for the change being recorded.
+        """
+        with transaction.atomic():
+            try:
+                stats = cls.objects.select_for_update().get(car_id=car_id)
+            except cls.DoesNotExist:
+                cls.objects.rebuild(Car.objects.filter(pk=car_id))
+                return
+            update(stats)
+            stats.save()
+
+    def add_purchase(self, gallons, cost_per_gallon, odometer_reading):
+        self.fuel_cost += gallons * cost_per_gallon
+        self.gallons += gallons
+        self.fill_count += 1
+        if self.first_odometer is None or odometer_reading < self.first_odometer:
+            self.first_odometer = odometer_reading
+            self.first_gallons = gallons
+        if self.last_odometer is None or odometer_reading > self.last_odometer:
+            self.last_odometer = odometer_reading
+
+    def remove_purchase(self, gallons, cost_per_gallon, odometer_reading):
+        self.fuel_cost -= gallons * cost_per_gallon
+        self.gallons -= gallons
+        self.fill_count -= 1
+        if odometer_reading in (self.first_odometer, self.last_odometer):
+            self.refresh_odometer_bounds()
+
+    def refresh_odometer_bounds(self):
+        """
+        Looks up the first and last fill ups, which only needs the two ends
+        of the car's purchases ordered by odometer.
+        """
+        purchases = GasPurchase.objects.filter(vehicle_id=self.car_id)
+        first = purchases.order_by('odometer_reading').values_list(
+            'odometer_reading', 'gallons',
+        ).first()
+        last = purchases.order_by('-odometer_reading').values_list(
+            'odometer_reading', flat=True,
+        ).first()
+        self.first_odometer, self.first_gallons = first or (None, None)
+        self.last_odometer = last
+        archived = ArchivedTotals.objects.filter(car_id=self.car_id).first()
+        if archived is not None:
+            self.add_odometer_bounds(archived)
+
+    def add_archived(self, totals):
+        """
+        Adds the totals of the car's archived history (its ArchivedTotals).
+        """
+        self.fuel_cost += totals.fuel_cost
+        self.maintenance_cost += totals.maintenance_cost
+        self.gallons += totals.gallons
+        self.fill_count += totals.fill_count
+        self.add_odometer_bounds(totals)
+
+    def add_odometer_bounds(self, totals):
+        if totals.first_odometer is not None and (
+                self.first_odometer is None
+                or totals.first_odometer < self.first_odometer):
+            self.first_odometer = totals.first_odometer
+            self.first_gallons = totals.first_gallons
+        if totals.last_odometer is not None and (
+                self.last_odometer is None
+                or totals.last_odometer > self.last_odometer):
+            self.last_odometer = totals.last_odometer
+
+    def add_maintenance(self, cost):
+        self.maintenance_cost += cost
+
+    def remove_maintenance(self, cost):
+        self.maintenance_cost -= cost
+
+
+SEGMENT_PRECISION = Decimal('0.000001')
+
+
+class TankSegmentManager(models.Manager):
+    def refresh(self, purchase):
+        """
+        Recomputes the segment starting at purchase, which ends at the next
+        fill up of the same vehicle. Purchases without a later fill up do
+        not have a segment.
+        """
+        if purchase.vehicle_id is None:
+            self.filter(start=purchase).delete()
+            return None
+
+        end = GasPurchase.objects.filter(
+            vehicle_id=purchase.vehicle_id,
+            odometer_reading__gt=purchase.odometer_reading,
+        ).order_by('odometer_reading', 'uuid').first()
+        if end is None:
+            self.filter(start=purchase).delete()
+            return None
+
+        segment = TankSegment.between(purchase, end)
+        segment.save()
+        return segment
+
+    def refresh_before(self, vehicle_id, odometer_reading):
+        """
+        Recomputes the segments of the fill ups immediately before the given
+        odometer reading, whose end is affected by a purchase being added,
+        moved or removed at that reading.
+        """
+        if vehicle_id is None:
+            return
+
+        purchases = GasPurchase.objects.filter(vehicle_id=vehicle_id)
+        previous_reading = purchases.filter(
+            odometer_reading__lt=odometer_reading,
+        ).order_by('-odometer_reading').values_list(
+            'odometer_reading', flat=True,
+        ).first()
+        if previous_reading is None:
+            return
+
+        for previous in purchases.filter(odometer_reading=previous_reading):
+            self.refresh(previous)
+
+    def rebuild(self, cars=None, batch_size=500):
+        """
+        Recomputes every segment for the given cars (or every car) in a
+        single ordered pass over their purchases.
+        """
+        if cars is None:
+            cars = Car.objects.all()
+
+        purchases = GasPurchase.objects.filter(
+            vehicle__in=cars.values('pk'),
+        ).order_by('vehicle', 'odometer_reading', 'uuid').values_list(
+            'pk',
+            'vehicle_id',
+            'odometer_reading',
+            'gallons',
+            'cost_per_gallon',
+            named=True,
+        )
+
+        segments = []
+        # Purchases at the highest odometer reading seen so far for the
+        # current vehicle, all of which end at the next higher reading.
+        pending = []
+        for purchase in purchases.iterator(chunk_size=batch_size):
+            if pending and pending[0].vehicle_id != purchase.vehicle_id:
+                pending = []
+            if (pending
+                    and pending[0].odometer_reading < purchase.odometer_reading):
+                segments.extend(
+                    TankSegment.between(start, purchase) for start in pending
+                )
+                pending = []
+            pending.append(purchase)
+
+        with transaction.atomic():
+            self.filter(vehicle__in=cars.values('pk')).delete()
+            self.bulk_create(segments, batch_size=batch_size)
+            bump_car_versions(cars.values_list('pk', flat=True))
+        return segments
+
+
+class TankSegment(models.Model):
+    """
+    A tank of gas, from the fill up where it was bought to the next fill up,
+    at which point the gallons used and miles driven are known.
+    """
+    start = models.OneToOneField(
+        GasPurchase,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name='tank_segment',
+    )
+    end = models.ForeignKey(
+        GasPurchase,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    vehicle = models.ForeignKey(
+        Car,
+        on_delete=models.CASCADE,
+        related_name='tank_segments',
+    )
+    start_odometer = models.IntegerField()
+    miles = models.IntegerField()
+    gallons = models.DecimalField(max_digits=6, decimal_places=3)
+    mpg = models.DecimalField(max_digits=12, decimal_places=6, null=True)
+    cost_per_mile = models.DecimalField(
+        max_digits=12,
+        decimal_places=6,
+        null=True,
+    )
+
+    objects = TankSegmentManager()
+
+    class Meta:
+        ordering = ['-start_odometer']
+        indexes = [
+            models.Index(fields=['vehicle', 'start_odometer']),
+        ]
+
+    def __str__(self):
+        return f"{self.start_odometer} +{self.miles} miles"
+
+    @classmethod
+    def between(cls, start, end):
+        """
+        Builds the segment between two purchases, which may be model
+        instances or rows with the same attribute names.
+        """
+        miles = end.odometer_reading - start.odometer_reading
+        mpg = cost_per_mile = None
+        if end.gallons:
+            mpg = (miles / end.gallons).quantize(SEGMENT_PRECISION)
+        if miles:
+            cost = end.gallons * end.cost_per_gallon
+            cost_per_mile = (cost / miles).quantize(SEGMENT_PRECISION)
+        return cls(
+            start_id=start.pk,
+            end_id=end.pk,
+            vehicle_id=start.vehicle_id,
+            start_odometer=start.odometer_reading,
+            miles=miles,
+            gallons=end.gallons,
+            mpg=mpg,
+            cost_per_mile=cost_per_mile,
+        )
+
+
+class RecomputeJob(models.Model):
+    """
+    A request for the run_gas_worker command to recompute a car's derived
+    data, used when GAS_RECOMPUTE_MODE is 'queue'.
+
+    A car has at most one job waiting to be claimed, so a burst of writes to
+    it is coalesced into a single recompute. Writes made while a job is
+    being worked on queue another, as that job may not have seen them.
+    """
+    car = models.ForeignKey(Car, on_delete=models.CASCADE, related_name='+')
+    requested_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['requested_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['car'],
+                condition=Q(claimed_at__isnull=True),
+                name='recomputejob_one_waiting_per_car',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['claimed_at', 'requested_at'],
+                name='recomputejob_claim_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Recompute {self.car_id} requested at {self.requested_at}"
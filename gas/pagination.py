@@ -0,0 +1,238 @@
+"""
+Keyset (cursor) pagination for histories ordered by odometer reading.
+
+Rather than skipping rows with OFFSET and counting the whole history, each
+page continues from the last row of the previous one, so every page costs
+the same single indexed query however deep into the history it is.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+
+def encode_cursor(values, direction):
+    data = json.dumps([direction, [str(value) for value in values]])
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, fields):
+    """
+    Returns the (direction, key values) stored in a cursor token, with each
+    value converted by the matching model field of the ordering, raising
+    ValueError for tokens that were not produced by encode_cursor() for
+    those fields.
+    """
+    try:
+        padding = '=' * (-len(token) % 4)
+        direction, values = json.loads(base64.urlsafe_b64decode(token + padding))
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError(f"Invalid cursor: {token}")
+
+    if (direction not in ('next', 'previous')
+            or not isinstance(values, list)
+            or len(values) != len(fields)
+            or not all(isinstance(value, str) for value in values)):
+        raise ValueError(f"Invalid cursor: {token}")
+    try:
+        values = [
+            field.to_python(value) for field, value in zip(fields, values)
+        ]
+    except ValidationError:
+        raise ValueError(f"Invalid cursor: {token}")
+    return direction, values
+
+
+def ordering_fields(model, ordering):
+    """
+    Returns the model fields of an ordering such as ['-year', 'uuid'].
+    """
+    return [model._meta.get_field(field.lstrip('-')) for field in ordering]
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Paginates a queryset by the given ordering, which must identify rows
+    uniquely (such as an odometer reading followed by the primary key).
+    """
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.model = queryset.model if queryset is not None else None
+        self.per_page = per_page
+        self.ordering = [
+            (field.lstrip('-'), field.startswith('-')) for field in ordering
+        ]
+
+    def _key(self, obj):
+        # Rows from values() querysets are dictionaries.
+        if isinstance(obj, dict):
+            return [obj[field] for field, _ in self.ordering]
+        return [getattr(obj, field) for field, _ in self.ordering]
+
+    def keyset_filter(self, values, reverse=False):
+        """
+        Builds the filter for the rows after the key values in the
+        paginator's ordering, or before them when reverse is set.
+        """
+        q = Q()
+        equal = Q()
+        for (field, descending), value in zip(self.ordering, values):
+            lookup = 'lt' if descending != reverse else 'gt'
+            q |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return q
+
+    def _order_by(self, reverse=False):
+        return [
+            f"{'-' if descending != reverse else ''}{field}"
+            for field, descending in self.ordering
+        ]
+
+    def fetch(self, queryset, values, reverse):
+        """
+        Returns up to one more than a page of the queryset's rows after (or
+        before) the key values, in page order.
+        """
+        qs = queryset.order_by(*self._order_by(reverse))
+        if values is not None:
+            qs = qs.filter(self.keyset_filter(values, reverse))
+        return list(qs[:self.per_page + 1])
+
+    def rows(self, values, reverse):
+        return self.fetch(self.queryset, values, reverse)
+
+    def page(self, cursor=None):
+        """
+        Returns the page following (or preceding) the cursor, or the first
+        page when there is no cursor.
+        """
+        direction, values = 'next', None
+        if cursor:
+            fields = ordering_fields(self.model, self._order_by())
+            try:
+                direction, values = decode_cursor(cursor, fields)
+            except ValueError:
+                raise Http404("Invalid page.")
+
+        reverse = direction == 'previous'
+        rows = self.rows(values, reverse)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        has_next = has_more if not reverse else True
+        has_previous = has_more if reverse else values is not None
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = encode_cursor(self._key(rows[-1]), 'next')
+        if rows and has_previous:
+            previous_cursor = encode_cursor(self._key(rows[0]), 'previous')
+        return CursorPage(rows, next_cursor, previous_cursor)
+
+
+class MergedCursorPaginator(CursorPaginator):
+    """
+    A CursorPaginator over several querysets at once (such as a car's live
+    and archived history), whose rows must all have the ordering's fields.
+    Each page takes one indexed query per queryset, whose rows are merged.
+    """
+
+    def __init__(self, querysets, per_page, ordering):
+        super().__init__(None, per_page, ordering)
+        self.querysets = querysets
+        self.model = querysets[0].model
+
+    def rows(self, values, reverse):
+        rows = []
+        for queryset in self.querysets:
+            rows.extend(self.fetch(queryset, values, reverse))
+        # Sorting by each field in turn, from the last, leaves the rows in
+        # the order of all of them.
+        for index in reversed(range(len(self.ordering))):
+            _, descending = self.ordering[index]
+            rows.sort(
+                key=lambda row: self._key(row)[index],
+                reverse=descending != reverse,
+            )
+        return rows[:self.per_page + 1]
+
+
+class CursorPaginationMixin:
+    """
+    Replaces a ListView's page number pagination with cursor pagination
+    over cursor_ordering. Pages are selected with the ?cursor= parameter.
+    """
+    cursor_ordering = None
+    cursor_kwarg = 'cursor'
+
+    def get_cursor_paginator(self, queryset, page_size):
+        return CursorPaginator(queryset, page_size, self.cursor_ordering)
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = self.get_cursor_paginator(queryset, page_size)
+        page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # The rest of the query string (such as filters), which page links
+        # need to carry over.
+        params = self.request.GET.copy()
+        params.pop(self.cursor_kwarg, None)
+        context['cursor_query'] = params.urlencode()
+        return context
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A page number Paginator (for the admin) that takes the row count of an
+    unfiltered queryset over a large PostgreSQL table from the planner's
+    statistics rather than counting every row.
+    """
+    # Tables estimated to have fewer rows than this are counted exactly.
+    exact_count_limit = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row is not None and row[0] >= self.exact_count_limit:
+                return int(row[0])
+        return super().count
@@ -0,0 +1,111 @@
+"""
+Recomputing the data derived from a car's history (its CarStats and tank
+segments) after writes that the signal handlers cannot follow one row at a
+time, such as bulk updates and deletes.
+
+With GAS_RECOMPUTE_MODE set to 'queue', recomputes are not run by the
+request making the write at all, but queued for the run_gas_worker command
+(see gas.jobs). The default 'sync' mode keeps them in the request.
+"""
+import threading
+
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .cache import bump_car_versions
+from .models import Car, CarStats, RecomputeJob, TankSegment
+
+
+_state = threading.local()
+
+
+def recompute_cars(car_ids):
+    """
+    Rebuilds the statistics and tank segments of the given cars, which also
+    invalidates anything cached for them.
+    """
+    car_ids = {car_id for car_id in car_ids if car_id is not None}
+    if not car_ids:
+        return
+    cars = Car.objects.filter(pk__in=car_ids)
+    CarStats.objects.rebuild(cars)
+    TankSegment.objects.rebuild(cars)
+
+
+def queued():
+    return getattr(settings, 'GAS_RECOMPUTE_MODE', 'sync') == 'queue'
+
+
+def enqueue(car_ids):
+    """
+    Queues a recompute of each of the given cars, unless one is already
+    waiting to be claimed (and so will see the write being recorded).
+    """
+    car_ids = {car_id for car_id in car_ids if car_id is not None}
+    if not car_ids:
+        return
+    for car_id in car_ids:
+        try:
+            with transaction.atomic():
+                RecomputeJob.objects.create(car_id=car_id)
+        except IntegrityError:
+            pass
+
+    # The statistics are unchanged until the worker gets to them, but pages
+    # listing the history itself must not be answered from caches (or with
+    # validators) that predate the write.
+    CarStats.objects.filter(car__in=car_ids).update(updated_at=timezone.now())
+    bump_car_versions(car_ids)
+
+
+def schedule(car_ids):
+    """
+    Recomputes the given cars now, or queues them in 'queue' mode.
+    """
+    if queued():
+        enqueue(car_ids)
+    else:
+        recompute_cars(car_ids)
+
+
+def defer(*car_ids):
+    """
+    Called by the signal handlers before updating derived data for the given
+    cars. Returns True, having noted the cars, when that work is deferred to
+    the end of a deferred_recompute() block or queued for the worker.
+    """
+    deferred = getattr(_state, 'cars', None)
+    if deferred is not None:
+        deferred.update(car_ids)
+        return True
+    if queued():
+        enqueue(car_ids)
+        return True
+    return False
+
+
+@contextmanager
+def deferred_recompute():
+    """
+    Runs the block in a transaction, recomputing (or queueing) every car
+    written to inside it once at the end rather than once per row.
+
+    The set of car IDs to recompute is yielded so that bulk writes which send
+    no signals (such as QuerySet.update()) can add the cars they touch.
+    Nested blocks are folded into the outermost one.
+    """
+    if getattr(_state, 'cars', None) is not None:
+        yield _state.cars
+        return
+
+    _state.cars = cars = set()
+    try:
+        with transaction.atomic():
+            yield cars
+            _state.cars = None
+            schedule(cars)
+    finally:
+        _state.cars = None
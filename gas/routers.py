@@ -0,0 +1,65 @@
+"""
+Sends the reads of requests that only read to the read replica named by the
+GAS_DB_REPLICA setting, when there is one.
+
+Reads go to the replica only inside replica_reads() blocks, which
+ReplicaMiddleware wraps around safe requests. Everything else (writes,
+reads in a transaction on the default database, management commands and the
+recompute worker) uses the default database, so nothing that is about to
+write decides what to write from a replica that may be behind.
+"""
+from contextlib import contextmanager
+
+from asgiref.local import Local
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+# Thread and async task local, and carried into the worker threads of the
+# async views.
+_state = Local()
+
+
+def replica():
+    return getattr(settings, 'GAS_DB_REPLICA', None)
+
+
+@contextmanager
+def replica_reads():
+    """
+    Sends the reads made inside the block to the replica.
+    """
+    previous = getattr(_state, 'replica_reads', False)
+    _state.replica_reads = True
+    try:
+        yield
+    finally:
+        _state.replica_reads = previous
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = replica()
+        if not alias or not getattr(_state, 'replica_reads', False):
+            return None
+        # Reads in a transaction see its writes.
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the default database.
+        alias = replica()
+        databases = {DEFAULT_DB_ALIAS, alias}
+        if alias and {obj1._state.db, obj2._state.db} <= databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema from the default database.
+        if db == replica():
+            return False
+        return None
@@ -0,0 +1,134 @@
+"""
+Generation of realistic looking fleets for local testing and benchmarks.
+
+Every car gets a history of fill ups at increasing odometer readings with
+plausible gaps, fuel economy and prices, plus a maintenance roughly every
+5,000 miles, all written with bulk_create.
+"""
+import datetime
+import random
+import uuid
+
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import (
+    Car,
+    CarStats,
+    GasPurchase,
+    Maintenance,
+    TankSegment,
+    User,
+)
+
+
+MAKES = [
+    ('Honda', ['Civic', 'Fit', 'Accord', 'CR-V']),
+    ('Toyota', ['Corolla', 'Camry', 'Prius', 'RAV4']),
+    ('Ford', ['Focus', 'Fusion', 'Escape', 'F-150']),
+    ('Subaru', ['Impreza', 'Outback', 'Forester']),
+]
+
+MAINTENANCES = [
+    ('Oil change', Decimal('39.99'), Decimal('89.99')),
+    ('Tire rotation', Decimal('19.99'), Decimal('49.99')),
+    ('Brake pads', Decimal('149.00'), Decimal('399.00')),
+    ('Air filter', Decimal('24.99'), Decimal('59.99')),
+]
+
+
+def _money(rng, low, high):
+    return Decimal(rng.uniform(float(low), float(high))).quantize(Decimal('0.01'))
+
+
+def car_history(car, start, end, rng):
+    """
+    Returns unsaved gas purchases and maintenances for a car driven from
+    start to end.
+    """
+    purchases = []
+    maintenances = []
+    mpg = rng.uniform(18, 38)
+    tank = rng.uniform(10, 16)
+    price = rng.uniform(2.2, 3.8)
+    odometer = rng.randint(10, 30000)
+    next_service = odometer
+
+    when = start
+    while when < end:
+        if odometer >= next_service:
+            description, low, high = rng.choice(MAINTENANCES)
+            maintenances.append(Maintenance(
+                vehicle=car,
+                datetime=when.date(),
+                cost=_money(rng, low, high),
+                odometer_reading=odometer,
+                description=description,
+            ))
+            next_service = odometer + rng.randint(4500, 5500)
+
+        gallons = tank * rng.uniform(0.55, 0.95)
+        purchases.append(GasPurchase(
+            vehicle=car,
+            datetime=when,
+            gallons=Decimal(gallons).quantize(Decimal('0.001')),
+            cost_per_gallon=Decimal(price).quantize(Decimal('0.001')),
+            odometer_reading=odometer,
+        ))
+
+        odometer += max(1, int(gallons * mpg * rng.uniform(0.85, 1.15)))
+        price = min(max(price + rng.gauss(0, 0.05), 1.5), 6.0)
+        when += datetime.timedelta(hours=rng.uniform(72, 240))
+
+    return purchases, maintenances
+
+
+def seed_fleet(users=1, cars_per_user=1, years=1, owner=None, seed=None,
+               batch_size=1000):
+    """
+    Creates users (or uses owner) with cars_per_user cars each, every car
+    with years of history up to now. Returns the created cars.
+    """
+    rng = random.Random(seed)
+    end = timezone.now()
+    start = end - datetime.timedelta(days=365 * years)
+
+    if owner is not None:
+        owners = [owner]
+    else:
+        owners = [
+            User.objects.create_user(
+                f'fleet-{uuid.uuid4().hex[:12]}',
+                password='password',
+            )
+            for _ in range(users)
+        ]
+
+    with transaction.atomic():
+        cars = []
+        for user in owners:
+            for _ in range(cars_per_user):
+                make, models = rng.choice(MAKES)
+                year = rng.randint(start.year - 10, start.year)
+                cars.append(Car(
+                    make=make,
+                    model=rng.choice(models),
+                    year=year,
+                    purchase_date=datetime.date(year, rng.randint(1, 12), 1),
+                    vin=''.join(rng.choices('ABCDEFGHJKLMNPRSTUVWXYZ0123456789', k=17)),
+                    owner=user,
+                ))
+        Car.objects.bulk_create(cars, batch_size=batch_size)
+
+        for car in cars:
+            purchases, maintenances = car_history(car, start, end, rng)
+            GasPurchase.objects.bulk_create(purchases, batch_size=batch_size)
+            Maintenance.objects.bulk_create(maintenances, batch_size=batch_size)
+
+        seeded = Car.objects.filter(pk__in=[car.pk for car in cars])
+        CarStats.objects.rebuild(seeded, batch_size=batch_size)
+        TankSegment.objects.rebuild(seeded, batch_size=batch_size)
+
+    return cars
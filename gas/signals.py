@@ -0,0 +1,212 @@
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import recompute, timezones
+from .cache import bump_car_versions
+from .models import (
+    Car,
+    CarStats,
+    GasPurchase,
+    Maintenance,
+    TankSegment,
+)
+
+
+def _purchase_values(values):
+    return (
+        values['gallons'],
+        values['cost_per_gallon'],
+        values['odometer_reading'],
+    )
+
+
+def _swap_loaded_values(instance):
+    """
+    Returns the values a saved instance was loaded with alongside its current
+    values, which then become the loaded values for any later save.
+    """
+    previous = getattr(instance, '_loaded_values', None)
+    instance.remember_loaded_values()
+    return previous, instance._loaded_values
+
+
+def _known(instance, values):
+    """
+    Whether values hold every field of instance, which they do not for
+    instances loaded with only() or defer().
+    """
+    return values is not None and all(
+        field.attname in values for field in instance._meta.concrete_fields
+    )
+
+
+def _record_change(created, previous, current, add, remove):
+    """
+    Moves a saved purchase or maintenance from the statistics of the car it
+    was loaded with to those of the car it now belongs to.
+    """
+    bump_car_versions([current['vehicle_id'], _vehicle_id(previous)])
+    if not created and previous['vehicle_id']:
+        CarStats.update_for(
+            previous['vehicle_id'],
+            lambda stats: remove(stats, previous),
+        )
+    if current['vehicle_id']:
+        CarStats.update_for(
+            current['vehicle_id'],
+            lambda stats: add(stats, current),
+        )
+
+
+def _vehicle_id(values):
+    return values.get('vehicle_id') if values is not None else None
+
+
+def _stored_values(instance):
+    values = getattr(instance, '_loaded_values', None)
+    if values is None:
+        instance.remember_loaded_values()
+        values = instance._loaded_values
+    return values
+
+
+def _recompute_unknown(created, instance, previous, current):
+    """
+    Recomputes the cars a saved row belonged to from scratch when not
+    everything is known about what it looked like before, which is the only
+    safe option. Returns whether it did.
+    """
+    if created or _known(instance, previous):
+        return False
+    recompute.schedule([current['vehicle_id'], _vehicle_id(previous)])
+    return True
+
+
+def _record_delete(values, remove):
+    bump_car_versions([values['vehicle_id']])
+    if values['vehicle_id']:
+        CarStats.update_for(
+            values['vehicle_id'],
+            lambda stats: remove(stats, values),
+        )
+
+
+def _add_purchase(stats, values):
+    stats.add_purchase(*_purchase_values(values))
+
+
+def _remove_purchase(stats, values):
+    stats.remove_purchase(*_purchase_values(values))
+
+
+def _add_maintenance(stats, values):
+    stats.add_maintenance(values['cost'])
+
+
+def _remove_maintenance(stats, values):
+    stats.remove_maintenance(values['cost'])
+
+
+@receiver(post_save, sender=Car)
+def create_car_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        CarStats.objects.create(car=instance)
+
+
+@receiver(post_save, sender=Car)
+def touch_car_stats(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        CarStats.objects.filter(car=instance).update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Car)
+def forget_car(sender, instance, **kwargs):
+    # Its purchases and maintenances are detached with a bulk update that
+    # sends no signals of its own.
+    bump_car_versions([instance.pk])
+
+
+@receiver(pre_delete, sender=GasPurchase)
+@receiver(pre_delete, sender=Maintenance)
+def load_deferred_values(sender, instance, **kwargs):
+    # Fields left out by only() or defer() can no longer be loaded once the
+    # row is gone.
+    values = getattr(instance, '_loaded_values', None)
+    if values is not None and not _known(instance, values):
+        deferred = instance.get_deferred_fields()
+        instance.refresh_from_db(fields=deferred)
+        values.update(
+            {attname: getattr(instance, attname) for attname in deferred},
+        )
+
+
+@receiver(post_save, sender=GasPurchase)
+def record_purchase(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+
+    previous, current = _swap_loaded_values(instance)
+    if recompute.defer(current['vehicle_id'], _vehicle_id(previous)):
+        return
+    if _recompute_unknown(created, instance, previous, current):
+        return
+    _record_change(created, previous, current, _add_purchase, _remove_purchase)
+
+    # The fill up that used to come before this purchase now ends at
+    # whatever came after it, and the one now before it ends at this one.
+    if not created:
+        TankSegment.objects.refresh_before(
+            previous['vehicle_id'], previous['odometer_reading'],
+        )
+    TankSegment.objects.refresh_before(
+        current['vehicle_id'], current['odometer_reading'],
+    )
+    TankSegment.objects.refresh(instance)
+
+
+@receiver(post_delete, sender=GasPurchase)
+def forget_purchase(sender, instance, **kwargs):
+    values = _stored_values(instance)
+    if recompute.defer(values['vehicle_id']):
+        return
+    _record_delete(values, _remove_purchase)
+    TankSegment.objects.refresh_before(
+        values['vehicle_id'], values['odometer_reading'],
+    )
+
+
+@receiver(post_save, sender=Maintenance)
+def record_maintenance(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+
+    previous, current = _swap_loaded_values(instance)
+    if recompute.defer(current['vehicle_id'], _vehicle_id(previous)):
+        return
+    if _recompute_unknown(created, instance, previous, current):
+        return
+    _record_change(
+        created, previous, current, _add_maintenance, _remove_maintenance,
+    )
+
+
+@receiver(post_delete, sender=Maintenance)
+def forget_maintenance(sender, instance, **kwargs):
+    values = _stored_values(instance)
+    if recompute.defer(values['vehicle_id']):
+        return
+    _record_delete(values, _remove_maintenance)
+
+
+@receiver(user_logged_in)
+def restore_timezone(sender, request, user, **kwargs):
+    if request is not None and user.timezone:
+        timezones.remember(request, user.timezone)
+
+
+@receiver(user_logged_out)
+def forget_timezone(sender, request, user, **kwargs):
+    if request is not None:
+        timezones.remember(request, '')
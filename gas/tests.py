@@ -1,3 +1,1607 @@
-from django.test import TestCase
+import base64
+import csv
+import datetime
+import importlib
+import io
+import json
+import re
+import tempfile
 
-# Create your tests here.
+from decimal import Decimal
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections
+from django.db.models import QuerySet
+from django.http import HttpResponse
+from django.test import (
+    AsyncClient,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+    skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import reverse
+
+from . import analytics, api, async_urls, async_views, benchmarks, urls
+from .benchmarks import fetch, route_urls
+from .checks import check_query_plans
+from .middleware import ReplicaMiddleware
+from . import archive, jobs, recompute, timezones, views
+from .admin import GasPurchaseAdmin
+from .cache import attach_car_stats, counters
+from .importers import HistoryImporter, MalformedRow, read_rows
+from .models import (
+    ArchivedGasPurchase,
+    ArchivedMaintenance,
+    ArchivedTotals,
+    Car,
+    CarStats,
+    GasPurchase,
+    Maintenance,
+    RecomputeJob,
+    TankSegment,
+    User,
+)
+from .pagination import CursorPaginator, EstimatedCountPaginator
+from .routers import ReplicaRouter, replica_reads
+from .seeding import seed_fleet
+
+
+class QueryPlanTests(TestCase):
+    def test_hot_queries_use_indexes(self):
+        warnings = check_query_plans(databases=['default'])
+        self.assertEqual(
+            [], [f"{w.id}: {w.msg}\n{w.hint}" for w in warnings],
+        )
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Every page must run a fixed number of queries, no matter how much
+    history the user has.
+    """
+
+    # Queries for each URL name with a cold cache, including the two made by
+    # every logged in request to load the session and the user.
+    budgets = {
+        'index': 2,
+        'cars': 4,
+        'fleet': 5,
+        'car-detail': 9,
+        'car-update': 3,
+        'car-delete': 3,
+        'car-export-csv': 5,
+        'car-export-jsonl': 5,
+        'car-gas-purchases': 7,
+        'car-gas-purchases-bulk': 4,
+        'car-maintenances': 5,
+        'gas-purchase-update': 4,
+        'gas-purchase-delete': 4,
+        'maintenance-update': 4,
+        'maintenance-delete': 3,
+        'add-purchase': 4,
+        'add-car': 2,
+        'add-maintenance': 4,
+        'import-history': 4,
+        'set-timezone': 2,
+        'api-cars': 3,
+        'api-car': 3,
+        'api-car-gas-purchases': 4,
+        'api-car-maintenances': 4,
+        'api-car-rollups': 5,
+        # The archive of every car is rolled up, whether or not it has one.
+        'api-rollups': 4,
+    }
+
+    def setUp(self):
+        self.user = User.objects.create_user('driver', password='password')
+        self.client.force_login(self.user)
+
+    def assert_budgets(self, car):
+        for name, url in route_urls(car):
+            with self.subTest(name=name):
+                cache.clear()
+                with self.assertNumQueries(self.budgets[name]):
+                    response = fetch(self.client, url)
+                self.assertEqual(200, response.status_code)
+
+    def test_every_route_has_a_budget(self):
+        names = {pattern.name for pattern in urls.urlpatterns}
+        self.assertEqual(names, set(self.budgets))
+
+    def test_small_history(self):
+        car, = seed_fleet(owner=self.user, years=0.1, seed=1)
+        self.assert_budgets(car)
+
+    def test_large_fleet(self):
+        car, *_ = seed_fleet(owner=self.user, cars_per_user=8, years=3, seed=1)
+        self.assert_budgets(car)
+
+
+class CarCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('driver', password='password')
+        self.client.force_login(self.user)
+        self.car, = seed_fleet(owner=self.user, years=0.1, seed=1)
+        cache.clear()
+        counters.reset()
+
+    def test_warm_pages_skip_derived_queries(self):
+        # The session is read from the cache as well.
+        warm_budgets = {'car-detail': 3, 'car-gas-purchases': 5}
+        for name, budget in warm_budgets.items():
+            url = reverse(name, args=(self.car.uuid,))
+            with self.subTest(name=name):
+                self.client.get(url)
+                with self.assertNumQueries(budget):
+                    self.client.get(url)
+        self.assertGreater(counters.snapshot()['hits'], 0)
+
+    def test_writes_invalidate_summary(self):
+        url = reverse('car-detail', args=(self.car.uuid,))
+        before = self.client.get(url).context['car'].operating_cost
+        last = self.car.gaspurchase_set.first()
+        GasPurchase.objects.create(
+            vehicle=self.car,
+            datetime=timezone.now(),
+            gallons=Decimal('10.000'),
+            cost_per_gallon=Decimal('3.000'),
+            odometer_reading=last.odometer_reading + 300,
+        )
+        response = self.client.get(url)
+        self.assertEqual(
+            before + Decimal('30'), response.context['car'].operating_cost,
+        )
+        purchase = response.context['recent_purchases'][1]
+        self.assertAlmostEqual(30.0, float(purchase.tank_mpg))
+
+
+class CarStatsTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('driver', password='password')
+        self.car, self.other_car = seed_fleet(
+            owner=user, cars_per_user=2, years=0.2, seed=1,
+        )
+        self.last = self.car.gaspurchase_set.order_by('odometer_reading').last()
+
+    def assert_stats_are_current(self):
+        for car in (self.car, self.other_car):
+            stats = CarStats.objects.get(car=car)
+            expected = Car.objects.with_stats().get(pk=car.pk)
+            self.assertEqual(expected.operating_cost, stats.operating_cost)
+            self.assertEqual(expected.average_mpg, stats.average_mpg)
+            self.assertEqual(
+                car.gaspurchase_set.count(), stats.fill_count,
+            )
+
+    def add_purchase(self):
+        return GasPurchase.objects.create(
+            vehicle=self.car,
+            datetime=self.last.datetime + datetime.timedelta(days=7),
+            gallons=Decimal('10.000'),
+            cost_per_gallon=Decimal('3.000'),
+            odometer_reading=self.last.odometer_reading + 300,
+        )
+
+    def test_add_move_and_remove(self):
+        purchase = self.add_purchase()
+        self.assert_stats_are_current()
+
+        purchase = GasPurchase.objects.get(pk=purchase.pk)
+        purchase.vehicle = self.other_car
+        purchase.save()
+        self.assert_stats_are_current()
+
+        purchase.delete()
+        self.assert_stats_are_current()
+
+        maintenance = self.car.maintenance_set.first()
+        maintenance.cost += 100
+        maintenance.save()
+        self.assert_stats_are_current()
+
+    def test_deferred_fields(self):
+        purchase = GasPurchase.objects.only('gallons').get(pk=self.last.pk)
+        purchase.gallons += 1
+        purchase.save()
+        self.assert_stats_are_current()
+
+        purchase = GasPurchase.objects.defer('vehicle').get(pk=self.last.pk)
+        purchase.delete()
+        self.assert_stats_are_current()
+
+        maintenance = Maintenance.objects.only('cost').filter(
+            vehicle=self.car,
+        ).first()
+        maintenance.cost += 100
+        maintenance.save()
+        self.assert_stats_are_current()
+
+    def test_with_stats_totals(self):
+        Car.objects.create(
+            make="Empty", model="Car", year=2020, owner=self.car.owner,
+            purchase_date=datetime.date(2020, 1, 1), vin='1' * 17,
+        )
+        for car in Car.objects.with_stats():
+            purchases = list(car.gaspurchase_set.all())
+            readings = [p.odometer_reading for p in purchases]
+            with self.subTest(car=car.make):
+                self.assertEqual(
+                    sum(p.total_cost for p in purchases), car.fuel_cost_total,
+                )
+                self.assertEqual(
+                    sum(m.cost for m in car.maintenance_set.all()),
+                    car.maintenance_cost_total,
+                )
+                self.assertEqual(len(purchases), car.fill_count)
+                self.assertEqual(min(readings, default=None), car.odometer_min)
+                self.assertEqual(max(readings, default=None), car.odometer_max)
+                self.assertEqual(
+                    car.summary.operating_cost, car.operating_cost,
+                )
+                self.assertAlmostEqual(
+                    float(car.summary.average_mpg), float(car.average_mpg),
+                )
+
+    def test_missing_stats_are_rebuilt_once(self):
+        CarStats.objects.filter(car=self.car).delete()
+        car = Car.objects.get(pk=self.car.pk)
+        fill_count = car.summary.fill_count
+        self.assertEqual(self.car.gaspurchase_set.count(), fill_count)
+        with self.assertNumQueries(0):
+            self.assertEqual(fill_count, car.summary.fill_count)
+
+    def test_concurrent_rebuilds_replace_the_row(self):
+        CarStats.objects.filter(car=self.car).delete()
+        car = Car.objects.get(pk=self.car.pk)
+
+        def rebuilt_elsewhere(*args, **kwargs):
+            # Another request finishes rebuilding the car while this one is
+            # still reading its history.
+            CarStats.objects.create(car=car, fill_count=0)
+            return {}
+
+        with mock.patch.object(
+                ArchivedTotals.objects, 'in_bulk', rebuilt_elsewhere):
+            fill_count = car.summary.fill_count
+        self.assertEqual(self.car.gaspurchase_set.count(), fill_count)
+        self.assertEqual(
+            fill_count, CarStats.objects.get(car=self.car).fill_count,
+        )
+
+
+class TankSegmentTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('driver', password='password')
+        self.car, = seed_fleet(owner=user, years=0.2, seed=1)
+        self.last = self.car.gaspurchase_set.order_by('odometer_reading').last()
+
+    def add_purchase(self, days, miles):
+        return GasPurchase.objects.create(
+            vehicle=self.car,
+            datetime=self.last.datetime + datetime.timedelta(days=days),
+            gallons=Decimal('10.000'),
+            cost_per_gallon=Decimal('3.000'),
+            odometer_reading=self.last.odometer_reading + miles,
+        )
+
+    def assert_segments_are_current(self, *cars):
+        for car in cars or (self.car,):
+            stored = {
+                segment.start_id: (segment.end_id, segment.mpg)
+                for segment in TankSegment.objects.filter(vehicle=car)
+            }
+            TankSegment.objects.rebuild(Car.objects.filter(pk=car.pk))
+            rebuilt = {
+                segment.start_id: (segment.end_id, segment.mpg)
+                for segment in TankSegment.objects.filter(vehicle=car)
+            }
+            self.assertEqual(rebuilt, stored)
+
+    def test_refresh_before_insert_move_and_delete(self):
+        other_car, = seed_fleet(owner=self.car.owner, years=0.2, seed=2)
+        # Between the last two fill ups, which changes where the one before
+        # it ends.
+        before_last = self.car.gaspurchase_set.order_by(
+            '-odometer_reading',
+        )[1]
+        purchase = GasPurchase.objects.create(
+            vehicle=self.car,
+            datetime=before_last.datetime + datetime.timedelta(hours=1),
+            gallons=Decimal('2.000'),
+            cost_per_gallon=Decimal('3.000'),
+            odometer_reading=before_last.odometer_reading + 50,
+        )
+        self.assertEqual(
+            purchase.pk, TankSegment.objects.get(start=before_last).end_id,
+        )
+        self.assert_segments_are_current()
+
+        purchase.vehicle = other_car
+        purchase.save()
+        self.assert_segments_are_current(self.car, other_car)
+
+        purchase.delete()
+        self.assert_segments_are_current(self.car, other_car)
+        self.assertEqual(
+            self.last.pk, TankSegment.objects.get(start=before_last).end_id,
+        )
+
+    def test_migration_builds_existing_history(self):
+        migration = importlib.import_module(
+            'gas.migrations.0010_rebuild_derived_data',
+        )
+        stored = {
+            segment.start_id: segment.mpg
+            for segment in TankSegment.objects.filter(vehicle=self.car)
+        }
+        average_mpg = self.car.stats.average_mpg
+        TankSegment.objects.all().delete()
+        CarStats.objects.all().delete()
+
+        migration.rebuild(apps, None)
+        self.assertEqual(stored, {
+            segment.start_id: segment.mpg
+            for segment in TankSegment.objects.filter(vehicle=self.car)
+        })
+        self.assertEqual(
+            average_mpg, CarStats.objects.get(car=self.car).average_mpg,
+        )
+
+    def test_tank_mpg_skips_equal_readings(self):
+        for days, miles in ((7, 300), (8, 300), (14, 600)):
+            self.add_purchase(days, miles)
+        segments = self.car.gaspurchase_set.select_related('tank_segment')
+        expected = {purchase.pk: purchase.tank_mpg for purchase in segments}
+        # Without the segments, each purchase looks up the next fill up.
+        purchases = list(self.car.gaspurchase_set.all())
+        for purchase in purchases:
+            with self.subTest(odometer_reading=purchase.odometer_reading):
+                if expected[purchase.pk] is None:
+                    self.assertIsNone(purchase.tank_mpg)
+                else:
+                    self.assertAlmostEqual(
+                        float(expected[purchase.pk]),
+                        float(purchase.tank_mpg), places=5,
+                    )
+        mpgs = [
+            purchase.tank_mpg for purchase in purchases
+            if purchase.odometer_reading == self.last.odometer_reading + 300
+        ]
+        self.assertEqual([30, 30], mpgs)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('driver', password='password')
+        self.client.force_login(self.user)
+        self.car, = seed_fleet(owner=self.user, years=0.3, seed=1)
+        self.mpgs = {
+            purchase.odometer_reading: purchase.tank_mpg
+            for purchase in self.car.gaspurchase_set.select_related(
+                'tank_segment',
+            )
+        }
+
+    def export(self, name):
+        response = self.client.get(reverse(name, args=(self.car.uuid,)))
+        self.assertEqual(200, response.status_code)
+        return b''.join(response.streaming_content).decode()
+
+    def assert_tank_mpgs(self, records):
+        gas = [record for record in records if record['type'] == 'gas']
+        self.assertEqual(len(self.mpgs), len(gas))
+        for record in gas:
+            expected = self.mpgs[int(record['odometer_reading'])]
+            with self.subTest(odometer_reading=record['odometer_reading']):
+                if expected is None:
+                    self.assertIn(record['tank_mpg'], ('', None))
+                else:
+                    self.assertAlmostEqual(
+                        float(expected), float(record['tank_mpg']), places=3,
+                    )
+        # The last fill up's tank is still being driven.
+        self.assertIn(gas[-1]['tank_mpg'], ('', None))
+
+    def test_csv_tank_mpg(self):
+        content = self.export('car-export-csv')
+        self.assert_tank_mpgs(list(csv.DictReader(io.StringIO(content))))
+
+    def test_jsonl_tank_mpg(self):
+        content = self.export('car-export-jsonl')
+        self.assert_tank_mpgs([
+            json.loads(line) for line in content.splitlines()
+        ])
+
+
+class OwnershipTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner', password='password')
+        self.car, = seed_fleet(owner=owner, years=0.1, seed=1)
+        self.purchase = self.car.gaspurchase_set.first()
+        self.maintenance = self.car.maintenance_set.first()
+        self.client.force_login(
+            User.objects.create_user('other', password='password'),
+        )
+
+    def test_other_users_pages_are_not_found(self):
+        car = (self.car.uuid,)
+        urls = [
+            reverse(name, args=car)
+            for name in ('car-detail', 'car-update', 'car-delete',
+                         'car-gas-purchases', 'car-maintenances',
+                         'car-export-csv')
+        ] + [
+            reverse(name, args=car + (self.purchase.uuid,))
+            for name in ('gas-purchase-update', 'gas-purchase-delete')
+        ] + [
+            reverse(name, args=car + (self.maintenance.uuid,))
+            for name in ('maintenance-update', 'maintenance-delete')
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(404, self.client.get(url).status_code)
+
+    def test_other_users_objects_are_not_deleted(self):
+        response = self.client.post(reverse(
+            'gas-purchase-delete', args=(self.car.uuid, self.purchase.uuid),
+        ))
+        self.assertEqual(404, response.status_code)
+        self.assertTrue(
+            GasPurchase.objects.filter(pk=self.purchase.pk).exists(),
+        )
+
+
+class ConditionalCarPageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('driver', password='password')
+        self.client.force_login(self.user)
+        self.car, = seed_fleet(owner=self.user, years=0.1, seed=1)
+        self.url = reverse('car-detail', args=(self.car.uuid,))
+
+    def test_unchanged_page_is_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+
+    def test_other_users_get_no_validators(self):
+        etag = self.client.get(self.url)['ETag']
+        other = User.objects.create_user('other', password='password')
+        self.client.force_login(other)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(404, response.status_code)
+
+    def test_edits_change_validators(self):
+        purchase = self.car.gaspurchase_set.first()
+        edits = [
+            (reverse('gas-purchase-update', args=(self.car.uuid, purchase.uuid)), {
+                'vehicle': self.car.uuid,
+                'datetime': purchase.datetime.strftime('%Y-%m-%d %H:%M:%S'),
+                'odometer_reading': purchase.odometer_reading,
+                'gallons': '12.000',
+                'cost_per_gallon': '2.999',
+            }),
+            (reverse('car-update', args=(self.car.uuid,)), {
+                'make': 'Edited',
+                'model': self.car.model,
+                'year': self.car.year,
+                'purchase_date': self.car.purchase_date,
+                'vin': self.car.vin,
+            }),
+            (reverse('gas-purchase-delete', args=(self.car.uuid, purchase.uuid)), {}),
+        ]
+        for url, data in edits:
+            with self.subTest(url=url):
+                etag = self.client.get(self.url)['ETag']
+                self.assertEqual(302, self.client.post(url, data).status_code)
+                response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(200, response.status_code)
+
+    def test_other_cars_change_purchase_list_validators(self):
+        url = reverse('car-gas-purchases', args=(self.car.uuid,))
+        etag = self.client.get(url)['ETag']
+        other, = seed_fleet(owner=self.user, years=0.1, seed=2)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        self.assertContains(response, other.vin)
+
+        etag = response['ETag']
+        other.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        self.assertNotContains(response, other.vin)
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('driver', password='password')
+        self.client.force_login(self.user)
+        self.car, = seed_fleet(owner=self.user, years=0.5, seed=1)
+
+    def test_car_matches_html_stats(self):
+        data = self.client.get(reverse('api-car', args=(self.car.uuid,))).json()
+        self.assertEqual(str(self.car.uuid), data['uuid'])
+        self.assertAlmostEqual(
+            float(self.car.operating_cost), float(data['operating_cost']),
+        )
+        self.assertAlmostEqual(
+            float(self.car.average_mpg), float(data['average_mpg']),
+        )
+
+    def test_average_mpg_matches_html_without_history(self):
+        car, = seed_fleet(owner=self.user, years=0.1, seed=2)
+        car.gaspurchase_set.all().delete()
+        CarStats.objects.filter(car=self.car).delete()
+        data = self.client.get(reverse('api-cars')).json()['results']
+        by_uuid = {row['uuid']: row for row in data}
+        for each in Car.objects.filter(pk__in=[car.pk, self.car.pk]):
+            with self.subTest(car=each.pk):
+                self.assertAlmostEqual(
+                    float(each.average_mpg),
+                    float(by_uuid[str(each.pk)]['average_mpg']),
+                )
+        self.assertEqual(0, by_uuid[str(car.pk)]['average_mpg'])
+        self.assertTrue(CarStats.objects.filter(car=self.car).exists())
+
+    def test_field_selection(self):
+        url = reverse('api-car-gas-purchases', args=(self.car.uuid,))
+        response = self.client.get(url, {'fields': 'odometer_reading,tank_mpg'})
+        rows = response.json()['results']
+        self.assertEqual({'odometer_reading', 'tank_mpg'}, set(rows[0]))
+        purchase = self.car.gaspurchase_set.get(
+            odometer_reading=rows[1]['odometer_reading'],
+        )
+        self.assertAlmostEqual(
+            float(purchase.tank_mpg), float(rows[1]['tank_mpg']), places=5,
+        )
+
+        response = self.client.get(url, {'fields': 'uuid,owner'})
+        self.assertEqual(400, response.status_code)
+
+    @mock.patch.object(api.GasPurchaseListApiView, 'paginate_by', 7)
+    def test_cursor_pagination(self):
+        url = reverse('api-car-gas-purchases', args=(self.car.uuid,))
+        url += '?fields=uuid'
+        seen = []
+        while url:
+            data = self.client.get(url).json()
+            self.assertLessEqual(len(data['results']), 7)
+            seen.extend(row['uuid'] for row in data['results'])
+            url = data['next']
+        expected = self.car.gaspurchase_set.order_by(
+            '-odometer_reading', '-uuid',
+        ).values_list('uuid', flat=True)
+        self.assertEqual([str(uuid) for uuid in expected], seen)
+
+    def test_other_users_cars_are_not_found(self):
+        other = User.objects.create_user('other', password='password')
+        self.client.force_login(other)
+        for name in ('api-car', 'api-car-gas-purchases', 'api-car-maintenances'):
+            with self.subTest(name=name):
+                response = self.client.get(reverse(name, args=(self.car.uuid,)))
+                self.assertEqual(404, response.status_code)
+        self.assertEqual(
+            [], self.client.get(reverse('api-cars')).json()['results'],
+        )
+
+
+class AnalyticsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('driver', password='password')
+        self.client.force_login(self.user)
+        self.car, = seed_fleet(owner=self.user, years=1, seed=1)
+
+    def test_rollups_match_purchases(self):
+        months = analytics.rollups(self.car.gaspurchase_set.all())
+        purchases = list(self.car.gaspurchase_set.all())
+        self.assertEqual(len(purchases), sum(m['fill_count'] for m in months))
+        self.assertEqual(
+            sum(p.total_cost for p in purchases),
+            sum(m['spend'] for m in months),
+        )
+
+        month = months[len(months) // 2]
+        in_month = [
+            p for p in purchases
+            if timezone.localtime(p.datetime).date().replace(day=1)
+            == month['period']
+        ]
+        with_next = [p for p in in_month if p.tank_mpg is not None]
+        miles = sum(p.tank_segment.miles for p in with_next)
+        gallons = sum(p.tank_segment.gallons for p in with_next)
+        self.assertAlmostEqual(
+            float(miles / gallons), float(month['mpg']), places=3,
+        )
+
+    def test_rolling_stats_without_numpy(self):
+        values = [22.5, 30.1, 27.4, 25.0, 31.9, 24.2, 28.8]
+        expected = analytics.rolling_stats(values, 3)
+        with mock.patch.object(analytics, 'np', None):
+            fallback = analytics.rolling_stats(values, 3)
+        self.assertEqual([None, None], fallback['mean'][:2])
+        for key, series in expected.items():
+            for a, b in zip(series[2:], fallback[key][2:]):
+                self.assertAlmostEqual(a, b)
+
+    def test_rollup_endpoints(self):
+        url = reverse('api-car-rollups', args=(self.car.uuid,))
+        data = self.client.get(url, {'period': 'week', 'window': 4}).json()
+        self.assertEqual('week', data['period'])
+        series = data['mpg_series']
+        self.assertEqual(len(series['mpg']), len(series['p90']))
+
+        for params in ({'period': 'year'}, {'window': 0}, {'window': 'x'}):
+            with self.subTest(params=params):
+                response = self.client.get(url, params)
+                self.assertEqual(400, response.status_code)
+
+
+class FleetDashboardTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('driver', password='password')
+        self.client.force_login(self.user)
+
+    def test_queries_do_not_grow_with_the_fleet(self):
+        for cars_per_user in (1, 6):
+            seed_fleet(
+                owner=self.user, cars_per_user=cars_per_user, years=1.5,
+                seed=cars_per_user,
+            )
+            with self.subTest(cars=self.user.car_set.count()):
+                with self.assertNumQueries(4):
+                    response = self.client.get(reverse('fleet'))
+                self.assertEqual(
+                    self.user.car_set.count(), len(response.context['rows']),
+                )
+
+    def test_totals(self):
+        cars = seed_fleet(owner=self.user, cars_per_user=3, years=1.5, seed=1)
+        rows, totals = analytics.fleet_summary(self.user)
+        self.assertEqual(
+            sum(car.operating_cost for car in cars), totals['cost'],
+        )
+
+        since = timezone.now() - analytics.TRAILING_PERIOD
+        row = rows[0]
+        car = row['car']
+        trailing_cost = sum(
+            p.total_cost
+            for p in car.gaspurchase_set.filter(datetime__gte=since)
+        ) + sum(
+            m.cost for m in car.maintenance_set.filter(datetime__gte=since)
+        )
+        self.assertEqual(trailing_cost, row['trailing_cost'])
+        self.assertEqual(
+            car.gaspurchase_set.order_by('-datetime').first().datetime,
+            row['last_fill_up'],
+        )
+
+
+class ImportHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('driver', password='password')
+        self.client.force_login(self.user)
+        self.car, = seed_fleet(owner=self.user, years=0.1, seed=1)
+        self.count = self.car.gaspurchase_set.count()
+        self.lines = [
+            'datetime,odometer_reading,gallons,cost_per_gallon',
+            '2030-01-01 08:00,90000,10.5,3.199',
+            '2030-01-08 08:00,90300,not a number,3.199',
+            '2030-01-15 08:00,90600,11.25,3.249',
+        ]
+
+    def upload(self, name, content, kind='gas'):
+        return self.client.post(reverse('import-history'), {
+            'vehicle': self.car.uuid,
+            'kind': kind,
+            'file': SimpleUploadedFile(name, content),
+        })
+
+    def test_command_reports_invalid_rows(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            f.write('\n'.join(self.lines))
+            f.flush()
+            out, err = io.StringIO(), io.StringIO()
+            call_command(
+                'import_history', str(self.car.uuid), f.name,
+                stdout=out, stderr=err,
+            )
+        self.assertIn("Imported 2 row(s), skipped 1.", out.getvalue())
+        self.assertIn("Row 2: gallons:", err.getvalue())
+        self.assertEqual(self.count + 2, self.car.gaspurchase_set.count())
+
+    def test_commands_reject_malformed_uuids(self):
+        commands = [
+            ('import_history', 'not-a-uuid', '-'),
+            ('archive_history', 'not-a-uuid'),
+            ('audit_odometers', str(self.car.uuid), 'not-a-uuid'),
+            ('rebuild_car_stats', 'not-a-uuid'),
+            ('rebuild_tank_segments', 'not-a-uuid'),
+        ]
+        for args in commands:
+            with self.subTest(command=args[0]):
+                with self.assertRaisesRegex(CommandError, 'invalid UUID'):
+                    call_command(*args, stdout=io.StringIO())
+
+    def test_upload_jsonl(self):
+        content = '\n'.join([
+            json.dumps({
+                'datetime': '2030-01-01', 'odometer_reading': 90000,
+                'cost': '45.00', 'description': "Oil change",
+            }),
+            '{"datetime": ',
+            '[]',
+        ]).encode()
+        response = self.upload('history.jsonl', content, kind='maintenance')
+        result = response.context['result']
+        self.assertEqual(1, result.created)
+        self.assertEqual([2, 3], [number for number, _ in result.errors])
+        self.assertTrue(self.car.maintenance_set.filter(
+            description="Oil change",
+        ).exists())
+
+    def test_non_utf8_files_are_rejected(self):
+        content = '\n'.join(self.lines[:2] + ['été']).encode('latin-1')
+        response = self.upload('history.csv', content)
+        self.assertEqual(200, response.status_code)
+        self.assertIn('file', response.context['form'].errors)
+        self.assertEqual(self.count, self.car.gaspurchase_set.count())
+
+        # Files that are read as they are imported report it as a row error.
+        lines = io.TextIOWrapper(io.BytesIO(content), encoding='utf-8')
+        rows = list(read_rows(lines, 'csv'))
+        self.assertIsInstance(rows[-1], MalformedRow)
+
+    def test_rows_that_cannot_be_saved_are_named(self):
+        bulk_create = GasPurchase.objects.bulk_create
+
+        def failing_bulk_create(instances, *args, **kwargs):
+            if any(i.odometer_reading == 90600 for i in instances):
+                raise IntegrityError("rejected")
+            return bulk_create(instances, *args, **kwargs)
+
+        lines = self.lines[:2] + self.lines[3:] + [
+            '2030-01-22 08:00,90900,9.5,3.299',
+        ]
+        with mock.patch.object(
+            GasPurchase.objects, 'bulk_create', failing_bulk_create,
+        ):
+            result = HistoryImporter(self.car, 'gas').run(
+                read_rows(lines, 'csv'),
+            )
+        self.assertEqual(2, result.created)
+        self.assertEqual(
+            [(2, "Could not be saved: rejected")], result.errors,
+        )
+
+
+class HistoryFilterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('driver', password='password')
+        self.client.force_login(self.user)
+        self.car, = seed_fleet(owner=self.user, years=2, seed=1)
+
+    def test_purchase_filters_and_subtotals(self):
+        purchases = list(self.car.gaspurchase_set.all())
+        start = timezone.localtime(purchases[-10].datetime).date()
+        end = timezone.localtime(purchases[10].datetime).date()
+        params = {
+            'start_date': start.isoformat(),
+            'end_date': end.isoformat(),
+            'min_odometer': purchases[-5].odometer_reading,
+            'max_price': '3.500',
+        }
+        expected = [
+            p for p in purchases
+            if start <= timezone.localtime(p.datetime).date() <= end
+            and p.odometer_reading >= params['min_odometer']
+            and p.cost_per_gallon <= Decimal(params['max_price'])
+        ]
+
+        url = reverse('car-gas-purchases', args=(self.car.uuid,))
+        cache.clear()
+        with self.assertNumQueries(QueryBudgetTests.budgets['car-gas-purchases']):
+            response = self.client.get(url, params)
+        subtotals = response.context['subtotals']
+        self.assertEqual(len(expected), subtotals['count'])
+        self.assertEqual(sum(p.gallons for p in expected), subtotals['gallons'])
+        self.assertEqual(
+            sum(p.total_cost for p in expected), subtotals['cost'],
+        )
+
+        # Later pages keep the filters.
+        seen = []
+        while True:
+            seen.extend(p.uuid for p in response.context['object_list'])
+            cursor = response.context['page_obj'].next_cursor
+            if not cursor:
+                break
+            response = self.client.get(url, {**params, 'cursor': cursor})
+        self.assertEqual([p.uuid for p in expected], seen)
+
+    def test_previous_and_next_links(self):
+        purchases = self.car.gaspurchase_set.order_by(
+            '-odometer_reading', '-uuid',
+        )
+        paginator = CursorPaginator(
+            purchases, 7, ['-odometer_reading', '-uuid'],
+        )
+        first = paginator.page()
+        self.assertFalse(first.has_previous())
+        second = paginator.page(first.next_cursor)
+        self.assertEqual(list(purchases[7:14]), list(second))
+
+        # Going back from the second page gives the first one again, which
+        # has nothing before it.
+        back = paginator.page(second.previous_cursor)
+        self.assertEqual(list(first), list(back))
+        self.assertFalse(back.has_previous())
+        self.assertEqual(
+            list(second), list(paginator.page(back.next_cursor)),
+        )
+
+        page = second
+        while page.has_next():
+            page = paginator.page(page.next_cursor)
+        self.assertEqual(purchases.last(), list(page)[-1])
+        self.assertTrue(page.has_previous())
+
+        # Both links are on the pages.
+        url = reverse('car-gas-purchases', args=(self.car.uuid,))
+        response = self.client.get(url)
+        page = response.context['page_obj']
+        self.assertIsNone(page.previous_cursor)
+        response = self.client.get(url, {'cursor': page.next_cursor})
+        page = response.context['page_obj']
+        self.assertContains(response, 'cursor=' + page.previous_cursor)
+        self.assertContains(response, 'cursor=' + page.next_cursor)
+
+    def test_bad_cursors_are_not_found(self):
+        def cursor(data):
+            token = base64.urlsafe_b64encode(json.dumps(data).encode())
+            return token.decode()
+
+        bad = [
+            'not a cursor',
+            cursor(['next', ['abc', 'def']]),
+            cursor(['next', ['100', 'not-a-uuid']]),
+            cursor(['next', [None, None]]),
+            cursor(['next', [['100'], {}]]),
+            cursor(['next', ['100']]),
+            cursor(['sideways', ['100', str(self.car.uuid)]]),
+        ]
+        for name in ('car-gas-purchases', 'car-maintenances'):
+            url = reverse(name, args=(self.car.uuid,))
+            for token in bad:
+                with self.subTest(name=name, cursor=token):
+                    response = self.client.get(url, {'cursor': token})
+                    self.assertEqual(404, response.status_code)
+
+        url = reverse('api-car-gas-purchases', args=(self.car.uuid,))
+        for token in bad:
+            with self.subTest(cursor=token):
+                response = self.client.get(url, {'cursor': token})
+                self.assertEqual(400, response.status_code)
+                self.assertIn('error', response.json())
+
+    def test_maintenance_description(self):
+        maintenance = self.car.maintenance_set.first()
+        word = maintenance.description.split()[0].upper()
+        url = reverse('car-maintenances', args=(self.car.uuid,))
+        response = self.client.get(url, {'description': word})
+        expected = [
+            m for m in self.car.maintenance_set.all()
+            if word.lower() in m.description.lower()
+        ]
+        self.assertEqual(len(expected), response.context['subtotals']['count'])
+        self.assertEqual(
+            sum(m.cost for m in expected),
+            response.context['subtotals']['cost'],
+        )
+
+    def test_reversed_range_is_an_error(self):
+        url = reverse('car-maintenances', args=(self.car.uuid,))
+        response = self.client.get(url, {
+            'min_odometer': 2000, 'max_odometer': 1000,
+        })
+        self.assertTrue(response.context['filter_form'].errors)
+        self.assertEqual(
+            self.car.maintenance_set.count(),
+            response.context['subtotals']['count'],
+        )
+
+
+class BulkEditTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('driver', password='password')
+        self.client.force_login(self.user)
+        self.car, self.other_car = seed_fleet(
+            owner=self.user, cars_per_user=2, years=0.5, seed=1,
+        )
+        self.url = reverse('car-gas-purchases-bulk', args=(self.car.uuid,))
+        self.selected = [
+            p.uuid for p in self.car.gaspurchase_set.all()[3:8]
+        ]
+
+    def assert_derived_data_is_current(self):
+        for car in (self.car, self.other_car):
+            stats = CarStats.objects.get(car=car)
+            expected = Car.objects.with_stats().get(pk=car.pk)
+            self.assertEqual(expected.operating_cost, stats.operating_cost)
+            self.assertEqual(expected.average_mpg, stats.average_mpg)
+            for purchase in car.gaspurchase_set.select_related('tank_segment'):
+                cached = purchase.tank_mpg
+                del purchase._state.fields_cache['tank_segment']
+                if cached is None:
+                    self.assertIsNone(purchase.tank_mpg)
+                else:
+                    self.assertAlmostEqual(
+                        float(purchase.tank_mpg), float(cached), places=5,
+                    )
+
+    def post(self, **data):
+        return self.client.post(self.url, {'purchases': self.selected, **data})
+
+    def test_move_recomputes_once(self):
+        with mock.patch.object(CarStats, 'update_for') as update_for, \
+                mock.patch.object(
+                    recompute, 'recompute_cars', wraps=recompute.recompute_cars,
+                ) as recompute_cars:
+            response = self.post(action='move', vehicle=self.other_car.uuid)
+        self.assertEqual(302, response.status_code)
+        update_for.assert_not_called()
+        recompute_cars.assert_called_once_with(
+            {self.car.pk, self.other_car.pk},
+        )
+        self.assertEqual(
+            5, self.other_car.gaspurchase_set.filter(
+                uuid__in=self.selected,
+            ).count(),
+        )
+        self.assert_derived_data_is_current()
+
+    def test_shift_and_delete(self):
+        before = {
+            p.uuid: p.odometer_reading
+            for p in GasPurchase.objects.filter(uuid__in=self.selected)
+        }
+        self.post(action='shift', odometer_offset=-3)
+        for purchase in GasPurchase.objects.filter(uuid__in=self.selected):
+            self.assertEqual(
+                before[purchase.uuid] - 3, purchase.odometer_reading,
+            )
+        self.assert_derived_data_is_current()
+
+        self.post(action='delete')
+        self.assertFalse(GasPurchase.objects.filter(uuid__in=self.selected))
+        self.assertFalse(TankSegment.objects.filter(end__in=self.selected))
+        self.assert_derived_data_is_current()
+
+    def test_other_users_purchases_are_rejected(self):
+        other = User.objects.create_user('other', password='password')
+        theirs, = seed_fleet(owner=other, years=0.1, seed=2)
+        self.selected.append(theirs.gaspurchase_set.first().uuid)
+        response = self.post(action='delete')
+        self.assertEqual(200, response.status_code)
+        self.assertIn('purchases', response.context['form'].errors)
+        self.assertEqual(
+            len(self.selected) - 1,
+            GasPurchase.objects.filter(uuid__in=self.selected[:-1]).count(),
+        )
+
+    def test_admin_actions(self):
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password',
+        )
+        self.client.force_login(admin)
+        url = reverse('admin:gas_gaspurchase_changelist')
+        response = self.client.post(url, {
+            'action': 'move_to_vehicle',
+            'vehicle': self.other_car.uuid,
+            '_selected_action': self.selected,
+        })
+        self.assertEqual(302, response.status_code)
+        self.assertEqual(
+            5, self.other_car.gaspurchase_set.filter(
+                uuid__in=self.selected,
+            ).count(),
+        )
+        self.assert_derived_data_is_current()
+
+    def test_admin_shift_cannot_go_below_zero(self):
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password',
+        )
+        self.client.force_login(admin)
+        selected = GasPurchase.objects.filter(uuid__in=self.selected)
+        before = dict(selected.values_list('uuid', 'odometer_reading'))
+        lowest = min(before.values())
+        response = self.client.post(
+            reverse('admin:gas_gaspurchase_changelist'), {
+                'action': 'shift_odometer',
+                'odometer_offset': -lowest - 1,
+                '_selected_action': self.selected,
+            }, follow=True,
+        )
+        self.assertIn(
+            "Odometer readings cannot become negative.",
+            [str(message) for message in response.context['messages']],
+        )
+        self.assertEqual(
+            before, dict(selected.values_list('uuid', 'odometer_reading')),
+        )
+
+
+class ArchiveHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('driver', password='password')
+        self.client.force_login(self.user)
+        self.car, = seed_fleet(owner=self.user, years=3, seed=1)
+
+    def archive(self, *args):
+        out = io.StringIO()
+        call_command('archive_history', '--older-than', '1', *args, stdout=out)
+        return out.getvalue()
+
+    def purchase_pages(self):
+        url = reverse('car-gas-purchases', args=(self.car.uuid,))
+        uuids, params = [], {}
+        while True:
+            response = self.client.get(url, params)
+            page = response.context['page_obj']
+            uuids += [purchase.uuid for purchase in page]
+            if not page.has_next():
+                return uuids, response.context['subtotals']
+            params = {'cursor': page.next_cursor}
+
+    def export(self):
+        response = self.client.get(
+            reverse('car-export-csv', args=(self.car.uuid,)),
+        )
+        content = b''.join(response.streaming_content).decode()
+        return [
+            (row['type'], row['odometer_reading'], row['datetime'][:10],
+             row['tank_mpg'] and round(float(row['tank_mpg']), 3))
+            for row in csv.DictReader(io.StringIO(content))
+        ]
+
+    def rollups(self):
+        return self.client.get(
+            reverse('api-car-rollups', args=(self.car.uuid,)),
+        ).json()
+
+    def test_full_history_is_still_seen(self):
+        stats = CarStats.objects.get(car=self.car)
+        pages, export, rollups = (
+            self.purchase_pages(), self.export(), self.rollups(),
+        )
+
+        self.assertIn("Archived", self.archive())
+        before = archive.archive_cutoff(1)
+        self.assertFalse(GasPurchase.objects.filter(
+            vehicle=self.car, datetime__lt=before,
+        ).exists())
+        self.assertFalse(Maintenance.objects.filter(
+            vehicle=self.car, datetime__lt=before.date(),
+        ).exists())
+        self.assertTrue(
+            ArchivedGasPurchase.objects.filter(vehicle=self.car).exists(),
+        )
+        self.assertTrue(
+            ArchivedMaintenance.objects.filter(vehicle=self.car).exists(),
+        )
+
+        archived_stats = CarStats.objects.get(car=self.car)
+        self.assertEqual(stats.operating_cost, archived_stats.operating_cost)
+        self.assertEqual(stats.average_mpg, archived_stats.average_mpg)
+        self.assertEqual(stats.fill_count, archived_stats.fill_count)
+        self.assertEqual(pages, self.purchase_pages())
+        self.assertEqual(export, self.export())
+        self.assertEqual(rollups, self.rollups())
+
+        # Archiving again finds nothing more to do.
+        self.assertIn("Archived 0 gas purchase(s) and 0", self.archive())
+        self.assertEqual(pages, self.purchase_pages())
+
+    def test_archive_costs_one_query_per_page(self):
+        self.archive()
+        cache.clear()
+        budget = QueryBudgetTests.budgets['car-gas-purchases']
+        with self.assertNumQueries(budget + 1):
+            response = self.client.get(
+                reverse('car-gas-purchases', args=(self.car.uuid,)),
+                {'start_date': '2000-01-01'},
+            )
+        self.assertEqual(200, response.status_code)
+
+    def test_orphans_are_archived(self):
+        other, = seed_fleet(owner=self.user, years=0.1, seed=2)
+        purchases = other.gaspurchase_set.count()
+        other.delete()
+        self.archive(str(self.car.uuid))
+        self.assertFalse(
+            GasPurchase.objects.filter(vehicle__isnull=True).exists(),
+        )
+        self.assertEqual(purchases, ArchivedGasPurchase.objects.filter(
+            vehicle__isnull=True,
+        ).count())
+
+    def test_only_years_that_are_over(self):
+        with self.assertRaises(CommandError):
+            call_command('archive_history', '--older-than', '0')
+
+
+class OdometerValidationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('driver', password='password')
+        self.client.force_login(self.user)
+        self.car, = seed_fleet(owner=self.user, years=0.5, seed=1)
+        self.purchases = list(self.car.gaspurchase_set.order_by('datetime'))
+
+    def form_data(self, purchase, **data):
+        return {
+            'vehicle': self.car.uuid,
+            'datetime': timezone.localtime(
+                purchase.datetime,
+            ).strftime('%Y-%m-%d %H:%M:%S'),
+            'odometer_reading': purchase.odometer_reading,
+            'gallons': purchase.gallons,
+            'cost_per_gallon': purchase.cost_per_gallon,
+            **data,
+        }
+
+    def audit(self, *args):
+        out = io.StringIO()
+        call_command('audit_odometers', *args, stdout=out)
+        return out.getvalue()
+
+    def test_new_purchase_must_follow_the_previous_reading(self):
+        last = self.purchases[-1]
+        data = self.form_data(
+            last, datetime=timezone.localtime(
+                last.datetime + datetime.timedelta(days=7),
+            ).strftime('%Y-%m-%d %H:%M:%S'),
+        )
+        url = reverse('add-purchase')
+
+        response = self.client.post(
+            url, {**data, 'odometer_reading': last.odometer_reading - 1},
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertIn('odometer_reading', response.context['form'].errors)
+
+        response = self.client.post(
+            url, {**data, 'odometer_reading': last.odometer_reading + 300},
+        )
+        self.assertEqual(302, response.status_code)
+
+    def test_update_must_precede_the_next_reading(self):
+        purchase, following = self.purchases[3:5]
+        url = reverse(
+            'gas-purchase-update', args=(self.car.uuid, purchase.uuid),
+        )
+        response = self.client.post(url, self.form_data(
+            purchase, odometer_reading=following.odometer_reading + 1,
+        ))
+        self.assertEqual(200, response.status_code)
+        self.assertIn('odometer_reading', response.context['form'].errors)
+
+        # Saving it unchanged compares it with its neighbours, not itself.
+        response = self.client.post(url, self.form_data(purchase))
+        self.assertEqual(302, response.status_code)
+
+    def test_validation_costs_two_queries(self):
+        purchase = self.purchases[3]
+        with self.assertNumQueries(2):
+            purchase.clean()
+
+    def test_audit_reports_anomalies(self):
+        self.assertIn("Found 0 anomaly(ies) in 1 car(s).", self.audit())
+
+        regression, duplicate, spike = (
+            self.purchases[3], self.purchases[6], self.purchases[9],
+        )
+        GasPurchase.objects.filter(pk=regression.pk).update(
+            odometer_reading=self.purchases[2].odometer_reading - 10,
+        )
+        GasPurchase.objects.filter(pk=duplicate.pk).update(
+            odometer_reading=self.purchases[5].odometer_reading,
+        )
+        GasPurchase.objects.filter(pk=spike.pk).update(gallons=Decimal('0.5'))
+
+        output = self.audit(str(self.car.uuid))
+        self.assertIn(f"{regression.uuid} regression", output)
+        self.assertIn(f"{duplicate.uuid} duplicate", output)
+        self.assertIn(f"{spike.uuid} mpg", output)
+        self.assertIn("in 1 car(s).", output)
+
+
+class HistoryAdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password',
+        )
+        self.client.force_login(self.admin)
+        self.url = reverse('admin:gas_gaspurchase_changelist')
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        car, = seed_fleet(owner=self.admin, years=0.1, seed=1)
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(200, self.client.get(self.url).status_code)
+
+        seed_fleet(owner=self.admin, cars_per_user=3, years=1, seed=2)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(self.url)
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(25, len(response.context['cl'].result_list))
+
+    def test_search_matches_whole_values(self):
+        car, = seed_fleet(owner=self.admin, years=0.2, seed=1)
+        purchase = car.gaspurchase_set.order_by('odometer_reading')[3]
+
+        response = self.client.get(self.url, {'q': str(purchase.uuid)})
+        self.assertEqual([purchase], list(response.context['cl'].result_list))
+
+        response = self.client.get(
+            self.url, {'q': str(purchase.odometer_reading)},
+        )
+        self.assertEqual([purchase], list(response.context['cl'].result_list))
+
+        response = self.client.get(
+            self.url, {'q': str(purchase.odometer_reading)[:-1]},
+        )
+        self.assertNotIn(purchase, response.context['cl'].result_list)
+        response = self.client.get(self.url, {'q': 'honda'})
+        self.assertEqual([], list(response.context['cl'].result_list))
+
+    def test_total_cost_is_annotated(self):
+        car, = seed_fleet(owner=self.admin, years=0.1, seed=1)
+        purchase = GasPurchaseAdmin(GasPurchase, None).get_queryset(
+            mock.Mock(),
+        ).get(pk=car.gaspurchase_set.first().pk)
+        self.assertEqual(
+            purchase.gallons * purchase.cost_per_gallon,
+            purchase.total_cost_value,
+        )
+
+    def test_paginator_counts_exactly_without_estimates(self):
+        seed_fleet(owner=self.admin, years=0.1, seed=1)
+        paginator = EstimatedCountPaginator(GasPurchase.objects.all(), 25)
+        self.assertEqual(GasPurchase.objects.count(), paginator.count)
+
+
+@override_settings(GAS_RECOMPUTE_MODE='queue')
+class RecomputeQueueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('driver', password='password')
+        with override_settings(GAS_RECOMPUTE_MODE='sync'):
+            self.car, = seed_fleet(owner=self.user, years=0.2, seed=1)
+        self.last = self.car.gaspurchase_set.first()
+
+    def add_purchases(self, count):
+        for i in range(1, count + 1):
+            GasPurchase.objects.create(
+                vehicle=self.car,
+                datetime=self.last.datetime + datetime.timedelta(days=7 * i),
+                gallons=Decimal('10.000'),
+                cost_per_gallon=Decimal('3.000'),
+                odometer_reading=self.last.odometer_reading + 300 * i,
+            )
+
+    def test_writes_are_coalesced(self):
+        fill_count = self.car.stats.fill_count
+        self.add_purchases(5)
+        self.assertEqual(1, RecomputeJob.objects.filter(car=self.car).count())
+        self.car.stats.refresh_from_db()
+        self.assertEqual(fill_count, self.car.stats.fill_count)
+
+        self.assertEqual(1, jobs.run_pending())
+        self.assertFalse(RecomputeJob.objects.exists())
+        self.car.stats.refresh_from_db()
+        self.assertEqual(fill_count + 5, self.car.stats.fill_count)
+        self.assertAlmostEqual(
+            30.0, float(self.last.tank_segment.mpg), places=3,
+        )
+
+    def test_writes_while_running_queue_another_job(self):
+        self.add_purchases(1)
+        running = jobs.claim()
+        self.add_purchases(1)
+        # The second job waits for the first one's car to be finished.
+        self.assertIsNone(jobs.claim())
+        jobs.run_job(running)
+        self.assertEqual(1, jobs.run_pending())
+
+    @skipUnlessDBFeature(
+        'has_select_for_update_skip_locked', 'has_select_for_update_of',
+    )
+    def test_claims_lock_the_car(self):
+        self.add_purchases(1)
+        with CaptureQueriesContext(connection) as queries:
+            jobs.claim()
+        locked = [
+            query['sql'].split('FOR UPDATE OF', 1)[1] for query in queries
+            if 'FOR UPDATE OF' in query['sql']
+        ]
+        self.assertIn(
+            connection.ops.quote_name(Car._meta.db_table), locked[0],
+        )
+
+    def test_stale_jobs_are_claimed_again(self):
+        self.add_purchases(1)
+        job = jobs.claim()
+        later = job.claimed_at + jobs.STALE_AFTER + datetime.timedelta(1)
+        self.assertEqual(job, jobs.claim(now=later))
+
+
+class TimezoneTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('driver', password='password')
+        self.url = reverse('set-timezone')
+
+    def current_timezone(self):
+        content = self.client.get(self.url).content.decode()
+        return re.search(r'<option value="([^"]+)" selected>', content)[1]
+
+    def test_anonymous_choice_needs_no_queries(self):
+        response = self.client.post(self.url, {'timezone': 'Asia/Tokyo'})
+        self.assertEqual(302, response.status_code)
+        with self.assertNumQueries(0):
+            self.assertEqual('Asia/Tokyo', self.current_timezone())
+        self.assertIs(
+            timezones.get_timezone('Asia/Tokyo'),
+            timezones.get_timezone('Asia/Tokyo'),
+        )
+
+    def test_choice_is_kept_on_the_user(self):
+        self.client.force_login(self.user)
+        self.client.post(self.url, {'timezone': 'Europe/Paris'})
+        self.user.refresh_from_db()
+        self.assertEqual('Europe/Paris', self.user.timezone)
+
+        self.client.post(reverse('logout'))
+        self.assertEqual('UTC', self.current_timezone())
+        self.client.post(
+            reverse('login'), {'username': 'driver', 'password': 'password'},
+        )
+        self.assertEqual('Europe/Paris', self.current_timezone())
+
+    def test_unknown_timezones_are_rejected(self):
+        for data in ({'timezone': 'Mars/Olympus_Mons'}, {}):
+            response = self.client.post(self.url, data)
+            self.assertEqual(400, response.status_code)
+        self.assertNotIn(timezones.COOKIE_NAME, self.client.cookies)
+
+    def test_tampered_cookies_are_ignored(self):
+        self.client.cookies[timezones.COOKIE_NAME] = 'Asia/Tokyo'
+        self.assertEqual('UTC', self.current_timezone())
+
+
+@override_settings(GAS_QUERY_METRICS=True)
+class QueryMetricsMiddlewareTests(TestCase):
+    def test_metrics_headers(self):
+        user = User.objects.create_user('driver', password='password')
+        self.client.force_login(user)
+        response = self.client.get(reverse('cars'))
+        self.assertEqual('2', response['X-Query-Count'])
+        self.assertGreater(float(response['X-Query-Time']), 0)
+        self.assertIn('X-Render-Time', response)
+
+
+@override_settings(GAS_DB_REPLICA='replica', GAS_DB_REPLICA_STICKINESS=15)
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.router = ReplicaRouter()
+        self.middleware = ReplicaMiddleware(self.read_database)
+
+    def read_database(self, request):
+        return HttpResponse(self.router.db_for_read(Car) or 'default')
+
+    def test_safe_requests_read_from_the_replica(self):
+        response = self.middleware(self.factory.get('/'))
+        self.assertEqual(b'replica', response.content)
+        self.assertNotIn(ReplicaMiddleware.cookie_name, response.cookies)
+        # Outside of requests, such as in commands and the worker.
+        self.assertIsNone(self.router.db_for_read(Car))
+
+    def test_writers_read_their_writes(self):
+        response = self.middleware(self.factory.post('/'))
+        self.assertEqual(b'default', response.content)
+        cookie = response.cookies[ReplicaMiddleware.cookie_name]
+        self.assertEqual(15, cookie['max-age'])
+
+        request = self.factory.get('/')
+        request.COOKIES[ReplicaMiddleware.cookie_name] = cookie.value
+        self.assertEqual(b'default', self.middleware(request).content)
+
+    def test_transactions_read_from_the_default_database(self):
+        with mock.patch.object(connections['default'], 'in_atomic_block',
+                               True):
+            response = self.middleware(self.factory.get('/'))
+        self.assertEqual(b'default', response.content)
+
+    def test_replica_is_not_migrated(self):
+        self.assertIs(False, self.router.allow_migrate('replica', 'gas'))
+        self.assertIsNone(self.router.allow_migrate('default', 'gas'))
+        self.assertEqual('default', self.router.db_for_write(Car))
+
+    @override_settings(GAS_DB_REPLICA=None)
+    def test_without_a_replica(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaMiddleware(self.read_database)
+        with replica_reads():
+            self.assertIsNone(self.router.db_for_read(Car))
+
+
+# Threads only see what has been committed, and reads are only routed to the
+# replica outside of transactions, so these are transaction tests.
+@override_settings(GAS_DB_REPLICA='replica')
+class LaggingReplicaTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user('driver', password='password')
+        self.car, = seed_fleet(owner=user, years=0.1, seed=1)
+        self.stale = CarStats.objects.get(car=self.car)
+        last = self.car.gaspurchase_set.order_by('odometer_reading').last()
+        GasPurchase.objects.create(
+            vehicle=self.car,
+            datetime=last.datetime + datetime.timedelta(days=7),
+            gallons=Decimal('10.000'),
+            cost_per_gallon=Decimal('3.000'),
+            odometer_reading=last.odometer_reading + 300,
+        )
+
+    def test_cache_is_not_filled_from_the_replica(self):
+        in_bulk = QuerySet.in_bulk
+
+        def lagging_in_bulk(queryset, *args, **kwargs):
+            # The replica has not yet seen the new purchase.
+            if queryset.db == 'replica':
+                return {self.stale.pk: self.stale}
+            return in_bulk(queryset, *args, **kwargs)
+
+        reader, writer = list(Car.objects.all()), list(Car.objects.all())
+        with mock.patch.object(QuerySet, 'in_bulk', lagging_in_bulk), \
+                replica_reads():
+            attach_car_stats(reader)
+        attach_car_stats(writer)
+        for car in (*reader, *writer):
+            self.assertEqual(self.stale.fill_count + 1, car.stats.fill_count)
+
+    def test_rebuilds_read_from_the_default_database(self):
+        CarStats.objects.all().delete()
+        # The replica alias does not exist, so any read from it would fail.
+        with replica_reads():
+            stats, = CarStats.objects.rebuild(
+                Car.objects.filter(pk=self.car.pk),
+            )
+        self.assertEqual(self.stale.fill_count + 1, stats.fill_count)
+        self.assertEqual(
+            stats.fill_count, CarStats.objects.get(car=self.car).fill_count,
+        )
+
+
+async def afetch(client, url, **extra):
+    response = await client.get(url, **extra)
+    if response.streaming:
+        response.body = b''.join([
+            chunk async for chunk in response.streaming_content
+        ])
+    else:
+        response.body = response.content
+    return response
+
+
+# Threads only see what has been committed, so these are transaction tests.
+@override_settings(ROOT_URLCONF='gastracker.async_urls')
+class AsyncViewTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('driver', password='password')
+        self.car, _ = seed_fleet(
+            owner=self.user, cars_per_user=2, years=0.5, seed=1,
+        )
+        self.client.force_login(self.user)
+        self.async_client = AsyncClient()
+        self.async_client.cookies = self.client.cookies
+
+    def async_get(self, url, **extra):
+        return async_to_sync(afetch)(self.async_client, url, **extra)
+
+    def test_responses_match_sync_views(self):
+        def body(response):
+            return re.sub(rb'value="[^"]+"', b'', response.body)
+
+        for name, url in route_urls(self.car):
+            if name not in async_urls.ASYNC_VIEWS:
+                continue
+            with override_settings(ROOT_URLCONF='gastracker.urls'):
+                expected = self.client.get(url)
+            expected.body = (
+                b''.join(expected.streaming_content)
+                if expected.streaming else expected.content
+            )
+            with mock.patch.object(
+                async_views.CarHistoryExportView, 'batch_size', 7,
+            ):
+                response = self.async_get(url)
+            with self.subTest(name):
+                self.assertEqual(200, response.status_code)
+                self.assertEqual(body(expected), body(response))
+
+    def test_conditional_requests(self):
+        url = reverse('car-detail', args=(self.car.uuid,))
+        response = self.async_get(url)
+        self.assertIn('private', response['Cache-Control'])
+        response = self.async_get(
+            url, headers={'If-None-Match': response['ETag']},
+        )
+        self.assertEqual(304, response.status_code)
+
+    def test_cached_fragments_are_not_loaded(self):
+        url = reverse('car-detail', args=(self.car.uuid,))
+        self.async_get(url)
+        with mock.patch.object(
+            views.CarDetailView, 'recent_purchases',
+        ) as recent_purchases, mock.patch.object(
+            views.CarDetailView, 'monthly_rollups',
+        ) as monthly_rollups:
+            self.assertEqual(200, self.async_get(url).status_code)
+        recent_purchases.assert_not_called()
+        monthly_rollups.assert_not_called()
+
+    def test_other_users_cars_are_not_found(self):
+        other = User.objects.create_user('other', password='password')
+        theirs, = seed_fleet(owner=other, years=0.1, seed=2)
+        for name in ('car-detail', 'car-gas-purchases', 'car-export-csv',
+                     'api-car-gas-purchases', 'api-car-rollups'):
+            with self.subTest(name):
+                response = self.async_get(reverse(name, args=(theirs.uuid,)))
+                self.assertEqual(404, response.status_code)
+
+    @override_settings(GAS_QUERY_METRICS=True)
+    def test_query_metrics_count_worker_threads(self):
+        # The middleware is only installed by handlers created from here on.
+        self.async_client = AsyncClient()
+        self.async_client.cookies = self.client.cookies
+        for name, args in (('car-detail', (self.car.uuid,)), ('fleet', ()),
+                           ('car-gas-purchases', (self.car.uuid,))):
+            url = reverse(name, args=args)
+            cache.clear()
+            with override_settings(ROOT_URLCONF='gastracker.urls'):
+                expected = int(self.client.get(url)['X-Query-Count'])
+            cache.clear()
+            with self.subTest(name):
+                # The async views may split a query the sync views join.
+                self.assertGreaterEqual(
+                    int(self.async_get(url)['X-Query-Count']), expected,
+                )
+
+    def test_anonymous_requests(self):
+        self.async_client.cookies.clear()
+        response = self.async_get(reverse('cars'))
+        self.assertEqual(302, response.status_code)
+        response = self.async_get(reverse('api-cars'))
+        self.assertEqual(403, response.status_code)
+
+    def test_server_benchmark(self):
+        results = list(benchmarks.compare_servers(
+            [0.1], clients=2, requests=2, routes=['car-detail', 'api-cars'],
+        ))
+        self.assertEqual(
+            ['wsgi', 'asgi'] * 2, [result['server'] for result in results],
+        )
+        self.assertEqual([0] * 4, [result['errors'] for result in results])
@@ -0,0 +1,61 @@
+"""
+The time zones users can choose from, and the signed cookie carrying a
+user's choice, which lets TimezoneMiddleware activate it without reading
+the session or the database.
+
+Signed in users' choices are also kept on the User, and copied back into
+the cookie whenever they log in (see gas.signals).
+"""
+import functools
+
+import pytz
+
+
+# In the order they are offered in.
+TIMEZONE_CHOICES = pytz.common_timezones
+TIMEZONES = frozenset(TIMEZONE_CHOICES)
+
+COOKIE_NAME = 'gas_timezone'
+COOKIE_SALT = 'gas.timezones'
+COOKIE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+@functools.lru_cache(maxsize=None)
+def get_timezone(name):
+    """
+    Returns the tzinfo for one of TIMEZONES.
+    """
+    return pytz.timezone(name)
+
+
+def read_cookie(request):
+    """
+    Returns the time zone named by the request's cookie, or None.
+    """
+    name = request.get_signed_cookie(COOKIE_NAME, None, salt=COOKIE_SALT)
+    return name if name in TIMEZONES else None
+
+
+def remember(request, name):
+    """
+    Has the cookie set to the time zone (or, for an empty name, deleted) on
+    the response to the request.
+    """
+    request.timezone_cookie = name
+
+
+def update_cookie(request, response):
+    if not hasattr(request, 'timezone_cookie'):
+        return response
+    if request.timezone_cookie:
+        response.set_signed_cookie(
+            COOKIE_NAME,
+            request.timezone_cookie,
+            salt=COOKIE_SALT,
+            max_age=COOKIE_MAX_AGE,
+            httponly=True,
+            samesite='Lax',
+        )
+    else:
+        response.delete_cookie(COOKIE_NAME, samesite='Lax')
+    return response
@@ -1,21 +1,32 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('', views.index, name='index'),
     path('cars', views.CarListView.as_view(), name='cars'),
+    path('fleet', views.FleetDashboardView.as_view(), name='fleet'),
     path('car/<uuid:uuid>/', views.CarDetailView.as_view(), name='car-detail'),
     path('car/<uuid:uuid>/update', views.CarUpdateView.as_view(), name='car-update'),
     path('car/<uuid:uuid>/delete', views.CarDeleteView.as_view(), name='car-delete'),
+    path('car/<uuid:uuid>/export.csv', views.CarHistoryExportView.as_view(format='csv'), name='car-export-csv'),
+    path('car/<uuid:uuid>/export.jsonl', views.CarHistoryExportView.as_view(format='jsonl'), name='car-export-jsonl'),
     path('car/<uuid:car_id>/gas-purchase/<uuid:gas_id>/update', views.GasPurchaseUpdateView.as_view(), name='gas-purchase-update'),
     path('car/<uuid:car_id>/gas-purchase/<uuid:gas_id>/delete', views.GasPurchaseDeleteView.as_view(), name='gas-purchase-delete'),
     path('car/<uuid:car_id>/maintenance/<uuid:maint_id>/update', views.MaintenanceUpdateView.as_view(), name='maintenance-update'),
     path('car/<uuid:car_id>/maintenance/<uuid:maint_id>/delete', views.MaintenanceDeleteView.as_view(), name='maintenance-delete'),
     path('car/<uuid:uuid>/gas-purchases', views.GasPurchaseListView.as_view(), name='car-gas-purchases'),
+    path('car/<uuid:uuid>/gas-purchases/bulk', views.GasPurchaseBulkView.as_view(), name='car-gas-purchases-bulk'),
     path('car/<uuid:uuid>/maintenances', views.MaintenanceListView.as_view(), name='car-maintenances'),
     path('add-purchase', views.NewPurchaseView.as_view(), name='add-purchase'),
     path('add-car', views.NewCarView.as_view(), name='add-car'),
     path('add-maintenance', views.NewMaintenanceView.as_view(), name='add-maintenance'),
+    path('import', views.ImportHistoryView.as_view(), name='import-history'),
     path('set-timezone', views.set_timezone, name='set-timezone'),
+    path('api/cars', api.CarListApiView.as_view(), name='api-cars'),
+    path('api/cars/<uuid:uuid>', api.CarApiView.as_view(), name='api-car'),
+    path('api/cars/<uuid:uuid>/gas-purchases', api.GasPurchaseListApiView.as_view(), name='api-car-gas-purchases'),
+    path('api/cars/<uuid:uuid>/maintenances', api.MaintenanceListApiView.as_view(), name='api-car-maintenances'),
+    path('api/cars/<uuid:uuid>/rollups', api.CarRollupApiView.as_view(), name='api-car-rollups'),
+    path('api/rollups', api.RollupApiView.as_view(), name='api-rollups'),
 ]
@@ -1,20 +1,19 @@
 import datetime
+import functools
+import io
 
-import pytz
-
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.views import View
 from django.shortcuts import (
     redirect,
     render,
     reverse,
-    get_object_or_404,
 )
 from django.core.exceptions import (
     ValidationError
 )
 from django.contrib.auth.mixins import (
     LoginRequiredMixin,
-    UserPassesTestMixin,
 )
 from django.views.generic.detail import DetailView
 from django.views.generic.edit import (
@@ -23,20 +22,45 @@ from django.views.generic.edit import (
     UpdateView,
     DeleteView,
 )
+from django.views.generic.base import TemplateView
 from django.views.generic.list import ListView
 from django.utils import (
     timezone,
 )
+from django.utils.functional import SimpleLazyObject
 
 from .models import (
+    ArchivedGasPurchase,
+    ArchivedMaintenance,
     Car,
     GasPurchase,
     Maintenance,
     User,
 )
 
+from . import timezones
+from .analytics import fleet_summary, rollups
+from .cache import attach_car_stats, attach_tank_mpgs
+from .exporters import export_response
 from .forms import (
+    GasPurchaseBulkForm,
+    GasPurchaseFilterForm,
     GasPurchaseForm,
+    ImportHistoryForm,
+    MaintenanceFilterForm,
+)
+from .mixins import (
+    CarConditionMixin,
+    HistoryFilterMixin,
+    OwnedCarMixin,
+    OwnedObjectMixin,
+    OwnedVehicleObjectMixin,
+)
+from .pagination import CursorPaginationMixin
+from .importers import (
+    HistoryImporter,
+    guess_format,
+    read_rows,
 )
 
 
@@ -46,10 +70,16 @@ def index(request):
 
 def set_timezone(request):
     if request.method == 'POST':
-        request.session['django_timezone'] = request.POST['timezone']
+        tzname = request.POST.get('timezone')
+        if tzname not in timezones.TIMEZONES:
+            return HttpResponseBadRequest("Unknown time zone.")
+        if request.user.is_authenticated:
+            request.user.timezone = tzname
+            request.user.save(update_fields=['timezone'])
+        timezones.remember(request, tzname)
         return redirect('/')
     else:
-        return render(request, 'gas/user_timezone.html', {'timezones': pytz.common_timezones})
+        return render(request, 'gas/user_timezone.html', {'timezones': timezones.TIMEZONE_CHOICES})
 
 
 ## CAR ##
@@ -61,25 +91,65 @@ class CarListView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         user = self.request.user
-        return Car.objects.filter(owner=user)
+        return attach_car_stats(Car.objects.filter(owner=user))
+
+
+class FleetDashboardView(LoginRequiredMixin, TemplateView):
+    template_name = 'gas/fleet_dashboard.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['rows'], context['totals'] = self.get_summary()
+        return context
 
+    def get_summary(self):
+        return fleet_summary(self.request.user)
 
-class CarDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
+
+class CarDetailView(CarConditionMixin, OwnedObjectMixin, DetailView):
     model = Car
     template_name = 'gas/car-detail.html'
-    raise_exception = False
-
-    def get_queryset(self):
-        return Car.objects.filter(owner=self.request.user)
+    pk_url_kwarg = 'uuid'
 
     def get_object(self, queryset=None):
-        if queryset is None:
-            queryset = self.get_queryset()
+        car = super().get_object(queryset)
+        attach_car_stats([car])
+        return car
+
+    # The recent history shown in each of the page's cached fragments, by
+    # the method loading it for a car's key.
+    fragments = {
+        'recent_purchases': 'car-recent-purchases',
+        'recent_maintenances': 'car-recent-maintenances',
+        'monthly_rollups': 'car-monthly-rollups',
+    }
+
+    def recent_purchases(self, car_id):
+        return attach_tank_mpgs(GasPurchase.objects.filter(vehicle=car_id)[:5])
+
+    def recent_maintenances(self, car_id):
+        return list(Maintenance.objects.filter(vehicle=car_id)[:5])
+
+    def monthly_rollups(self, car_id):
+        return rollups(
+            GasPurchase.objects.filter(vehicle=car_id), 'month', limit=12,
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Each only loaded when its fragment is not already cached.
+        for name in self.fragments:
+            context[name] = SimpleLazyObject(
+                functools.partial(getattr(self, name), self.object.pk),
+            )
+        return context
 
-        return get_object_or_404(Car, uuid=self.kwargs.get("uuid"))
 
-    def test_func(self):
-        return self.get_object().owner == self.request.user
+class CarHistoryExportView(OwnedCarMixin, View):
+    format = 'csv'
+
+    def get(self, request, *args, **kwargs):
+        return export_response(self.car, self.format)
 
 
 class NewCarView(LoginRequiredMixin, CreateView):
@@ -100,8 +170,9 @@ class NewCarView(LoginRequiredMixin, CreateView):
         return redirect(self.success_url)
 
 
-class CarUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class CarUpdateView(OwnedObjectMixin, UpdateView):
     model = Car
+    pk_url_kwarg = 'uuid'
     fields = [
         'make',
         'model',
@@ -110,50 +181,52 @@ class CarUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         'vin',
     ]
 
-    def get_object(self):
-        return get_object_or_404(Car, uuid=self.kwargs.get("uuid"))
-
     def get_success_url(self):
-        return reverse('car-detail', args=(self.get_object().uuid,))
+        return reverse('car-detail', args=(self.object.uuid,))
 
-    def test_func(self):
-        return self.get_object().owner == self.request.user
 
-
-class CarDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class CarDeleteView(OwnedObjectMixin, DeleteView):
     model = Car
-
-    def get_object(self, queryset=None):
-        return get_object_or_404(Car, uuid=self.kwargs.get("uuid"))
+    pk_url_kwarg = 'uuid'
 
     def get_success_url(self):
         return reverse('cars')
 
-    def test_func(self):
-        return self.get_object().owner == self.request.user
-
 
 ## GAS PURCHASE ##
 
 
-class GasPurchaseListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class GasPurchaseListView(CarConditionMixin, OwnedCarMixin,
+                          HistoryFilterMixin, CursorPaginationMixin, ListView):
     model = GasPurchase
+    archived_model = ArchivedGasPurchase
     template_name = 'gas/car_gas_list.html'
 
     paginate_by = 20
+    cursor_ordering = ['-odometer_reading', '-uuid']
+    filter_form_class = GasPurchaseFilterForm
+    shows_other_cars = True
+    subtotal_fields = ('count', 'gallons', 'cost')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['car'] = Car.objects.get(uuid=self.kwargs.get("uuid"))
+        context['bulk_form'] = GasPurchaseBulkForm(car=self.car)
         return context
 
     def get_queryset(self):
-        car = Car.objects.get(uuid=self.kwargs.get("uuid"))
-        return GasPurchase.objects.filter(vehicle=car)
+        return self.filter_queryset(
+            GasPurchase.objects.filter(vehicle=self.car),
+        )
 
-    def test_func(self):
-        car = Car.objects.get(uuid=self.kwargs.get("uuid"))
-        return car.owner == self.request.user
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page, object_list, is_paginated = (
+            super().paginate_queryset(queryset, page_size)
+        )
+        # Archived purchases have their tank MPG stored with them.
+        attach_tank_mpgs(
+            purchase for purchase in object_list if not purchase.archived
+        )
+        return paginator, page, object_list, is_paginated
 
 
 class NewPurchaseView(LoginRequiredMixin, CreateView):
@@ -189,8 +262,9 @@ class NewPurchaseView(LoginRequiredMixin, CreateView):
         return values
 
 
-class GasPurchaseUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class GasPurchaseUpdateView(OwnedVehicleObjectMixin, UpdateView):
     model = GasPurchase
+    pk_url_kwarg = 'gas_id'
     fields = [
         'vehicle',
         'datetime',
@@ -200,54 +274,58 @@ class GasPurchaseUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView)
     ]
 
     def get_form(self, *args, **kwargs):
+        user = self.request.user
         form = super().get_form(*args, **kwargs)
+        form.fields['vehicle'].queryset = Car.objects.filter(owner=user)
         form.fields['datetime'].label = "Date & time"
         return form
 
-    def get_object(self, queryset=None):
-        return get_object_or_404(GasPurchase, uuid=self.kwargs.get("gas_id"))
-
     def get_success_url(self):
-        return reverse('car-detail', args=(self.object.vehicle.uuid,))
-
-    def test_func(self):
-        return self.get_object().vehicle.owner == self.request.user
+        return reverse('car-detail', args=(self.object.vehicle_id,))
 
 
-class GasPurchaseDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class GasPurchaseDeleteView(OwnedVehicleObjectMixin, DeleteView):
     model = GasPurchase
-
-    def get_object(self, queryset=None):
-        return get_object_or_404(GasPurchase, uuid=self.kwargs.get("gas_id"))
+    pk_url_kwarg = 'gas_id'
 
     def get_success_url(self):
-        return reverse('car-detail', args=(self.object.vehicle.uuid,))
+        return reverse('car-detail', args=(self.object.vehicle_id,))
+
 
-    def test_func(self):
-        return self.get_object().vehicle.owner == self.request.user
+class GasPurchaseBulkView(OwnedCarMixin, FormView):
+    form_class = GasPurchaseBulkForm
+    template_name = 'gas/gaspurchase_bulk.html'
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['car'] = self.car
+        return kwargs
+
+    def get_initial(self):
+        return {'purchases': self.request.GET.getlist('purchases')}
+
+    def form_valid(self, form):
+        form.save()
+        return redirect('car-gas-purchases', self.car.uuid)
 
 
 ## MAINTENANCE ##
 
 
-class MaintenanceListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class MaintenanceListView(CarConditionMixin, OwnedCarMixin,
+                          HistoryFilterMixin, CursorPaginationMixin, ListView):
     model = Maintenance
+    archived_model = ArchivedMaintenance
     template_name = 'gas/car_maintenance_list.html'
 
     paginate_by = 20
-
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['car'] = Car.objects.get(uuid=self.kwargs.get("uuid"))
-        return context
+    cursor_ordering = ['odometer_reading', 'uuid']
+    filter_form_class = MaintenanceFilterForm
 
     def get_queryset(self):
-        car = Car.objects.get(uuid=self.kwargs.get("uuid"))
-        return Maintenance.objects.filter(vehicle=car)
-
-    def test_func(self):
-        car = Car.objects.get(uuid=self.kwargs.get("uuid"))
-        return car.owner == self.request.user
+        return self.filter_queryset(
+            Maintenance.objects.filter(vehicle=self.car),
+        )
 
 
 class NewMaintenanceView(LoginRequiredMixin, CreateView):
@@ -282,8 +360,9 @@ class NewMaintenanceView(LoginRequiredMixin, CreateView):
 
         return values
 
-class MaintenanceUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class MaintenanceUpdateView(OwnedVehicleObjectMixin, UpdateView):
     model = Maintenance
+    pk_url_kwarg = 'maint_id'
     fields = [
         'vehicle',
         'datetime',
@@ -293,30 +372,54 @@ class MaintenanceUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView)
     ]
 
     def get_form(self, *args, **kwargs):
+        user = self.request.user
         form = super().get_form(*args, **kwargs)
+        form.fields['vehicle'].queryset = Car.objects.filter(owner=user)
         form.fields['datetime'].label = "Date & time"
         return form
 
-    def get_object(self, queryset=None):
-        return get_object_or_404(Maintenance, uuid=self.kwargs.get("maint_id"))
+    def get_success_url(self):
+        return reverse('car-detail', args=(self.object.vehicle_id,))
+
+
+class MaintenanceDeleteView(OwnedVehicleObjectMixin, DeleteView):
+    model = Maintenance
+    pk_url_kwarg = 'maint_id'
 
     def get_success_url(self):
-        return reverse('car-detail', args=(self.object.vehicle.uuid,))
+        return reverse('car-detail', args=(self.object.vehicle_id,))
 
-    def test_func(self):
-        return self.get_object().vehicle.owner == self.request.user
 
+## IMPORT ##
 
-class MaintenanceDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
-    model = Maintenance
 
-    def get_object(self, queryset=None):
-        return get_object_or_404(Maintenance, uuid=self.kwargs.get("maint_id"))
+class ImportHistoryView(LoginRequiredMixin, FormView):
+    form_class = ImportHistoryForm
+    template_name = 'gas/import_history.html'
 
-    def get_success_url(self):
-        return reverse('car-detail', args=(self.object.vehicle.uuid,))
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user
+        return kwargs
 
-    def test_func(self):
-        return self.get_object().vehicle.owner == self.request.user
+    def get_initial(self):
+        values = {}
+        try:
+            car = Car.objects.get(uuid=self.request.GET.get("uuid"))
+            values['vehicle'] = car
+        except (Car.DoesNotExist, ValidationError):
+            pass
 
+        return values
 
+    def form_valid(self, form):
+        upload = form.cleaned_data['file']
+        importer = HistoryImporter(
+            form.cleaned_data['vehicle'],
+            form.cleaned_data['kind'],
+        )
+        lines = io.TextIOWrapper(upload.file, encoding='utf-8', newline='')
+        result = importer.run(read_rows(lines, guess_format(upload.name)))
+        return self.render_to_response(
+            self.get_context_data(form=form, result=result)
+        )
@@ -0,0 +1,17 @@
+"""
+ASGI config for gastracker project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Set GAS_ASYNC_VIEWS=1 to serve the read-heavy pages with async views.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gastracker.settings')
+
+application = get_asgi_application()
@@ -0,0 +1,14 @@
+"""gastracker URL Configuration for ASGI
+
+The same URLs as gastracker.urls, with the app's read-heavy views served by
+their async versions (see gas.async_urls). This is the ROOT_URLCONF when
+GAS_ASYNC_VIEWS is set.
+"""
+from django.contrib import admin
+from django.urls import include, path
+
+urlpatterns = [
+    path('admin/', admin.site.urls),
+    path('accounts/', include('django.contrib.auth.urls')),
+    path('', include('gas.async_urls')),
+]
@@ -43,7 +43,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'gas.middleware.QueryMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'gas.middleware.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -79,15 +81,76 @@ WSGI_APPLICATION = 'gastracker.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        # Set GAS_DB_ENGINE to django.db.backends.sqlite3 (with GAS_DB_NAME
+        # the path of the database file) to run without PostgreSQL.
+        'ENGINE': os.environ.get(
+            'GAS_DB_ENGINE', 'django.db.backends.postgresql',
+        ),
         'NAME': os.environ.get('GAS_DB_NAME', 'gas'),
         'USER': os.environ.get('GAS_DB_USER', 'gas_user'),
         'PASSWORD': os.environ.get('GAS_DB_PASS', 'password'),
         'HOST': os.environ.get('GAS_DB_HOST', 'localhost'),
         'PORT': os.environ.get('GAS_DB_PORT', '5432'),
+        # Connections are kept open between requests for this many seconds,
+        # and checked before being reused.
+        'CONN_MAX_AGE': int(os.environ.get('GAS_DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     },
 }
 
+# An optional read replica of the default database, configured by the same
+# variables prefixed GAS_DB_REPLICA_ (any that are unset are taken from the
+# default database). See gas.routers.
+if {'GAS_DB_REPLICA_NAME', 'GAS_DB_REPLICA_HOST'} & set(os.environ):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        **{
+            key: os.environ[f'GAS_DB_REPLICA_{variable}']
+            for key, variable in [
+                ('NAME', 'NAME'),
+                ('USER', 'USER'),
+                ('PASSWORD', 'PASS'),
+                ('HOST', 'HOST'),
+                ('PORT', 'PORT'),
+            ]
+            if f'GAS_DB_REPLICA_{variable}' in os.environ
+        },
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['gas.routers.ReplicaRouter']
+
+# The alias of the read replica, if there is one.
+GAS_DB_REPLICA = 'replica' if 'replica' in DATABASES else None
+
+# How long, in seconds, a client's reads stay on the default database after
+# it writes, so that it sees its own writes whatever the replica's lag.
+GAS_DB_REPLICA_STICKINESS = int(
+    os.environ.get('GAS_DB_REPLICA_STICKINESS', 15),
+)
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'GAS_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.environ.get('GAS_CACHE_LOCATION', ''),
+    },
+}
+
+# How long, in seconds, per-car summaries stay cached. Entries are keyed by
+# a version that changes on every write, so this only bounds memory use.
+GAS_CACHE_TIMEOUT = int(os.environ.get('GAS_CACHE_TIMEOUT', 24 * 60 * 60))
+
+# Sessions are read from the cache, and only from the database when the
+# cache does not have them.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -128,3 +191,18 @@ USE_TZ = True
 STATIC_URL = '/static/'
 LOGIN_REDIRECT_URL = '/'
 AUTH_USER_MODEL = 'gas.User'
+
+# Report the queries, SQL time and render time of each request in response
+# headers and the gas.metrics logger.
+GAS_QUERY_METRICS = os.environ.get('GAS_QUERY_METRICS', '') == '1'
+
+# Where the data derived from a car's history is recomputed after a write:
+# 'sync' does it in the request making the write, and 'queue' leaves it to
+# the run_gas_worker command.
+GAS_RECOMPUTE_MODE = os.environ.get('GAS_RECOMPUTE_MODE', 'sync')
+
+# Serve the read-heavy pages and the API with the async views in
+# gas.async_views. Only worthwhile when running under ASGI (asgi.py).
+GAS_ASYNC_VIEWS = os.environ.get('GAS_ASYNC_VIEWS', '') == '1'
+if GAS_ASYNC_VIEWS:
+    ROOT_URLCONF = 'gastracker.async_urls'